@@ -0,0 +1,59 @@
+"""asolr: asyncio flavour of the `app.solr` query helpers that run on the
+pooled Solr client with a limit on concurrent requests"""
+import asyncio
+import weakref
+from app import solr
+
+CONCURRENCY = solr.POOLSIZE
+SEMAPHORES = weakref.WeakKeyDictionary()
+
+def set_concurrency(n):
+    """set_concurrency: set the limit on concurrent Solr requests"""
+    global CONCURRENCY
+    CONCURRENCY = n
+    SEMAPHORES.clear()
+
+def get_semaphore():
+    """get_semaphore: return the concurrency semaphore for the running loop"""
+    this_loop = asyncio.get_running_loop()
+    if this_loop not in SEMAPHORES:
+        SEMAPHORES[this_loop] = asyncio.Semaphore(CONCURRENCY)
+    return SEMAPHORES[this_loop]
+
+async def run_limited(function, *rest, **kwargs):
+    """run_limited: run a blocking `app.solr` function in a worker thread once
+    a concurrency slot is free"""
+    async with get_semaphore():
+        return await asyncio.to_thread(function, *rest, **kwargs)
+
+async def get_query(name, search_str='*:*', sort='id asc', limitrows=False, nrows=10, **rest):
+    """get_query: return Solr query data for `solr` connection"""
+    return await run_limited(solr.get_query, name, search_str, sort, limitrows, nrows, **rest)
+
+async def get_frame(name, search_str='*:*', sort='id asc', pagesize=solr.PAGESIZE, columns=None, **rest):
+    """get_frame: return Solr query docs as a DataFrame"""
+    return await run_limited(solr.get_frame, name, search_str, sort, pagesize, columns, **rest)
+
+async def get_group(name, group_fl, search_str='*:*', ngroup=1024, sort='id asc', **rest):
+    """get_group: return Solr query grouped by group_fl data"""
+    return await run_limited(solr.get_group, name, group_fl, search_str, ngroup, sort, **rest)
+
+async def get_facet(name, facet_fl, search_str='*:*', nrows=0, ngroup=512, **rest):
+    """get_facet: return Solr facet grouped by facet_fl field"""
+    return await run_limited(solr.get_facet, name, facet_fl, search_str, nrows, ngroup, **rest)
+
+async def get_count(name, search_str='*:*', **rest):
+    """get_count: return Solr document count for name"""
+    return await run_limited(solr.get_count, name, search_str, **rest)
+
+async def gather(**queries):
+    """gather: await independent named query coroutines together and return
+    a dict of their results"""
+    these_results = await asyncio.gather(*queries.values())
+    return dict(zip(queries.keys(), these_results))
+
+def run_queries(**queries):
+    """run_queries: run independent named query coroutines concurrently from
+    synchronous code, for example
+    run_queries(counts=get_facet('PATH', 'TIPLOC'), names=get_frame('TR'))"""
+    return asyncio.run(gather(**queries))
@@ -0,0 +1,52 @@
+"""boundary: vectorised point in boundary masks using a prepared polygon read
+from an Osmosis `.poly` polygon filter file"""
+from functools import lru_cache
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+POLYFILE = 'data/great-britain.poly'
+
+def read_poly(filename):
+    """read_poly: return a shapely geometry for an Osmosis `.poly` file, where
+    sections with names starting `!` are holes in the polygon"""
+    with open(filename) as fin:
+        lines = [i.strip() for i in fin if i.strip()]
+    (outer, inner) = ([], [])
+    n = 1
+    while n < len(lines) and lines[n] != 'END':
+        this_name = lines[n]
+        n += 1
+        ring = []
+        while lines[n] != 'END':
+            ring.append(tuple(float(i) for i in lines[n].split()[:2]))
+            n += 1
+        n += 1
+        (inner if this_name.startswith('!') else outer).append(Polygon(ring))
+    geometry = shapely.union_all(outer)
+    if inner:
+        geometry = geometry.difference(shapely.union_all(inner))
+    return geometry
+
+@lru_cache(maxsize=8)
+def get_boundary(filename=POLYFILE):
+    """get_boundary: return the prepared boundary geometry for a `.poly` file"""
+    geometry = read_poly(filename)
+    shapely.prepare(geometry)
+    return geometry
+
+def contains(geometry, latitude, longitude):
+    """contains: return a boolean mask of the latitude and longitude arrays
+    inside geometry using a bounding box prefilter before the prepared
+    point in polygon test, missing coordinates are outside"""
+    x = np.asarray(longitude, dtype='float64')
+    y = np.asarray(latitude, dtype='float64')
+    (minx, miny, maxx, maxy) = geometry.bounds
+    mask = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+    if mask.any():
+        mask[mask] = shapely.contains_xy(geometry, x[mask], y[mask])
+    return mask
+
+def in_boundary(latitude, longitude, filename=POLYFILE):
+    """in_boundary: return a boolean mask of points inside the `.poly` boundary"""
+    return contains(get_boundary(filename), latitude, longitude)
@@ -0,0 +1,153 @@
+"""bplan: stream a BPLAN Geography gzip archive in one pass into typed Parquet
+tables for each record type"""
+import os
+import gzip
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BATCHSIZE = 65536
+BLOCKSIZE = 1 << 20
+DATE_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+RECORD_FIELDS = {
+    'PIF': ['Record type', 'File version', 'Source system', 'TOC ID', 'Timetable start date',
+            'Timetable end date', 'Cycle type', 'Cycle stage', 'Creation date', 'File sequence number'],
+    'REF': ['Record type', 'Action Code', 'Reference type', 'Reference', 'Description'],
+    'TLD': ['Record type', 'Action Code', 'Traction type', 'Trailing load', 'Speed', 'RA/Gauge',
+            'Description', 'ITPS power type', 'ITPS load', 'Limiting speed'],
+    'LOC': ['Record type', 'Action Code', 'Location Code', 'Location name', 'Start date', 'End date',
+            'Easting', 'Northing', 'Timing point type', 'Zone', 'STANOX code', 'Off-Network indicator',
+            'Force LPB'],
+    'PLT': ['Record type', 'Action Code', 'Location Code', 'Platform ID', 'Start date', 'End date',
+            'Length', 'Power supply type', 'DOO (passenger)', 'DOO (non-passenger)'],
+    'NWK': ['Record type', 'Action Code', 'Origin location', 'Destination location', 'Running line code',
+            'Running line description', 'Start date', 'End date', 'Initial direction', 'Final direction',
+            'Distance', 'DOO (passenger)', 'DOO (non-passenger)', 'RETB', 'Zone', 'Reversible line',
+            'Power supply type', 'RA', 'Maximum train length'],
+    'TLK': ['Record type', 'Action Code', 'Origin location', 'Destination location', 'Running line code',
+            'Traction type', 'Trailing load', 'Speed', 'RA/Gauge', 'Entry speed', 'Exit speed',
+            'Start date', 'End date', 'Sectional running time', 'Description'],
+    'PIT': ['Record type', 'REF count', 'TLD count', 'LOC count', 'PLT count', 'NWK count', 'TLK count'],
+}
+
+NUMERIC_FIELDS = {'Easting', 'Northing', 'Length', 'Distance', 'Maximum train length', 'Trailing load',
+                  'Speed', 'Entry speed', 'Exit speed', 'Limiting speed', 'ITPS load',
+                  'REF count', 'TLD count', 'LOC count', 'PLT count', 'NWK count', 'TLK count'}
+
+DATE_FIELDS = {'Start date', 'End date', 'Timetable start date', 'Timetable end date', 'Creation date'}
+
+def get_fields(record_type, width):
+    """get_fields: return the column names for a record type, naming columns
+    of unknown record types or extra columns by position"""
+    fields = RECORD_FIELDS.get(record_type, ['Record type'])
+    return fields + ['Field {}'.format(n) for n in range(len(fields), width)]
+
+def get_schema(fields):
+    """get_schema: return arrow schema with float, timestamp and string columns"""
+    def get_type(field):
+        if field in NUMERIC_FIELDS:
+            return pa.float64()
+        if field in DATE_FIELDS:
+            return pa.timestamp('s')
+        return pa.string()
+    return pa.schema([(i, get_type(i)) for i in fields])
+
+def get_table(rows, schema):
+    """get_table: return an arrow table of split rows typed by schema"""
+    fields = schema.names
+    this_df = pd.DataFrame([(i + [''] * len(fields))[:len(fields)] for i in rows], columns=fields)
+    this_df = this_df.apply(lambda v: v.str.strip()).replace('', None)
+    for field in fields:
+        if field in NUMERIC_FIELDS:
+            this_df[field] = pd.to_numeric(this_df[field], errors='coerce')
+        elif field in DATE_FIELDS:
+            this_df[field] = pd.to_datetime(this_df[field], format=DATE_FORMAT, errors='coerce')
+    return pa.Table.from_pandas(this_df, schema=schema, preserve_index=False)
+
+def get_checksum(filename, blocksize=BLOCKSIZE):
+    """get_checksum: return the sha256 digest of a file"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_outputfile(outputpath, record_type):
+    return os.path.join(outputpath, 'BPLAN-{}.parquet'.format(record_type))
+
+def get_statefile(outputpath):
+    return os.path.join(outputpath, 'BPLAN-checksum.json')
+
+def is_current(checksum, outputpath):
+    """is_current: return True when the archive checksum matches the one
+    recorded for the last conversion and all its tables exist"""
+    statefile = get_statefile(outputpath)
+    if not os.path.exists(statefile):
+        return False
+    with open(statefile) as fin:
+        state = json.load(fin)
+    if state.get('checksum') != checksum:
+        return False
+    return all(os.path.exists(get_outputfile(outputpath, i)) for i in state.get('records', {}))
+
+def split_records(filename, outputpath, batchsize=BATCHSIZE):
+    """split_records: stream the gzip archive once writing each record type to
+    its own Parquet table in batches of `batchsize` rows, returning the
+    number of records of each type
+
+    Known record types take their columns from RECORD_FIELDS and unknown ones
+    from their first row, a later row with more non-empty fields raises
+    ValueError rather than being truncated"""
+    (writers, batches, counts) = ({}, {}, {})
+
+    def flush(record_type):
+        table = get_table(batches[record_type], writers[record_type].schema)
+        writers[record_type].write_table(table)
+        batches[record_type] = []
+
+    try:
+        with gzip.open(filename, 'rt', encoding='utf-8', errors='replace', newline='') as fin:
+            for n, line in enumerate(fin, 1):
+                row = line.rstrip('\r\n').split('\t')
+                record_type = row[0].strip()
+                if not record_type:
+                    continue
+                if record_type not in writers:
+                    width = 0 if record_type in RECORD_FIELDS else len(row)
+                    schema = get_schema(get_fields(record_type, width))
+                    writers[record_type] = pq.ParquetWriter(get_outputfile(outputpath, record_type), schema, use_dictionary=True)
+                    (batches[record_type], counts[record_type]) = ([], 0)
+                width = len(writers[record_type].schema.names)
+                if len(row) > width and any(i.strip() for i in row[width:]):
+                    raise ValueError('line {}: {} record has {} fields, expected at most {}'
+                                     .format(n, record_type, len(row), width))
+                batches[record_type].append(row)
+                counts[record_type] += 1
+                if len(batches[record_type]) == batchsize:
+                    flush(record_type)
+        for record_type in RECORD_FIELDS:
+            if record_type not in writers:
+                schema = get_schema(get_fields(record_type, 0))
+                writers[record_type] = pq.ParquetWriter(get_outputfile(outputpath, record_type), schema)
+                (batches[record_type], counts[record_type]) = ([], 0)
+        for record_type, batch in batches.items():
+            if batch:
+                flush(record_type)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+def process_archive(filename, outputpath, force=False, batchsize=BATCHSIZE):
+    """process_archive: split the archive into Parquet tables unless it is
+    unchanged since the last run, returning the record counts or None if skipped"""
+    checksum = get_checksum(filename)
+    if not force and is_current(checksum, outputpath):
+        return None
+    counts = split_records(filename, outputpath, batchsize)
+    with open(get_statefile(outputpath), 'w') as fout:
+        json.dump({'checksum': checksum, 'records': counts}, fout, indent=1)
+    return counts
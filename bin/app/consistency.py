@@ -0,0 +1,60 @@
+"""consistency: vectorised cross-source agreement of candidate TIPLOC locations
+using pairwise great-circle distances between source positions"""
+import numpy as np
+import pandas as pd
+from app.coords import haversine
+
+SOURCES = ['FOI', 'BPLAN', 'NaPTAN', 'OSM']
+WARNING = 500.0
+ERROR = 5000.0
+
+def get_positions(candidates, sources=SOURCES):
+    """get_positions: return the TIPLOC index and aligned (TIPLOC, source)
+    latitude and longitude arrays of the first located candidate of each
+    source, with NaN where a source has no location"""
+    this_df = candidates[candidates['type'].isin(sources)]
+    this_df = this_df.dropna(subset=['TIPLOC', 'latitude', 'longitude'])
+    this_df = this_df.drop_duplicates(subset=['TIPLOC', 'type'])
+    (row, tiplocs) = pd.factorize(this_df['TIPLOC'], sort=True)
+    column = pd.Index(sources).get_indexer(this_df['type'])
+    latitude = np.full((len(tiplocs), len(sources)), np.nan)
+    longitude = np.full((len(tiplocs), len(sources)), np.nan)
+    latitude[row, column] = this_df['latitude'].to_numpy(dtype='float64')
+    longitude[row, column] = this_df['longitude'].to_numpy(dtype='float64')
+    return (pd.Index(tiplocs, name='TIPLOC'), latitude, longitude)
+
+def get_spread(latitude, longitude):
+    """get_spread: return the largest pairwise distance in metres between the
+    source positions of each row, NaN where fewer than two sources"""
+    (i, j) = np.triu_indices(latitude.shape[1], k=1)
+    distance = haversine(latitude[:, i], longitude[:, i], latitude[:, j], longitude[:, j])
+    found = ~np.isnan(distance)
+    return np.where(found.any(axis=1), np.where(found, distance, -np.inf).max(axis=1), np.nan)
+
+def get_deviation(latitude, longitude):
+    """get_deviation: return the distance in metres of each source position
+    from the per row median position of all sources"""
+    counts = (~np.isnan(latitude)).sum(axis=1, keepdims=True)
+    these_rows = counts[:, 0] > 0
+    (median_latitude, median_longitude) = (np.full(counts.shape, np.nan), np.full(counts.shape, np.nan))
+    median_latitude[these_rows] = np.nanmedian(latitude[these_rows], axis=1, keepdims=True)
+    median_longitude[these_rows] = np.nanmedian(longitude[these_rows], axis=1, keepdims=True)
+    return haversine(latitude, longitude, median_latitude, median_longitude)
+
+def check_sources(candidates, sources=SOURCES, warning=WARNING, error=ERROR):
+    """check_sources: return the source spread for each TIPLOC and the
+    discrepancies where the spread exceeds the warning threshold, with the
+    source furthest from the median position as the `outlier`"""
+    (tiplocs, latitude, longitude) = get_positions(candidates, sources)
+    spread = pd.Series(get_spread(latitude, longitude), index=tiplocs, name='spread')
+    deviation = get_deviation(latitude, longitude)
+    this_df = pd.DataFrame({'spread': spread.values,
+                            'sources': (~np.isnan(latitude)).sum(axis=1)}, index=tiplocs)
+    this_df['level'] = np.where(this_df['spread'] > error, 'error', 'warning')
+    this_df['outlier'] = np.asarray(sources, dtype='object')[np.nan_to_num(deviation, nan=-1.0).argmax(axis=1)]
+    for n, this_source in enumerate(sources):
+        this_df[this_source + '_latitude'] = latitude[:, n]
+        this_df[this_source + '_longitude'] = longitude[:, n]
+        this_df[this_source + '_distance'] = np.round(deviation[:, n], 1)
+    this_df = this_df[this_df['spread'] > warning].sort_values('spread', ascending=False).round({'spread': 1})
+    return (spread, this_df[['level', 'spread', 'sources', 'outlier'] + list(this_df.columns[4:])])
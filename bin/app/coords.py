@@ -0,0 +1,48 @@
+"""coords: vectorised centroid, rounding and `_location_` string helpers on
+whole latitude and longitude arrays"""
+import numpy as np
+import pandas as pd
+import shapely
+
+PRECISION = 6
+
+def trim(values, precision=PRECISION):
+    """trim: round an array of coordinates to `precision` decimal places"""
+    return np.round(np.asarray(values, dtype='float64'), precision)
+
+def get_centroids(geometry, precision=PRECISION):
+    """get_centroids: return rounded (latitude, longitude) arrays of the
+    centroids of a GeoSeries or array of shapely geometries"""
+    points = shapely.centroid(np.asarray(geometry))
+    return (trim(shapely.get_y(points), precision), trim(shapely.get_x(points), precision))
+
+def add_centroids(this_df, precision=PRECISION):
+    """add_centroids: add float latitude and longitude columns for the
+    `geometry` column of a GeoDataFrame"""
+    (this_df['latitude'], this_df['longitude']) = get_centroids(this_df['geometry'], precision)
+    return this_df
+
+def from_locationstr(this_series):
+    """from_locationstr: return a float latitude and longitude DataFrame from
+    a Series of "latitude,longitude" strings"""
+    this_df = this_series.str.split(',', n=1, expand=True).reindex(columns=[0, 1])
+    this_df = this_df.apply(pd.to_numeric, errors='coerce')
+    this_df.columns = ['latitude', 'longitude']
+    return this_df
+
+def to_locationstr(latitude, longitude):
+    """to_locationstr: return a Series of "latitude,longitude" strings from
+    latitude and longitude Series with null where either is missing"""
+    this_str = latitude.astype(str) + ',' + longitude.astype(str)
+    return this_str.where(latitude.notna() & longitude.notna())
+
+EARTH_RADIUS = 6371008.8
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """haversine: return great-circle distances in metres between arrays of
+    points in degrees"""
+    (phi1, lambda1, phi2, lambda2) = [np.radians(np.asarray(i, dtype='float64'))
+                                      for i in (latitude1, longitude1, latitude2, longitude2)]
+    this_a = np.sin((phi2 - phi1) / 2.0) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * np.sin((lambda2 - lambda1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(this_a, 0.0, 1.0)))
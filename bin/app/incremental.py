@@ -0,0 +1,120 @@
+"""incremental: per TIPLOC fingerprints of source candidate records and change
+logs between location reports for incremental TIPLOC resolution"""
+import os
+import json
+import hashlib
+import pandas as pd
+from app.coords import haversine
+
+FINGERPRINT_COLUMNS = ['TIPLOC', 'type', 'Description', 'latitude', 'longitude']
+REPORT_COLUMNS = ['type', 'Description', 'latitude', 'longitude']
+MOVED = 1.0
+
+def get_fingerprints(candidates):
+    """get_fingerprints: return Series of digests of the candidate records for
+    each TIPLOC independent of record order"""
+    this_df = candidates.reindex(columns=FINGERPRINT_COLUMNS).astype(str)
+    this_df['hash'] = pd.util.hash_pandas_object(this_df, index=False).values
+    this_df = this_df.sort_values(['TIPLOC', 'hash'])
+    return this_df.groupby('TIPLOC', sort=True)['hash'] \
+                  .agg(lambda v: hashlib.sha1(v.values.tobytes()).hexdigest())
+
+def get_digest(this_df):
+    """get_digest: return one digest of every candidate record of a source"""
+    this_hash = pd.util.hash_pandas_object(this_df.reindex(columns=FINGERPRINT_COLUMNS).astype(str), index=False)
+    return hashlib.sha1(this_hash.values.tobytes()).hexdigest()
+
+def get_source_fingerprints(sources, previous):
+    """get_source_fingerprints: return per source and TIPLOC fingerprints of
+    the `sources` dict of candidate frames, the source digests and the TIPLOCs
+    whose records changed since `previous`, a (fingerprints, digests) pair,
+    only fingerprinting the TIPLOCs of sources whose digest changed
+
+    With no `previous` fingerprints every TIPLOC is treated as changed and
+    the changed TIPLOCs are None"""
+    (previous_fingerprints, previous_digests) = previous or (pd.DataFrame(columns=['source', 'TIPLOC', 'fingerprint'], dtype='object'), {})
+    (these_fingerprints, digests, changed) = ([], {}, pd.Index([], name='TIPLOC'))
+    for name, this_df in sources.items():
+        digests[name] = get_digest(this_df)
+        this_previous = previous_fingerprints[previous_fingerprints['source'] == name].set_index('TIPLOC')['fingerprint']
+        if digests[name] == previous_digests.get(name):
+            these_fingerprints.append(this_previous.reset_index().assign(source=name))
+            continue
+        this_fingerprints = get_fingerprints(this_df.dropna(subset=['TIPLOC']))
+        changed = changed.union(get_changed(this_fingerprints, this_previous))
+        these_fingerprints.append(this_fingerprints.rename('fingerprint').rename_axis('TIPLOC')
+                                                   .reset_index().assign(source=name))
+    fingerprints = pd.concat(these_fingerprints, ignore_index=True)[['source', 'TIPLOC', 'fingerprint']]
+    return ((fingerprints, digests), None if previous is None else changed)
+
+def get_digestfile(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+def read_fingerprints(filename):
+    """read_fingerprints: return the previous per source fingerprints and
+    source digests or None if either file is missing or unreadable"""
+    try:
+        this_df = pd.read_csv(filename, sep='\t', dtype='object', keep_default_na=False)
+        with open(get_digestfile(filename)) as fin:
+            digests = json.load(fin)
+    except (OSError, ValueError):
+        return None
+    if not {'source', 'TIPLOC', 'fingerprint'} <= set(this_df.columns) or not isinstance(digests, dict):
+        return None
+    return (this_df, digests)
+
+def write_fingerprints(fingerprints, filename):
+    (this_df, digests) = fingerprints
+    this_df.to_csv(filename, sep='\t', index=False)
+    with open(get_digestfile(filename), 'w') as fout:
+        json.dump(digests, fout, indent=1, sort_keys=True)
+
+def read_candidates(filename):
+    """read_candidates: return a previous candidates audit file or None"""
+    if not os.path.exists(filename):
+        return None
+    return pd.read_csv(filename, sep='\t', dtype={'TIPLOC': 'object', 'type': 'object', 'Description': 'object'})
+
+def merge_candidates(previous, audit, tiplocs, resolved):
+    """merge_candidates: replace the rows of the `resolved` TIPLOCs in a
+    previous candidates audit with `audit`, keeping only rows for `tiplocs`"""
+    if previous is None:
+        return audit
+    previous = previous[previous['TIPLOC'].isin(tiplocs) & ~previous['TIPLOC'].isin(resolved)]
+    this_df = pd.concat([previous, audit], ignore_index=True)
+    return this_df.sort_values('TIPLOC', kind='stable').reset_index(drop=True)
+
+def read_report(filename):
+    """read_report: return a locations report indexed by TIPLOC with float
+    latitude and longitude or an empty frame if there is no report"""
+    if not os.path.exists(filename):
+        return pd.DataFrame(columns=REPORT_COLUMNS, index=pd.Index([], name='TIPLOC'))
+    this_df = pd.read_csv(filename, sep='\t', dtype='object', keep_default_na=False, index_col='TIPLOC')
+    this_df = this_df.reindex(columns=REPORT_COLUMNS).replace('', None)
+    this_df[['latitude', 'longitude']] = this_df[['latitude', 'longitude']].apply(pd.to_numeric, errors='coerce')
+    return this_df
+
+def get_changed(fingerprints, previous):
+    """get_changed: return the TIPLOCs whose candidate records were added,
+    removed or changed since the previous fingerprints"""
+    this_index = fingerprints.index.union(previous.index)
+    this_current = fingerprints.reindex(this_index).fillna('')
+    this_previous = previous.reindex(this_index).fillna('')
+    return this_index[this_current.values != this_previous.values]
+
+def get_changes(previous, current, moved=MOVED):
+    """get_changes: return the new, moved and lost locations between two
+    locations reports with the distance moved in metres"""
+    this_df = previous[REPORT_COLUMNS].join(current[REPORT_COLUMNS], how='outer', lsuffix='_before')
+    before = this_df['latitude_before'].notna() & this_df['longitude_before'].notna()
+    after = this_df['latitude'].notna() & this_df['longitude'].notna()
+    this_df['distance'] = haversine(this_df['latitude_before'], this_df['longitude_before'],
+                                    this_df['latitude'], this_df['longitude'])
+    this_df['change'] = None
+    this_df.loc[~before & after, 'change'] = 'new'
+    this_df.loc[before & ~after, 'change'] = 'lost'
+    this_df.loc[before & after & (this_df['distance'] > moved), 'change'] = 'moved'
+    this_df = this_df.dropna(subset=['change'])
+    this_df.index.name = 'TIPLOC'
+    return this_df[['change', 'type_before', 'type', 'Description',
+                    'latitude_before', 'longitude_before', 'latitude', 'longitude', 'distance']]
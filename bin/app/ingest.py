@@ -0,0 +1,45 @@
+"""ingest: read BPLAN and FOI easting and northing tables directly into float
+latitude and longitude frames with one batched OSGB36 to WGS84 transform"""
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from app.coords import trim
+from app.store import read_frame
+
+BPLANFILE = 'output/BPLAN-LOC.parquet'
+FOIFILE = 'output/TIPLOC_Eastings_and_Northings.xlsx'
+FOISHEET = 'TIPLOC'
+
+@lru_cache(maxsize=1)
+def get_transformer():
+    """get_transformer: return the EPSG:27700 to EPSG:4326 transformer in
+    easting, northing and longitude, latitude axis order"""
+    return Transformer.from_crs('EPSG:27700', 'EPSG:4326', always_xy=True)
+
+def to_wgs84(easting, northing):
+    """to_wgs84: return rounded (latitude, longitude) arrays for arrays of
+    OSGB36 eastings and northings, NaN where either is missing"""
+    x = pd.to_numeric(pd.Series(np.asarray(easting)), errors='coerce').to_numpy(dtype='float64')
+    y = pd.to_numeric(pd.Series(np.asarray(northing)), errors='coerce').to_numpy(dtype='float64')
+    (longitude, latitude) = get_transformer().transform(x, y)
+    mask = np.isnan(x) | np.isnan(y)
+    longitude = np.where(mask, np.nan, longitude)
+    latitude = np.where(mask, np.nan, latitude)
+    return (trim(latitude), trim(longitude))
+
+def add_wgs84(this_df, easting='Easting', northing='Northing'):
+    """add_wgs84: add float latitude and longitude columns from the easting
+    and northing columns of a DataFrame"""
+    (this_df['latitude'], this_df['longitude']) = to_wgs84(this_df[easting], this_df[northing])
+    return this_df
+
+def read_bplan(filename=BPLANFILE):
+    """read_bplan: return the BPLAN LOC records with latitude and longitude"""
+    this_df = read_frame(filename)
+    return add_wgs84(this_df, 'Easting', 'Northing')
+
+def read_foi(filename=FOIFILE):
+    """read_foi: return the FOI TIPLOC spreadsheet with latitude and longitude"""
+    this_df = pd.read_excel(filename, sheet_name=FOISHEET, dtype='object')
+    return add_wgs84(this_df, 'EASTING', 'NORTHING')
@@ -0,0 +1,257 @@
+"""instrument: per stage wall time, CPU time, peak memory, row counts and
+Solr request counts and latency written as JSON lines with a run summary and
+an optional per stage profiler"""
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import resource
+from threading import Event, Lock, Thread
+from contextlib import contextmanager
+
+OUTPUTFILE = os.environ.get('INSTRUMENT', '')
+PROFILER = os.environ.get('INSTRUMENT_PROFILE', '')
+PROFILEPATH = os.environ.get('INSTRUMENT_PROFILEPATH', 'output/profile')
+PERCENTILES = (50, 95, 99)
+SAMPLEINTERVAL = 0.05
+# Request latency histogram bucket upper bounds in seconds, 5% apart from
+# 0.1ms to about 200s
+BUCKETS = [0.0001 * 1.05 ** i for i in range(300)]
+LOCK = Lock()
+
+def get_script():
+    """get_script: return the name of the running script"""
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+
+def get_rss():
+    """get_rss: return the peak resident set size of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def get_current_rss():
+    """get_current_rss: return the current resident set size of this process
+    in MB, or the peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except (OSError, ValueError, IndexError):
+        return get_rss()
+
+class RSSSampler:
+    """RSSSampler: sample the resident set size in a daemon thread to find
+    the peak while a stage runs rather than the peak of the whole process"""
+    def __init__(self, interval=SAMPLEINTERVAL):
+        self.interval = interval
+        self.peak = get_current_rss()
+        self.done = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, get_current_rss())
+
+    def stop(self):
+        """stop: stop sampling and return the peak in MB"""
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, get_current_rss())
+        return self.peak
+
+def get_histogram_percentiles(counts, percentiles=PERCENTILES):
+    """get_histogram_percentiles: return nearest rank percentiles in
+    milliseconds from latency histogram counts as the bucket upper bounds"""
+    total = sum(counts)
+    if not total:
+        return {}
+    this_data = {}
+    for i in percentiles:
+        (rank, n) = (min(total - 1, total * i // 100), 0)
+        for bucket, count in zip(BUCKETS + [float('inf')], counts):
+            n += count
+            if n > rank:
+                break
+        this_data['p{}'.format(i)] = round(1000.0 * min(bucket, BUCKETS[-1]), 3)
+    return this_data
+
+def emit(record, outputfile=None):
+    """emit: write a record as a JSON line to the instrument file or stderr"""
+    outputfile = OUTPUTFILE if outputfile is None else outputfile
+    this_record = {'event': record.pop('event'), 'script': get_script(), 'pid': os.getpid(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **record}
+    this_line = json.dumps(this_record, default=str)
+    with LOCK:
+        if not outputfile or outputfile == '-':
+            print(this_line, file=sys.stderr, flush=True)
+            return
+        with open(outputfile, 'a') as fout:
+            fout.write(this_line + '\n')
+
+class Requests:
+    """Requests: thread safe count, error count and latency histogram of HTTP
+    requests, bounded in size however many requests a run makes"""
+    def __init__(self):
+        self.lock = Lock()
+        self.counts = [0] * (len(BUCKETS) + 1)
+        (self.n, self.seconds, self.errors, self.nbytes) = (0, 0.0, 0, 0)
+
+    def add(self, seconds, nbytes=0, error=False):
+        """add: record one request"""
+        with self.lock:
+            self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.n += 1
+            self.seconds += seconds
+            self.nbytes += nbytes
+            self.errors += int(error)
+
+    def get_mark(self):
+        """get_mark: return a position to summarise requests made after it"""
+        with self.lock:
+            return (self.n, self.errors, self.nbytes, self.seconds, list(self.counts))
+
+    def get_summary(self, mark=None):
+        """get_summary: return request count, errors, bytes and latency
+        percentiles since mark"""
+        with self.lock:
+            (n, errors, nbytes, seconds, counts) = mark or (0, 0, 0, 0.0, [0] * len(self.counts))
+            this_summary = {'requests': self.n - n, 'errors': self.errors - errors,
+                            'mb': round((self.nbytes - nbytes) / 1048576.0, 3)}
+            this_seconds = self.seconds - seconds
+            these_counts = [i - j for i, j in zip(self.counts, counts)]
+        if this_summary['requests']:
+            this_summary['seconds'] = round(this_seconds, 3)
+            this_summary.update(get_histogram_percentiles(these_counts))
+        return this_summary
+
+REQUESTS = Requests()
+
+def record_request(seconds, nbytes=0, error=False):
+    """record_request: record the latency of one Solr HTTP request"""
+    REQUESTS.add(seconds, nbytes, error)
+
+class Stage:
+    """Stage: row counts and named counters reported with a stage's timings"""
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.counts = {}
+
+    def count(self, key, value):
+        """count: set a named counter such as TIPLOCs resolved per source"""
+        self.counts[key] = value.item() if hasattr(value, 'item') else value
+
+    def update(self, values):
+        """update: set several named counters from a dict or Series"""
+        for k, v in dict(values).items():
+            self.count(k, v)
+
+    def iter_rows(self, records):
+        """iter_rows: yield records counting them as rows out"""
+        self.rows_out = self.rows_out or 0
+        for record in records:
+            self.rows_out += 1
+            yield record
+
+class Run:
+    """Run: the stages of this process for the run summary"""
+    def __init__(self):
+        self.start = time.monotonic()
+        self.cpu = time.process_time()
+        self.stages = []
+
+    def add(self, record):
+        self.stages.append({k: record[k] for k in ['stage', 'seconds', 'cpu', 'rows_out'] if k in record})
+
+    def get_summary(self):
+        """get_summary: return the run wall time, CPU time, peak memory,
+        stages and Solr requests"""
+        return {'event': 'summary',
+                'seconds': round(time.monotonic() - self.start, 3),
+                'cpu': round(time.process_time() - self.cpu, 3),
+                'peak_rss_mb': round(get_rss(), 1),
+                'stages': self.stages,
+                'solr': REQUESTS.get_summary()}
+
+RUN = Run()
+
+def write_summary():
+    """write_summary: emit the run summary once any stage or request is recorded"""
+    if RUN.stages or REQUESTS.get_mark()[0]:
+        emit(RUN.get_summary())
+
+atexit.register(write_summary)
+
+def get_profiler(profiler=PROFILER):
+    """get_profiler: return started (profiler, extension) for `cprofile` or
+    `pyinstrument`, or None when profiling is off"""
+    if not profiler:
+        return None
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        this_profiler = Profiler()
+        this_profiler.start()
+        return (this_profiler, 'html')
+    if profiler == 'cprofile':
+        import cProfile
+        this_profiler = cProfile.Profile()
+        this_profiler.enable()
+        return (this_profiler, 'prof')
+    raise ValueError('unknown profiler "{}", use cprofile or pyinstrument'.format(profiler))
+
+def write_profile(profiler, name, profilepath=PROFILEPATH):
+    """write_profile: stop the profiler and write it to the profile directory"""
+    (this_profiler, extension) = profiler
+    os.makedirs(profilepath, exist_ok=True)
+    filename = os.path.join(profilepath, '{}-{}.{}'.format(get_script(), name, extension))
+    if extension == 'html':
+        this_profiler.stop()
+        with open(filename, 'w') as fout:
+            fout.write(this_profiler.output_html())
+    else:
+        this_profiler.disable()
+        this_profiler.dump_stats(filename)
+    return filename
+
+@contextmanager
+def stage(name, rows_in=None):
+    """stage: time the enclosed block as a named stage, yielding a `Stage` to
+    record rows in and out and named counters, and emit a JSON line on exit"""
+    this_stage = Stage(name, rows_in)
+    this_mark = REQUESTS.get_mark()
+    this_profiler = get_profiler()
+    this_sampler = RSSSampler()
+    (this_start, this_cpu) = (time.monotonic(), time.process_time())
+    this_error = None
+    try:
+        yield this_stage
+    except BaseException as error:
+        this_error = error
+        raise
+    finally:
+        this_record = {'event': 'stage', 'stage': name,
+                       'seconds': round(time.monotonic() - this_start, 3),
+                       'cpu': round(time.process_time() - this_cpu, 3),
+                       'peak_rss_mb': round(this_sampler.stop(), 1)}
+        if this_stage.rows_in is not None:
+            this_record['rows_in'] = this_stage.rows_in
+        if this_stage.rows_out is not None:
+            this_record['rows_out'] = this_stage.rows_out
+            if this_record['seconds'] > 0:
+                this_record['rows/s'] = round(this_stage.rows_out / this_record['seconds'], 1)
+        if this_stage.counts:
+            this_record['counts'] = this_stage.counts
+        this_requests = REQUESTS.get_summary(this_mark)
+        if this_requests['requests']:
+            this_record['solr'] = this_requests
+        if this_profiler:
+            this_record['profile'] = write_profile(this_profiler, name)
+        if this_error is not None:
+            this_record['error'] = repr(this_error)
+        RUN.add(this_record)
+        emit(this_record)
+
+def event(name, **rest):
+    """event: emit a named progress event"""
+    emit({'event': name, **rest})
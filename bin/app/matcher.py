@@ -0,0 +1,138 @@
+"""matcher: blocked character n-gram name matching to propose candidate
+locations for TIPLOCs without a location"""
+import re
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from app.coords import haversine
+
+NGRAM = 3
+MAX_DF = 0.02
+MIN_SIMILARITY = 0.4
+TOPN = 5
+PREFIX_WEIGHT = 0.15
+NEIGHBOUR_WEIGHT = 0.25
+NEIGHBOUR_SCALE = 5000.0
+
+ABBREVIATIONS = {'C.E.': 'CIVIL ENGINEERS',
+                 'CE': 'CIVIL ENGINEERS',
+                 'SIG': 'SIGNAL',
+                 'SIGS': 'SIGNALS',
+                 'GF': 'GROUND FRAME',
+                 'JN': 'JUNCTION',
+                 'JCN': 'JUNCTION',
+                 'JUNC': 'JUNCTION',
+                 'SDG': 'SIDING',
+                 'SDGS': 'SIDINGS',
+                 'STN': 'STATION',
+                 'LC': 'LEVEL CROSSING',
+                 'DEP': 'DEPOT',
+                 'DPT': 'DEPOT',
+                 'TMD': 'TRACTION MAINTENANCE DEPOT',
+                 'YD': 'YARD',
+                 'HL': 'HIGH LEVEL',
+                 'LL': 'LOW LEVEL',
+                 'NTH': 'NORTH',
+                 'STH': 'SOUTH',
+                 'WHF': 'WHARF',
+                 'INTL': 'INTERNATIONAL',
+                 'PKWY': 'PARKWAY',
+                 'RD': 'ROAD',
+                 'DN': 'DOWN'}
+
+ABBREVIATION_RE = re.compile(r'(?<![A-Z0-9])({})(?![A-Z0-9])'.format(
+    '|'.join(re.escape(i) for i in sorted(ABBREVIATIONS, key=len, reverse=True))))
+
+def normalise(this_series):
+    """normalise: return upper case names with abbreviations expanded and
+    punctuation removed"""
+    this_series = this_series.fillna('').astype(str).str.upper()
+    this_series = this_series.str.replace(ABBREVIATION_RE, lambda m: ABBREVIATIONS[m.group(1)], regex=True)
+    this_series = this_series.str.replace(r'[^A-Z0-9 ]+', ' ', regex=True)
+    return this_series.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+def get_ngrams(name, n=NGRAM):
+    this_name = ' {} '.format(name)
+    return {this_name[i:i + n] for i in range(len(this_name) - n + 1)}
+
+def get_matrix(names, vocabulary, n=NGRAM):
+    """get_matrix: return binary sparse matrix of names by n-grams in vocabulary"""
+    (rows, columns) = ([], [])
+    for row, name in enumerate(names):
+        for this_gram in get_ngrams(name, n):
+            column = vocabulary.get(this_gram)
+            if column is not None:
+                rows.append(row)
+                columns.append(column)
+    data = np.ones(len(rows), dtype='float32')
+    return sparse.csr_matrix((data, (rows, columns)), shape=(len(names), len(vocabulary)))
+
+def get_vocabulary(names, n=NGRAM, max_df=None):
+    """get_vocabulary: return n-gram column numbers, leaving out n-grams found
+    in more than max_df of names so common n-grams do not block everything"""
+    counts = pd.Series([j for i in names for j in get_ngrams(i, n)], dtype='object').value_counts()
+    if max_df is not None:
+        counts = counts[counts <= max(1, int(max_df * len(names)))]
+    return {k: n for n, k in enumerate(counts.index)}
+
+def get_pairs(query_matrix, candidate_matrix):
+    """get_pairs: return (query, candidate) positions sharing an n-gram"""
+    this_pairs = (query_matrix @ candidate_matrix.T).tocoo()
+    return (this_pairs.row, this_pairs.col)
+
+def match_names(queries, candidates, n=NGRAM, max_df=MAX_DF, min_similarity=MIN_SIMILARITY, topn=TOPN):
+    """match_names: return (query, candidate, similarity) positions for the
+    topn candidate names for each query name by n-gram Dice similarity
+
+    Pairs are chosen on the n-grams found in at most max_df of the candidates,
+    or on every n-gram for a query made only of common n-grams, and scored on
+    the full n-gram sets so an exact match scores 1.0"""
+    vocabulary = get_vocabulary(candidates, n)
+    candidate_matrix = get_matrix(candidates, vocabulary, n)
+    query_matrix = get_matrix(queries, vocabulary, n)
+    blocking = get_vocabulary(candidates, n, max_df)
+    blocking = np.asarray([vocabulary[k] for k in blocking], dtype='int64')
+    (query, candidate) = get_pairs(query_matrix[:, blocking], candidate_matrix[:, blocking])
+    common = np.flatnonzero(np.diff(query_matrix[:, blocking].indptr) == 0)
+    if common.size:
+        (common_query, common_candidate) = get_pairs(query_matrix[common], candidate_matrix)
+        query = np.concatenate([query, common[common_query]])
+        candidate = np.concatenate([candidate, common_candidate])
+    shared = np.asarray(query_matrix[query].multiply(candidate_matrix[candidate]).sum(axis=1)).ravel()
+    query_size = np.asarray([len(get_ngrams(i, n)) for i in queries], dtype='float64')
+    candidate_size = np.asarray([len(get_ngrams(i, n)) for i in candidates], dtype='float64')
+    similarity = 2.0 * shared / (query_size[query] + candidate_size[candidate])
+    this_df = pd.DataFrame({'query': query, 'candidate': candidate, 'similarity': similarity})
+    this_df = this_df[this_df['similarity'] >= min_similarity]
+    this_df = this_df.sort_values(['query', 'similarity'], ascending=[True, False], kind='stable')
+    return this_df.groupby('query').head(topn).reset_index(drop=True)
+
+def get_neighbours(locations, length=4):
+    """get_neighbours: return the mean location of located TIPLOCs for each
+    TIPLOC prefix of length characters"""
+    this_df = locations.dropna(subset=['latitude', 'longitude'])
+    this_df = this_df.assign(k=this_df.index.str[:length])
+    return this_df.groupby('k')[['latitude', 'longitude']].mean()
+
+def rank_suggestions(missing, candidates, locations, topn=TOPN, length=4):
+    """rank_suggestions: return ranked candidate locations for the `missing`
+    TIPLOCs by description similarity, shared TIPLOC prefix `k` and distance
+    to the located TIPLOCs with the same prefix"""
+    query_names = normalise(missing['Description'])
+    candidate_names = normalise(candidates['name'])
+    this_df = match_names(query_names.tolist(), candidate_names.tolist(), topn=topn * 4)
+    this_query = missing.iloc[this_df['query']].reset_index()
+    this_candidate = candidates.iloc[this_df['candidate']].reset_index(drop=True) \
+                               .add_prefix('candidate_')
+    this_df = pd.concat([this_query, this_candidate, this_df[['similarity']].reset_index(drop=True)], axis=1)
+    this_df['k'] = this_df['TIPLOC'].str[:length]
+    this_df['prefix'] = this_df['candidate_TIPLOC'].fillna('').str[:length].values == this_df['k'].values
+    neighbours = get_neighbours(locations, length).reindex(this_df['k'])
+    this_df['neighbour_distance'] = haversine(neighbours['latitude'].values, neighbours['longitude'].values,
+                                              this_df['candidate_latitude'].values, this_df['candidate_longitude'].values)
+    closeness = np.exp(-this_df['neighbour_distance'].fillna(np.inf) / NEIGHBOUR_SCALE)
+    this_df['score'] = this_df['similarity'] + PREFIX_WEIGHT * this_df['prefix'] + NEIGHBOUR_WEIGHT * closeness
+    this_df = this_df.sort_values(['TIPLOC', 'score'], ascending=[True, False], kind='stable')
+    this_df = this_df.groupby('TIPLOC').head(topn)
+    this_df['rank'] = this_df.groupby('TIPLOC').cumcount() + 1
+    return this_df.reset_index(drop=True)
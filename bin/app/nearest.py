@@ -0,0 +1,103 @@
+"""nearest: spatial index of resolved TIPLOC locations on unit sphere
+coordinates for batched k-nearest, radius and bounding box queries"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from app.coords import EARTH_RADIUS, haversine
+
+REPORT = 'locations-report.tsv'
+EXTENSION = '.kdtree'
+
+def to_xyz(latitude, longitude):
+    """to_xyz: return unit sphere cartesian coordinates for arrays of degrees"""
+    phi = np.radians(np.asarray(latitude, dtype='float64'))
+    this_lambda = np.radians(np.asarray(longitude, dtype='float64'))
+    return np.column_stack([np.cos(phi) * np.cos(this_lambda),
+                            np.cos(phi) * np.sin(this_lambda),
+                            np.sin(phi)])
+
+def to_chord(metres):
+    """to_chord: return unit sphere chord length for a great-circle distance"""
+    return 2.0 * np.sin(np.minimum(np.asarray(metres, dtype='float64'), np.pi * EARTH_RADIUS) / (2.0 * EARTH_RADIUS))
+
+def to_metres(chord):
+    """to_metres: return great-circle distance for a unit sphere chord length"""
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord, dtype='float64') / 2.0, 0.0, 1.0))
+
+class LocationIndex:
+    """LocationIndex: KD-tree over the unit sphere positions of located TIPLOCs"""
+    def __init__(self, locations):
+        locations = locations.dropna(subset=['latitude', 'longitude'])
+        self.tiplocs = locations.index.to_numpy(dtype='object')
+        self.latitude = locations['latitude'].to_numpy(dtype='float64')
+        self.longitude = locations['longitude'].to_numpy(dtype='float64')
+        self.data = locations.reindex(columns=['type', 'Description']).reset_index(drop=True)
+        self.tree = cKDTree(to_xyz(self.latitude, self.longitude))
+
+    def get_result(self, query, position, distance):
+        this_df = pd.DataFrame({'query': query,
+                                'TIPLOC': self.tiplocs[position],
+                                'latitude': self.latitude[position],
+                                'longitude': self.longitude[position],
+                                'distance': distance})
+        return this_df.join(self.data.iloc[position].reset_index(drop=True))
+
+    def nearest(self, latitude, longitude, k=1, max_distance=np.inf):
+        """nearest: return the k nearest TIPLOCs to each query point within
+        max_distance metres, `query` is the position of the query point"""
+        bound = np.inf if np.isinf(max_distance) else float(to_chord(max_distance))
+        (chord, position) = self.tree.query(to_xyz(latitude, longitude), k=k,
+                                            distance_upper_bound=bound, workers=-1)
+        chord = np.asarray(chord).reshape(-1, k)
+        position = np.asarray(position).reshape(-1, k)
+        query = np.repeat(np.arange(chord.shape[0]), k)
+        (chord, position) = (chord.ravel(), position.ravel())
+        found = position < self.tiplocs.shape[0]
+        this_df = self.get_result(query[found], position[found], to_metres(chord[found]))
+        this_df.insert(1, 'rank', np.tile(np.arange(1, k + 1), chord.shape[0] // k)[found])
+        return this_df
+
+    def within(self, latitude, longitude, radius):
+        """within: return the TIPLOCs within radius metres of each query point"""
+        (latitude, longitude) = (np.atleast_1d(latitude), np.atleast_1d(longitude))
+        these_positions = self.tree.query_ball_point(to_xyz(latitude, longitude), r=float(to_chord(radius)), workers=-1)
+        counts = np.fromiter((len(i) for i in these_positions), dtype='int64', count=len(these_positions))
+        query = np.repeat(np.arange(len(these_positions)), counts)
+        position = np.concatenate([np.asarray(i, dtype='int64') for i in these_positions]) if counts.sum() else np.zeros(0, dtype='int64')
+        distance = haversine(latitude[query], longitude[query], self.latitude[position], self.longitude[position])
+        return self.get_result(query, position, distance).sort_values(['query', 'distance'], kind='stable').reset_index(drop=True)
+
+    def bbox(self, south, west, north, east):
+        """bbox: return the TIPLOCs inside a latitude and longitude bounding box"""
+        mask = (self.latitude >= south) & (self.latitude <= north) & \
+            (self.longitude >= west) & (self.longitude <= east)
+        position = np.flatnonzero(mask)
+        return self.get_result(np.zeros(position.shape[0], dtype='int64'), position, np.full(position.shape[0], np.nan))
+
+def read_locations(filename=REPORT):
+    """read_locations: return the locations report indexed by TIPLOC"""
+    this_df = pd.read_csv(filename, sep='\t', dtype={'TIPLOC': 'object', 'type': 'object', 'Description': 'object'},
+                          keep_default_na=False, na_values={'latitude': [''], 'longitude': ['']})
+    return this_df.set_index('TIPLOC')
+
+def get_indexfile(filename=REPORT):
+    return os.path.splitext(filename)[0] + EXTENSION
+
+def write_index(filename=REPORT):
+    """write_index: build the location index for a report and persist it next
+    to the report"""
+    this_index = LocationIndex(read_locations(filename))
+    with open(get_indexfile(filename), 'wb') as fout:
+        pickle.dump(this_index, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    return this_index
+
+def get_index(filename=REPORT):
+    """get_index: return the persisted location index for a report, rebuilding
+    it when missing or older than the report"""
+    indexfile = get_indexfile(filename)
+    if os.path.exists(indexfile) and os.path.getmtime(indexfile) >= os.path.getmtime(filename):
+        with open(indexfile, 'rb') as fin:
+            return pickle.load(fin)
+    return write_index(filename)
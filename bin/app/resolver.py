@@ -0,0 +1,89 @@
+"""resolver: single pass source priority resolution of TIPLOC locations from
+normalised candidate frames"""
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['type', 'Description', 'latitude', 'longitude']
+
+def get_candidates(sources):
+    """get_candidates: concatenate candidate frames with `TIPLOC` and COLUMNS
+    in source priority order, adding the source `rank` and `order` columns"""
+    these_frames = [this_df.reindex(columns=['TIPLOC'] + COLUMNS).assign(rank=n)
+                    for n, this_df in enumerate(sources)]
+    this_df = pd.concat(these_frames, ignore_index=True)
+    this_df = this_df.dropna(subset=['TIPLOC'])
+    this_df['order'] = np.arange(this_df.shape[0])
+    return this_df.reset_index(drop=True)
+
+def resolve(tiplocs, candidates):
+    """resolve: return the highest priority located candidate for each of
+    tiplocs and the candidates for tiplocs with a `winner` flag"""
+    this_df = candidates[candidates['TIPLOC'].isin(tiplocs)]
+    located = this_df['latitude'].notna() & this_df['longitude'].notna()
+    this_df = this_df.sort_values(['TIPLOC', 'rank', 'order'], kind='stable')
+    winners = this_df[located.reindex(this_df.index)].drop_duplicates(subset='TIPLOC')
+    this_df = this_df.assign(winner=this_df.index.isin(winners.index))
+    locations = winners.set_index('TIPLOC')[COLUMNS].reindex(pd.Index(tiplocs, name='TIPLOC'))
+    return (locations, this_df.drop(columns='order').reset_index(drop=True))
+
+def resolve_locations(tiplocs, sources):
+    """resolve_locations: resolve tiplocs against a list of candidate frames
+    in priority order, highest priority first"""
+    return resolve(tiplocs, get_candidates(sources))
+
+def follow_aliases(aliases):
+    """follow_aliases: return the final target for each alias `TIPLOC` following
+    chains of aliases to a non-alias `mapped TIPLOC`, and the index of alias
+    TIPLOCs that are part of, or lead into, a cycle
+
+    Each pass jumps the still chained aliases to their target's target so a
+    chain of n aliases is followed in log2(n) passes. Aliases that reach
+    themselves or a known cyclic alias are dropped as cyclic, and any still
+    chained after the last pass lead into a cycle"""
+    alias_map = aliases.drop_duplicates(subset='TIPLOC').set_index('TIPLOC')['mapped TIPLOC']
+    # The target of alias i is the mapped TIPLOC of alias pointer[i]
+    following = alias_map.index.get_indexer(alias_map.values)
+    pointer = np.arange(alias_map.shape[0])
+    cyclic = np.zeros(alias_map.shape[0], dtype=bool)
+    chained = np.flatnonzero(following >= 0)
+    for _ in range(int(np.ceil(np.log2(max(alias_map.shape[0], 1)))) + 1):
+        if not chained.size:
+            break
+        this_next = following[pointer[chained]]
+        found = (this_next == chained) | cyclic[this_next]
+        cyclic[chained[found]] = True
+        pointer[chained] = pointer[this_next]
+        chained = chained[~found]
+        chained = chained[following[pointer[chained]] >= 0]
+    cyclic[chained] = True
+    targets = pd.Series(alias_map.values[pointer], index=alias_map.index, name=alias_map.name)
+    return (targets.where(~cyclic), alias_map.index[cyclic])
+
+def resolve_aliases(locations, aliases, fallbacks=(), alias_type='overlapA'):
+    """resolve_aliases: set alias TIPLOCs to the location of their final target
+    falling back to the `fallbacks` list of (type, frame) in priority order
+    where the target has no resolved location, returning the updated
+    locations with any alias TIPLOCs they lacked added and the index of
+    cyclic aliases"""
+    aliases = aliases.dropna(subset=['mapped TIPLOC']).drop_duplicates(subset='TIPLOC')
+    (targets, cycles) = follow_aliases(aliases)
+    this_df = pd.DataFrame({'target': targets})
+    this_df['type'] = alias_type
+    this_df['Description'] = aliases.set_index('TIPLOC')['Description'].reindex(this_df.index)
+    this_df[['latitude', 'longitude']] = locations[['latitude', 'longitude']].reindex(this_df['target']).values
+    for this_type, this_source in fallbacks:
+        missing = this_df['latitude'].isna() & this_df['target'].notna()
+        if not missing.any():
+            break
+        this_located = this_source.dropna(subset=['TIPLOC', 'latitude', 'longitude']) \
+                                  .drop_duplicates(subset='TIPLOC').set_index('TIPLOC')
+        this_data = this_located[['latitude', 'longitude']].reindex(this_df.loc[missing, 'target'])
+        found = this_data['latitude'].notna().values
+        this_index = this_df.index[missing][found]
+        this_df.loc[this_index, ['latitude', 'longitude']] = this_data.values[found]
+        this_df.loc[this_index, 'type'] = this_type
+    # Cyclic aliases have no target, keep any location already resolved
+    this_df = this_df.dropna(subset=['target'])
+    locations = locations.reindex(locations.index.append(this_df.index.difference(locations.index, sort=False)))
+    locations.loc[this_df.index, COLUMNS] = this_df[COLUMNS]
+    return (locations, cycles)
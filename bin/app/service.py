@@ -0,0 +1,262 @@
+"""service: in-memory TIPLOC lookup HTTP service with batch, bounding box and
+radius GeoJSON queries, an LRU response cache and hot reload of the report"""
+import os
+import json
+import math
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import numpy as np
+from app.coords import haversine
+from app.nearest import LocationIndex, read_locations, to_chord, to_xyz
+from app.tiplocdb import REPORT, open_db
+
+CACHESIZE = 65536
+INTERVAL = 5.0
+MAXBATCH = 10000
+
+Snapshot = namedtuple('Snapshot', ['version', 'mtime', 'db', 'index'])
+
+class LRUCache:
+    """LRUCache: thread safe least recently used cache of response bodies"""
+    def __init__(self, maxsize=CACHESIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        (self.hits, self.misses) = (0, 0)
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+def get_feature(tiploc, this_type, description, latitude, longitude, **properties):
+    """get_feature: return a GeoJSON point Feature for a TIPLOC location"""
+    geometry = None
+    if not (math.isnan(latitude) or math.isnan(longitude)):
+        geometry = {'type': 'Point', 'coordinates': [longitude, latitude]}
+    properties = dict({'TIPLOC': tiploc, 'type': this_type, 'Description': description}, **properties)
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+def get_collection(features):
+    return {'type': 'FeatureCollection', 'features': features}
+
+def index_features(index, position, distance=None):
+    """index_features: return GeoJSON Features for LocationIndex positions
+    with the distance in metres when given"""
+    these_types = index.data['type'].to_numpy(dtype='object')[position].tolist()
+    these_descriptions = index.data['Description'].to_numpy(dtype='object')[position].tolist()
+    these_data = zip(index.tiplocs[position].tolist(), these_types, these_descriptions,
+                     index.latitude[position].tolist(), index.longitude[position].tolist())
+    if distance is None:
+        return [get_feature(*i) for i in these_data]
+    return [get_feature(*i, distance=round(j, 1)) for i, j in zip(these_data, distance.tolist())]
+
+class LocationService:
+    """LocationService: current report snapshot with an atomic swap on reload,
+    a replaced snapshot's index is closed once its last reader is done"""
+    def __init__(self, report=REPORT, cachesize=CACHESIZE):
+        self.report = report
+        self.cache = LRUCache(cachesize)
+        self.lock = threading.Lock()
+        self.readers_lock = threading.Lock()
+        self.readers = {}
+        self.snapshot = None
+        self.reload()
+
+    def load(self, version):
+        mtime = os.path.getmtime(self.report)
+        return Snapshot(version, mtime, open_db(self.report), LocationIndex(read_locations(self.report)))
+
+    def reload(self, force=False):
+        """reload: build a new snapshot when the report has changed and swap it
+        in, requests in flight keep using the snapshot they started with"""
+        with self.lock:
+            current = self.snapshot
+            if not force and current is not None and os.path.getmtime(self.report) == current.mtime:
+                return False
+            snapshot = self.load(0 if current is None else current.version + 1)
+            with self.readers_lock:
+                self.snapshot = snapshot
+                idle = current is not None and current.version not in self.readers
+            self.cache.clear()
+            if idle:
+                current.db.close()
+            return True
+
+    def acquire(self):
+        """acquire: return the current snapshot counting it as in use"""
+        with self.readers_lock:
+            snapshot = self.snapshot
+            self.readers[snapshot.version] = self.readers.get(snapshot.version, 0) + 1
+            return snapshot
+
+    def release(self, snapshot):
+        """release: stop using a snapshot, closing its index when it has been
+        replaced and this was its last reader"""
+        with self.readers_lock:
+            self.readers[snapshot.version] -= 1
+            if self.readers[snapshot.version]:
+                return
+            del self.readers[snapshot.version]
+            if snapshot is self.snapshot:
+                return
+        snapshot.db.close()
+
+    @contextmanager
+    def reading(self):
+        """reading: yield the current snapshot for the length of a request"""
+        snapshot = self.acquire()
+        try:
+            yield snapshot
+        finally:
+            self.release(snapshot)
+
+    def close(self):
+        """close: close the current snapshot's index"""
+        self.snapshot.db.close()
+
+    def watch(self, interval=INTERVAL):
+        """watch: start a daemon thread reloading the report once it has changed
+        and its modification time is unchanged for one interval, so a report
+        that is still being written is not loaded"""
+        def run():
+            seen = None
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.path.getmtime(self.report)
+                    if mtime == seen and self.reload():
+                        print('reloaded {} version {}'.format(self.report, self.snapshot.version), flush=True)
+                    seen = mtime
+                except (OSError, ValueError) as error:
+                    print('reload failed: {}'.format(error), flush=True)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def lookup(self, snapshot, tiplocs):
+        features = []
+        for tiploc, location in zip(tiplocs, snapshot.db.lookup(tiplocs)):
+            if location is None:
+                features.append({'type': 'Feature', 'geometry': None, 'properties': {'TIPLOC': tiploc}})
+                continue
+            features.append(get_feature(*location))
+        return get_collection(features)
+
+    def bbox(self, snapshot, south, west, north, east):
+        index = snapshot.index
+        mask = (index.latitude >= south) & (index.latitude <= north) & \
+            (index.longitude >= west) & (index.longitude <= east)
+        return get_collection(index_features(index, np.flatnonzero(mask)))
+
+    def radius(self, snapshot, latitude, longitude, radius):
+        index = snapshot.index
+        position = np.asarray(index.tree.query_ball_point(to_xyz([latitude], [longitude])[0], r=float(to_chord(radius))),
+                              dtype='int64')
+        distance = haversine(latitude, longitude, index.latitude[position], index.longitude[position])
+        order = np.argsort(distance, kind='stable')
+        return get_collection(index_features(index, position[order], distance[order]))
+
+    def health(self, snapshot):
+        return {'report': self.report, 'version': snapshot.version, 'count': len(snapshot.db),
+                'cache': {'size': len(self.cache.data), 'hits': self.cache.hits, 'misses': self.cache.misses}}
+
+    def get_response(self, path, query):
+        """get_response: return (status, JSON body) for a GET request, caching
+        bodies by snapshot version and request"""
+        with self.reading() as snapshot:
+            return self.get_snapshot_response(snapshot, path, query)
+
+    def get_snapshot_response(self, snapshot, path, query):
+        if path == '/health':
+            return (200, json.dumps(self.health(snapshot)).encode('utf-8'))
+        key = (snapshot.version, path, query)
+        body = self.cache.get(key)
+        if body is not None:
+            return (200, body)
+        (status, data) = self.dispatch(snapshot, path, parse_qs(query))
+        body = json.dumps(data).encode('utf-8')
+        if status == 200:
+            self.cache.put(key, body)
+        return (status, body)
+
+    def dispatch(self, snapshot, path, params):
+        try:
+            if path.startswith('/tiploc/'):
+                return (200, self.lookup(snapshot, [unquote(path[len('/tiploc/'):])])['features'][0])
+            if path == '/tiplocs':
+                tiplocs = [j for i in params.get('tiploc', []) for j in i.split(',') if j]
+                if len(tiplocs) > MAXBATCH:
+                    return (400, {'error': 'more than {} TIPLOCs'.format(MAXBATCH)})
+                return (200, self.lookup(snapshot, tiplocs))
+            if path == '/bbox':
+                return (200, self.bbox(snapshot, *[float(params[i][0]) for i in ['south', 'west', 'north', 'east']]))
+            if path == '/radius':
+                return (200, self.radius(snapshot, *[float(params[i][0]) for i in ['lat', 'lon', 'radius']]))
+        except (KeyError, ValueError) as error:
+            return (400, {'error': 'bad query: {}'.format(error)})
+        return (404, {'error': 'not found: {}'.format(path)})
+
+class LocationHandler(BaseHTTPRequestHandler):
+    """LocationHandler: HTTP/1.1 keep-alive handler for a LocationService"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    service = None
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/geo+json' if status == 200 and self.path != '/health' else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        this_url = urlsplit(self.path)
+        self.send_body(*self.service.get_response(this_url.path, this_url.query))
+
+    def do_POST(self):
+        this_url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            tiplocs = json.loads(self.rfile.read(length) or b'[]')
+        except ValueError:
+            tiplocs = None
+        if this_url.path != '/tiplocs' or not isinstance(tiplocs, list):
+            self.send_body(400, json.dumps({'error': 'POST a JSON list of TIPLOCs to /tiplocs'}).encode('utf-8'))
+            return
+        if len(tiplocs) > MAXBATCH:
+            self.send_body(400, json.dumps({'error': 'more than {} TIPLOCs'.format(MAXBATCH)}).encode('utf-8'))
+            return
+        with self.service.reading() as snapshot:
+            body = json.dumps(self.service.lookup(snapshot, [str(i) for i in tiplocs])).encode('utf-8')
+        self.send_body(200, body)
+
+    def log_message(self, *args):
+        return None
+
+def get_server(service, host='127.0.0.1', port=8080):
+    """get_server: return a threaded HTTP server for a LocationService"""
+    handler = type('Handler', (LocationHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -2,76 +2,163 @@
 import json
 from json.decoder import JSONDecodeError as SolrError
 import os
-from time import sleep
+import re
+from time import sleep, monotonic
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError, ConnectionError
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+from app.instrument import event, record_request
+from app.solrcache import CACHEPATH, CACHESIZE, CacheMiss, ResponseCache
 
 CONNECTIONS = {}
 SOLRHOST = os.environ.get('SOLRHOST', 'localhost')
+SOLRPORT = int(os.environ.get('SOLRPORT', 8983))
+PAGESIZE = 8192
+MAXCLAUSES = 512
+POOLSIZE = int(os.environ.get('SOLRPOOLSIZE', 16))
+TIMEOUT = (3.05, 300.0)
+RETRIES = 4
+BACKOFF = 0.5
+RETRY_STATUS = (429, 502, 503, 504)
+METADATA_TTL = float(os.environ.get('SOLRMETADATA_TTL', 300.0))
+INDEXBATCH = 5000
+INDEXWORKERS = 4
+SOLRCACHE = os.environ.get('SOLRCACHE', 'off')
+RESPONSECACHE = None
+
+class SolrClient:
+    """SolrClient: pooled keep-alive `requests.Session` for a Solr host with
+    timeouts and exponential backoff retry on transient errors"""
+    def __init__(self, hostname=SOLRHOST, port=SOLRPORT, poolsize=POOLSIZE,
+                 timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, ttl=METADATA_TTL):
+        self.hostname = hostname
+        self.url = 'http://{}:{}'.format(hostname, port)
+        self.timeout = timeout
+        self.ttl = ttl
+        self.metadata = {}
+        # Only idempotent methods retry on an error status by default, select
+        # queries and update batches that overwrite docs by `id` use the
+        # session that also retries POST
+        self.session = get_session(poolsize, Retry(total=retries,
+                                                   backoff_factor=backoff,
+                                                   status_forcelist=RETRY_STATUS,
+                                                   raise_on_status=False))
+        self.retry_session = get_session(poolsize, Retry(total=retries,
+                                                         backoff_factor=backoff,
+                                                         status_forcelist=RETRY_STATUS,
+                                                         allowed_methods=None,
+                                                         raise_on_status=False))
+
+    def request(self, method, path, data=None, idempotent=False):
+        """request: send `method` request for path relative to the host url,
+        retrying POST requests only where they are idempotent"""
+        this_url = '{}/{}'.format(self.url, path).rstrip('/')
+        this_session = self.retry_session if idempotent else self.session
+        this_start = monotonic()
+        try:
+            this_response = this_session.request(method, this_url, data=data, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            record_request(monotonic() - this_start, error=True)
+            raise
+        record_request(monotonic() - this_start, len(this_response.content), this_response.status_code >= 400)
+        return this_response
+
+    def call_api(self, method, name='', api='', api_type='collections', data=None):
+        """call_api: request method for v2 Solr api"""
+        this_path = 'api/{}/{}/{}'.format(api_type, name, api)
+        this_request = self.request(method, this_path, data)
+        this_request.raise_for_status()
+        this_data = this_request.json()
+        if api in this_data:
+            return this_data[api]
+        this_data.pop('responseHeader', None)
+        return this_data
+
+    def call_solr(self, method, name='', api='', response_header=False, data=None, idempotent=False):
+        """call_solr: request method for v1 Solr api"""
+        this_path = 'solr/{}/{}'.format(name, api)
+        this_request = self.request(method, this_path, data, idempotent)
+        this_data = this_request.json()
+        if api in this_data:
+            return this_data[api]
+        if response_header:
+            return this_data
+        this_data.pop('responseHeader', None)
+        return this_data
+
+    def cached(self, key, function, *rest, **kwargs):
+        """cached: return the metadata value for key calling function on a miss
+        or once the value is older than the TTL"""
+        this_time = monotonic()
+        if key in self.metadata:
+            (this_expiry, this_value) = self.metadata[key]
+            if this_time < this_expiry:
+                return this_value
+        this_value = function(*rest, **kwargs)
+        self.metadata[key] = (this_time + self.ttl, this_value)
+        return this_value
+
+    def invalidate(self, name=None):
+        """invalidate: drop cached metadata for collection name or all metadata"""
+        if name is None:
+            self.metadata.clear()
+            return
+        for key in [k for k in self.metadata if k[1] == name]:
+            self.metadata.pop(key, None)
+
+    def close(self):
+        """close: close the pooled connections"""
+        self.session.close()
+        self.retry_session.close()
+
+def get_session(poolsize, retry):
+    """get_session: return a keep-alive `requests.Session` with a pool of
+    poolsize connections and the retry policy"""
+    this_adapter = HTTPAdapter(pool_connections=poolsize,
+                               pool_maxsize=poolsize,
+                               max_retries=retry)
+    this_session = requests.Session()
+    this_session.mount('http://', this_adapter)
+    return this_session
+
+def get_client(hostname=SOLRHOST):
+    """get_client: return the shared `SolrClient` for hostname"""
+    if hostname not in CONNECTIONS:
+        CONNECTIONS[hostname] = SolrClient(hostname)
+    return CONNECTIONS[hostname]
+
+def set_cache(mode=SOLRCACHE, cachepath=CACHEPATH, size=CACHESIZE):
+    """set_cache: set the on-disk Solr response cache mode to `off`, `on`,
+    `record` or `replay`"""
+    global RESPONSECACHE
+    RESPONSECACHE = None if mode == 'off' else ResponseCache(mode, cachepath, size)
+    return RESPONSECACHE
+
+set_cache()
 
 def get_api(name='', api='', api_type='collections', hostname=SOLRHOST):
     """get_api: get method for v2 Solr api"""
-    this_url = 'http://{}:8983/api/{}/{}/{}'\
-               .format(hostname, api_type, name, api)
-    this_url = this_url.rstrip('/')
-    this_request = requests.get(this_url)
-    this_request.raise_for_status()
-    this_data = this_request.json()
-    if api in this_data:
-        return this_data[api]
-    this_data.pop('responseHeader', None)
-    return this_data
+    return get_client(hostname).call_api('GET', name, api, api_type)
 
 def post_api(data, name='', api='', api_type='collections', hostname=SOLRHOST):
     """post_api: post method with v2 Solr api"""
-    this_url = 'http://{}:8983/api/{}/{}/{}'\
-               .format(hostname, api_type, name, api)
-    this_url = this_url.rstrip('/')
-    this_request = requests.post(this_url, data)
-    this_request.raise_for_status()
-    this_data = this_request.json()
-    if api in this_data:
-        return this_data[api]
-    this_data.pop('responseHeader', None)
-    return this_data
+    return get_client(hostname).call_api('POST', name, api, api_type, data)
 
 def delete_api(name='', api='', this_type='collections', hostname=SOLRHOST):
     """delete_api: delete method with v2 Solr api"""
-    this_url = 'http://{}:8983/api/{}/{}/{}'.format(hostname, this_type, name, api)
-    this_url = this_url.rstrip('/')
-    this_request = requests.delete(this_url)
-    this_request.raise_for_status()
-    this_data = this_request.json()
-    if api in this_data:
-        return this_data[api]
-    this_data.pop('responseHeader', None)
-    return this_data
+    return get_client(hostname).call_api('DELETE', name, api, this_type)
 
 def get_solr(name='', api='', response_header=False, hostname=SOLRHOST):
     """get_solr: get method with v1 Solr api"""
-    this_url = 'http://{}:8983/solr/{}/{}'.format(hostname, name, api)
-    this_url = this_url.rstrip('/')
-    this_request = requests.get(this_url)
-    this_data = this_request.json()
-    if api in this_data:
-        return this_data[api]
-    if response_header:
-        return this_data
-    this_data.pop('responseHeader', None)
-    return this_data
+    return get_client(hostname).call_solr('GET', name, api, response_header)
 
-def post_solr(data, name='', api='', response_header=False, hostname=SOLRHOST):
-    """post_solr: post data method with v1 Solr` api"""
-    this_url = 'http://{}:8983/solr/{}/{}'.format(hostname, name, api)
-    this_url = this_url.rstrip('/')
-    this_request = requests.post(this_url, data)
-    this_data = this_request.json()
-    if api in this_data:
-        return this_data[api]
-    if response_header:
-        return this_data
-    this_data.pop('responseHeader', None)
-    return this_data
+def post_solr(data, name='', api='', response_header=False, hostname=SOLRHOST, idempotent=False):
+    """post_solr: post data method with v1 Solr` api, only retrying on an
+    error status where the request is idempotent"""
+    return get_client(hostname).call_solr('POST', name, api, response_header, data, idempotent)
 
 def raw_query(name, search_str='*:*', sort='id asc', nrows=10,
               facet_fl=None, group_fl=None, ngroup=1024, **rest):
@@ -90,9 +177,39 @@ def raw_query(name, search_str='*:*', sort='id asc', nrows=10,
                 'rows': nrows}
     if rest:
         data = {**data, **rest}
-    this_response = post_solr(data, name, api='select')
+    this_response = post_query(name, data)
     return this_response
 
+def post_query(name, data):
+    """post_query: post select query data through the response cache keyed
+    on the index version of name"""
+    if RESPONSECACHE is None:
+        return post_solr(data, name, api='select', idempotent=True)
+    if RESPONSECACHE.mode == 'replay':
+        this_version = RESPONSECACHE.get_version(name)
+        if this_version is None:
+            raise CacheMiss('no cached Solr responses for "{}"'.format(name))
+    else:
+        this_version = get_version(name)
+        if this_version is None:
+            return post_solr(data, name, api='select', idempotent=True)
+        RESPONSECACHE.set_version(name, this_version)
+    return RESPONSECACHE.query(name, this_version, data, lambda: post_solr(data, name, api='select', idempotent=True))
+
+def get_version(name):
+    """get_version: return cached Solr index version for name"""
+    return get_client().cached(('version', name), read_version, name)
+
+def read_version(name):
+    """read_version: return the Solr index version for name from the `luke`
+    handler or None if it is not available"""
+    try:
+        this_data = get_solr(name, api='admin/luke?numTerms=0&show=index')
+    except (HTTPError, SolrError):
+        return None
+    this_version = this_data.get('index', {}).get('version')
+    return None if this_version is None else str(this_version)
+
 def get_query(name, search_str='*:*', sort='id asc', limitrows=False, nrows=10, **rest):
     """get_query: return Solr query data for `solr` connection"""
     if not ping_name(name):
@@ -106,6 +223,70 @@ def get_query(name, search_str='*:*', sort='id asc', limitrows=False, nrows=10,
     this_data = this_response.pop('response')
     return this_data['docs']
 
+def cursor_sort(sort):
+    """cursor_sort: add the `id` unique key tie-break required by `cursorMark`"""
+    if re.search(r'\bid\s+(asc|desc)\b', sort):
+        return sort
+    return '{},id asc'.format(sort) if sort else 'id asc'
+
+def iter_pages(name, search_str='*:*', sort='id asc', pagesize=PAGESIZE, **rest):
+    """iter_pages: yield Solr query docs a page of `pagesize` rows at a time
+    using a `cursorMark` deep paging cursor"""
+    if not ping_name(name):
+        raise ValueError('"{}" is not a Solr collection or core'.format(name))
+    this_sort = cursor_sort(sort)
+    this_cursor = '*'
+    while True:
+        this_response = raw_query(name,
+                                  q=search_str,
+                                  sort=this_sort,
+                                  nrows=pagesize,
+                                  cursorMark=this_cursor,
+                                  **rest)
+        this_data = this_response.pop('response')['docs']
+        if this_data:
+            yield this_data
+        next_cursor = this_response.get('nextCursorMark', this_cursor)
+        if not this_data or next_cursor == this_cursor:
+            return
+        this_cursor = next_cursor
+
+def iter_query(name, search_str='*:*', sort='id asc', pagesize=PAGESIZE, **rest):
+    """iter_query: yield Solr query docs as each `cursorMark` page arrives"""
+    for this_page in iter_pages(name, search_str, sort, pagesize, **rest):
+        yield from this_page
+
+def get_frame(name, search_str='*:*', sort='id asc', pagesize=PAGESIZE, columns=None, **rest):
+    """get_frame: return Solr query docs as a DataFrame built a page at a time
+    optionally renaming and selecting fields with the `columns` dict"""
+    this_frames = []
+    for this_page in iter_pages(name, search_str, sort, pagesize, **rest):
+        this_df = pd.DataFrame(this_page)
+        if columns:
+            this_df = this_df.reindex(columns=list(columns)).rename(columns=columns)
+        this_frames.append(this_df)
+    if not this_frames:
+        return pd.DataFrame(columns=list(columns.values()) if columns else None)
+    return pd.concat(this_frames, ignore_index=True)
+
+def quote_term(this_value):
+    """quote_term: escape a value for use as a Solr query term"""
+    return '"{}"'.format(str(this_value).replace('\\', '\\\\').replace('"', '\\"'))
+
+def chunk_query(field, values, chunksize=MAXCLAUSES):
+    """chunk_query: yield `field:(a OR b ...)` query strings of at most
+    `chunksize` clauses to stay under the Solr boolean clause limit"""
+    values = list(dict.fromkeys(values))
+    for n in range(0, len(values), chunksize):
+        this_chunk = values[n:n + chunksize]
+        yield '{}:({})'.format(field, ' OR '.join(quote_term(i) for i in this_chunk))
+
+def get_query_in(name, field, values, chunksize=MAXCLAUSES, **rest):
+    """get_query_in: return Solr query docs where field matches any of values
+    split across chunked queries"""
+    return [j for i in chunk_query(field, values, chunksize)
+            for j in iter_query(name, i, **rest)]
+
 def get_group(name, group_fl, search_str='*:*',
               ngroup=1024, sort='id asc', **rest):
     """get_group: return Solr query grouped by group_fl data"""
@@ -140,7 +321,12 @@ def get_facet(name, facet_fl, search_str='*:*', nrows=0, ngroup=512, **rest):
     return this_data
 
 def get_count(name, search_str='*:*', **rest):
-    """get_count: return Solr document count for name"""
+    """get_count: return cached Solr document count for name"""
+    this_key = ('count', name, search_str, json.dumps(rest, sort_keys=True))
+    return get_client().cached(this_key, count_docs, name, search_str, **rest)
+
+def count_docs(name, search_str='*:*', **rest):
+    """count_docs: return Solr document count for name from Solr"""
     if not ping_name(name):
         raise ValueError('"{}" is not a Solr collection or core'.format(name))
     this_response = raw_query(name, q=search_str, start=0, nrows=0, **rest)
@@ -170,20 +356,95 @@ def type_error_solr(this_response, this_schema):
         raise ValueError('Error: cannot post data "{}" to field "{}" type "{}"'\
                          .format(this_data, this_field, this_type))
 
-def post_data(data, name):
-    """post_data_api: post data using v1 Solr API"""
-    return post_solr(json.dumps(data),
-                     name,
-                     api='update/json/docs?commit=true',
-                     response_header=True)
-
-def update_data(data, name):
-    """post_data_api: post data using v1 Solr API"""
-    update_data = [{k: v if k == 'id' else {'set': v} for k, v in i.items()} for i in data]
-    return post_solr(json.dumps(update_data),
-                     name,
-                     api='update/json?commit=true',
-                     response_header=True)
+def iter_batches(docs, batchsize=INDEXBATCH):
+    """iter_batches: yield lists of at most batchsize docs from an iterable"""
+    this_batch = []
+    for doc in docs:
+        this_batch.append(doc)
+        if len(this_batch) == batchsize:
+            yield this_batch
+            this_batch = []
+    if this_batch:
+        yield this_batch
+
+def get_update_api(api, commit_within=None):
+    """get_update_api: add a `commitWithin` in milliseconds to an update api"""
+    if commit_within is None:
+        return api
+    return '{}?commitWithin={}'.format(api, int(commit_within))
+
+def check_update(this_response):
+    """check_update: raise ValueError when an update response is a Solr error"""
+    this_status = this_response.get('responseHeader', {}).get('status')
+    if 'error' in this_response or this_status != 0:
+        raise ValueError(this_response.get('error', {}).get('msg', 'Solr status {}'.format(this_status)))
+    return this_response
+
+def post_batch(name, batch, api):
+    """post_batch: post a batch of docs and raise ValueError on a Solr error"""
+    check_update(post_solr(json.dumps(batch), name, api=api, response_header=True, idempotent=True))
+    return len(batch)
+
+def commit(name):
+    """commit: hard commit pending updates to name"""
+    this_response = post_solr('[]', name, api='update/json?commit=true', response_header=True)
+    get_client().invalidate(name)
+    return this_response
+
+def index_docs(docs, name, api='update/json/docs', batchsize=INDEXBATCH, workers=INDEXWORKERS,
+               commit_within=None):
+    """index_docs: stream docs from an iterable to name in batches posted over
+    `workers` pooled connections, with a `commitWithin` in milliseconds or one
+    final hard commit, returning the doc and batch counts and failed batches
+    with a failed hard commit recorded as the batch `commit`"""
+    (this_result, this_running) = ({'docs': 0, 'batches': 0, 'failed': []}, {})
+    this_api = get_update_api(api, commit_within)
+
+    def check_done(return_when):
+        (this_done, _) = wait(this_running, return_when=return_when)
+        for this_future in this_done:
+            (n, this_start, this_size) = this_running.pop(this_future)
+            try:
+                this_result['docs'] += this_future.result()
+                this_result['batches'] += 1
+            except (HTTPError, ConnectionError, SolrError, ValueError,
+                    requests.exceptions.RequestException) as error:
+                this_failure = {'batch': n, 'start': this_start, 'size': this_size, 'error': str(error)}
+                this_result['failed'].append(this_failure)
+                event('index_failed', collection=name, **this_failure)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        this_start = 0
+        for n, this_batch in enumerate(iter_batches(docs, batchsize)):
+            # Bound the batches in flight so docs are read as they are sent
+            if len(this_running) >= 2 * workers:
+                check_done(FIRST_COMPLETED)
+            this_future = executor.submit(post_batch, name, this_batch, this_api)
+            this_running[this_future] = (n, this_start, len(this_batch))
+            this_start += len(this_batch)
+        if this_running:
+            check_done(ALL_COMPLETED)
+    this_result['failed'].sort(key=lambda v: v['batch'])
+    if commit_within is None:
+        try:
+            check_update(commit(name))
+        except (HTTPError, ConnectionError, SolrError, ValueError,
+                requests.exceptions.RequestException) as error:
+            this_failure = {'batch': 'commit', 'error': str(error)}
+            this_result['failed'].append(this_failure)
+            event('index_failed', collection=name, **this_failure)
+    get_client().invalidate(name)
+    return this_result
+
+def post_data(data, name, batchsize=INDEXBATCH, workers=INDEXWORKERS, commit_within=None):
+    """post_data: index an iterable of docs using v1 Solr API in parallel batches"""
+    return index_docs(data, name, 'update/json/docs', batchsize, workers, commit_within)
+
+def update_data(data, name, batchsize=INDEXBATCH, workers=INDEXWORKERS, commit_within=None):
+    """update_data: atomically set the fields of an iterable of docs by `id`
+    using v1 Solr API in parallel batches"""
+    update_data = ({k: v if k == 'id' else {'set': v} for k, v in i.items()} for i in data)
+    return index_docs(update_data, name, 'update/json', batchsize, workers, commit_within)
 
 def get_names():
     """get_names: return a set of Solr collection or core names"""
@@ -211,7 +472,8 @@ def get_schema(name, solr_mode='collections', all_fields=False):
     """get_schema: return dict for Solr schema for excluding required and unstored fields"""
     try:
         this_error = None
-        this_data = get_api(name, 'schema/fields', solr_mode)
+        this_data = get_client().cached(('schema', name, solr_mode),
+                                        get_api, name, 'schema/fields', solr_mode)
     except HTTPError as error:
         this_error = error
     if isinstance(this_error, HTTPError):
@@ -266,6 +528,7 @@ def set_schema(name, solr_mode='collections', *v):
             data['replace-field'].append(solr_field(**field))
             continue
         data['add-field'].append(solr_field(**field))
+    get_client().invalidate(name)
     return post_solr(json.dumps(data), name, api='schema')
 
 def wait_for_success(function, error, *rest):
@@ -276,7 +539,7 @@ def wait_for_success(function, error, *rest):
                 return True
         except error:
             pass
-        print({'waiting': function.__name__, 'count': i})
+        event('waiting', function=function.__name__, count=i)
         sleep(1.0)
     return False
 
@@ -298,6 +561,7 @@ def create_collection(name, shards=1, replication=1, set_schema=True):
                        'replicationFactor':replication,
                        'waitForFinalState': 'true'}}
     this_response = post_api(json.dumps(data))
+    get_client().invalidate(name)
     print(this_response)
     print('created collection {}'.format(name))
     if set_schema:
@@ -327,6 +591,7 @@ def delete_schema(name):
     for i in copyfields:
         data = {'delete-copy-field': i}
         post_solr(json.dumps(data), name, api='schema')
+    get_client().invalidate(name)
     return post_solr(json.dumps(data), name, api='schema')
 
 def delete_collection(name, drop_schema=True, drop_config=True):
@@ -337,14 +602,22 @@ def delete_collection(name, drop_schema=True, drop_config=True):
         delete_schema(name)
         print('deleted schema {}'.format(name))
     delete_api(name)
-    wait_for_success(lambda v: not ping_name(v), ValueError, name)
+    get_client().invalidate(name)
+    wait_for_success(lambda v: not check_ping(v), ValueError, name)
     if drop_config:
         delete_config(name)
         print('deleted config {}'.format(name))
+    get_client().invalidate(name)
     print('deleted collection {}'.format(name))
 
 def ping_name(name, solr_mode='cores'):
-    """ping_name: check if collection or core exists"""
+    """ping_name: check if collection or core exists using cached metadata"""
+    if RESPONSECACHE is not None and RESPONSECACHE.mode == 'replay':
+        return RESPONSECACHE.get_version(name) is not None
+    return get_client().cached(('ping', name, solr_mode), check_ping, name, solr_mode)
+
+def check_ping(name, solr_mode='cores'):
+    """check_ping: check with Solr if collection or core exists"""
     this_api = 'admin/ping' if solr_mode == 'cores' else 'admin/ping?distrib=true'
     this_error = None
     try:
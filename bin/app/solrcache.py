@@ -0,0 +1,168 @@
+"""solrcache: content addressed, compressed on-disk cache of Solr select
+responses keyed by collection, normalised query parameters and the
+collection's index version"""
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+from threading import Lock
+
+CACHEPATH = os.environ.get('SOLRCACHE_PATH', 'output/solr-cache')
+CACHESIZE = float(os.environ.get('SOLRCACHE_SIZE', 1024.0))
+MODES = ('off', 'on', 'record', 'replay')
+IGNORED = {'indent', 'wt'}
+VERSIONFILE = 'versions.json'
+
+class CacheMiss(KeyError):
+    """CacheMiss: a replay request that is not in the cache"""
+
+def normalise_params(params):
+    """normalise_params: return query parameters as sorted string pairs without
+    formatting only parameters"""
+    return sorted((str(k), str(v)) for k, v in dict(params).items() if k not in IGNORED)
+
+def get_key(name, version, params):
+    """get_key: return the hex digest of a collection, version and query"""
+    this_data = json.dumps([name, str(version), normalise_params(params)], separators=(',', ':'))
+    return hashlib.sha256(this_data.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """ResponseCache: size bounded LRU cache of Solr responses in one gzip JSON
+    file per response under a directory per collection
+
+    `on` reads the cache and records misses, `record` always queries Solr and
+    records the response, `replay` reads only the cache so runs need no Solr"""
+    def __init__(self, mode='on', cachepath=CACHEPATH, size=CACHESIZE):
+        if mode not in MODES:
+            raise ValueError('unknown Solr cache mode "{}", use {}'.format(mode, ', '.join(MODES)))
+        self.mode = mode
+        self.cachepath = cachepath
+        self.maxbytes = int(size * 1048576)
+        self.lock = Lock()
+        self.nbytes = None
+        self.versions = self.read_versions()
+
+    def get_versionfile(self):
+        return os.path.join(self.cachepath, VERSIONFILE)
+
+    def read_versions(self):
+        """read_versions: return the recorded index version of each collection"""
+        try:
+            with open(self.get_versionfile()) as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return {}
+
+    def write_versions(self):
+        os.makedirs(self.cachepath, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=self.cachepath, delete=False) as fout:
+            json.dump(self.versions, fout, indent=1, sort_keys=True)
+        os.replace(fout.name, self.get_versionfile())
+
+    def get_filename(self, name, key):
+        return os.path.join(self.cachepath, name, key + '.json.gz')
+
+    def get_files(self):
+        """get_files: return (mtime, size, filename) of every cached response"""
+        these_files = []
+        for dirpath, _, filenames in os.walk(self.cachepath):
+            for filename in filenames:
+                if not filename.endswith('.json.gz'):
+                    continue
+                this_file = os.path.join(dirpath, filename)
+                try:
+                    this_stat = os.stat(this_file)
+                except OSError:
+                    continue
+                these_files.append((this_stat.st_mtime, this_stat.st_size, this_file))
+        return these_files
+
+    def get_version(self, name):
+        """get_version: return the recorded index version of collection name"""
+        return self.versions.get(name)
+
+    def set_version(self, name, version):
+        """set_version: record the index version of collection name, dropping
+        the responses cached for any other version"""
+        with self.lock:
+            if self.versions.get(name) == version:
+                return
+            this_path = os.path.join(self.cachepath, name)
+            if os.path.isdir(this_path):
+                for filename in os.listdir(this_path):
+                    os.unlink(os.path.join(this_path, filename))
+            self.nbytes = None
+            self.versions[name] = version
+            self.write_versions()
+
+    def get(self, name, version, params):
+        """get: return the cached response or None, marking it recently used"""
+        filename = self.get_filename(name, get_key(name, version, params))
+        try:
+            with gzip.open(filename, 'rt', encoding='utf-8') as fin:
+                this_data = json.load(fin)
+        except (OSError, ValueError, EOFError):
+            return None
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return this_data
+
+    def put(self, name, version, params, data):
+        """put: write a response atomically and evict the least recently used
+        responses once the cache is over its size"""
+        filename = self.get_filename(name, get_key(name, version, params))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename), suffix='.tmp', delete=False) as fout:
+            with gzip.GzipFile(fileobj=fout, mode='wb', compresslevel=6, mtime=0) as fgz:
+                fgz.write(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        this_size = os.path.getsize(fout.name)
+        os.replace(fout.name, filename)
+        with self.lock:
+            if self.nbytes is None:
+                self.nbytes = sum(i[1] for i in self.get_files())
+            else:
+                self.nbytes += this_size
+            if self.nbytes > self.maxbytes:
+                self.evict()
+
+    def evict(self):
+        """evict: remove least recently used responses down to 90% of the size"""
+        these_files = sorted(self.get_files())
+        self.nbytes = sum(i[1] for i in these_files)
+        for (_, this_size, filename) in these_files:
+            if self.nbytes <= 0.9 * self.maxbytes:
+                break
+            try:
+                os.unlink(filename)
+            except OSError:
+                continue
+            self.nbytes -= this_size
+
+    def query(self, name, version, params, function):
+        """query: return the response for params from the cache or by calling
+        function according to the cache mode"""
+        if self.mode == 'replay':
+            this_data = self.get(name, version, params)
+            if this_data is None:
+                raise CacheMiss('no cached Solr response for {} {}'.format(name, normalise_params(params)))
+            return this_data
+        if self.mode == 'on':
+            this_data = self.get(name, version, params)
+            if this_data is not None:
+                return this_data
+        this_data = function()
+        if 'error' not in this_data:
+            self.put(name, version, params, this_data)
+        return this_data
+
+    def clear(self):
+        """clear: remove every cached response and recorded version"""
+        with self.lock:
+            for (_, _, filename) in self.get_files():
+                os.unlink(filename)
+            self.versions = {}
+            self.nbytes = 0
+            self.write_versions()
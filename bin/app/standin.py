@@ -0,0 +1,218 @@
+"""standin: minimal local HTTP stand-in for the Solr select, ping, luke, facet,
+group and JSON update requests made by `app.solr`, serving docs held in memory"""
+import os
+import re
+import json
+from collections import Counter
+from threading import Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TERM_RE = re.compile(r'^(?P<field>[^:\s()]+):(?P<value>.+)$')
+QUOTED_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def read_cores(dirname):
+    """read_cores: return a dict of core name to docs sorted by `id` from the
+    `<core>.jsonl` files in dirname"""
+    cores = {}
+    for filename in sorted(os.listdir(dirname)):
+        (name, extension) = os.path.splitext(filename)
+        if extension != '.jsonl':
+            continue
+        with open(os.path.join(dirname, filename)) as fin:
+            cores[name] = sorted((json.loads(i) for i in fin if i.strip()), key=lambda v: str(v.get('id', '')))
+    return cores
+
+def split_or(search_str):
+    """split_or: split a query on top level `OR` outside brackets and quotes"""
+    (terms, depth, quoted, start) = ([], 0, False, 0)
+    n = 0
+    while n < len(search_str):
+        c = search_str[n]
+        if c == '\\':
+            n += 2
+            continue
+        if c == '"':
+            quoted = not quoted
+        elif not quoted and c == '(':
+            depth += 1
+        elif not quoted and c == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and search_str.startswith(' OR ', n):
+            terms.append(search_str[start:n])
+            start = n + 4
+            n += 3
+        n += 1
+    terms.append(search_str[start:])
+    return [i.strip() for i in terms if i.strip()]
+
+def get_matcher(search_str):
+    """get_matcher: return a doc predicate for `*:*`, `field:value`,
+    `field:prefix*` and `field:("a" OR "b")` terms joined by `OR`"""
+    if search_str.strip() in ('', '*:*'):
+        return lambda doc: True
+    predicates = []
+    for term in split_or(search_str):
+        this_match = TERM_RE.match(term)
+        if this_match is None:
+            raise ValueError('unsupported query: {}'.format(term))
+        (field, value) = (this_match.group('field'), this_match.group('value').strip())
+        if value.startswith('('):
+            values = {i.replace('\\"', '"').replace('\\\\', '\\') for i in QUOTED_RE.findall(value)}
+            predicates.append(lambda doc, f=field, v=values: str(doc.get(f)) in v)
+        elif value == '*':
+            predicates.append(lambda doc, f=field: f in doc)
+        elif value.endswith('*'):
+            predicates.append(lambda doc, f=field, v=value[:-1]: str(doc.get(f, '')).startswith(v))
+        else:
+            predicates.append(lambda doc, f=field, v=value.strip('"'): str(doc.get(f)) == v)
+    return lambda doc: any(i(doc) for i in predicates)
+
+def select_fields(doc, fields):
+    if not fields:
+        return doc
+    return {k: doc[k] for k in fields if k in doc}
+
+class SolrStandin:
+    """SolrStandin: in-memory cores answering `app.solr` select requests"""
+    def __init__(self, cores, nmatch=64):
+        self.cores = cores
+        self.requests = Counter()
+        self.matches = {}
+        self.nmatch = nmatch
+        self.versions = {k: len(v) for k, v in cores.items()}
+        self.pending = {k: [] for k in cores}
+        self.lock = Lock()
+
+    def get_docs(self, name, search_str):
+        """get_docs: return the docs in core name matching search_str, keeping
+        recent matches so cursor paging does not filter the core per page"""
+        if search_str.strip() in ('', '*:*'):
+            return self.cores[name]
+        key = (name, search_str)
+        if key not in self.matches:
+            if len(self.matches) >= self.nmatch:
+                self.matches.clear()
+            matcher = get_matcher(search_str)
+            self.matches[key] = [i for i in self.cores[name] if matcher(i)]
+        return self.matches[key]
+
+    def select(self, name, params):
+        """select: return the Solr JSON response for select params"""
+        docs = self.get_docs(name, params.get('q', '*:*'))
+        fields = [i for i in params.get('fl', '').split(',') if i]
+        response = {'responseHeader': {'status': 0, 'QTime': 0}}
+        rows = int(params.get('rows', 10))
+        if params.get('facet') == 'true':
+            field = params['facet.field']
+            limit = int(params.get('facet.limit', 100))
+            counts = Counter(str(i[field]) for i in docs if field in i).most_common(None if limit < 0 else limit)
+            response['facet_counts'] = {'facet_fields': {field: [j for i in counts for j in i]}}
+        if params.get('group') == 'true':
+            field = params['group.field']
+            limit = int(params.get('group.limit', 1))
+            groups = {}
+            for i in docs:
+                if field in i:
+                    groups.setdefault(str(i[field]), []).append(select_fields(i, fields))
+            response['grouped'] = {field: {'matches': len(docs),
+                                           'groups': [{'groupValue': k, 'doclist': {'numFound': len(v), 'docs': v[:limit]}}
+                                                      for k, v in list(groups.items())[:rows]]}}
+            return response
+        if 'cursorMark' in params:
+            start = 0 if params['cursorMark'] == '*' else int(params['cursorMark'])
+            response['nextCursorMark'] = str(min(start + rows, len(docs))) if start < len(docs) else params['cursorMark']
+        else:
+            start = int(params.get('start', 0))
+        response['response'] = {'numFound': len(docs), 'start': start,
+                                'docs': [select_fields(i, fields) for i in docs[start:start + rows]]}
+        return response
+
+    def update(self, name, api, params, body):
+        """update: add or atomically `set` the posted docs by `id`, applying
+        them on a commit or `commitWithin`"""
+        docs = json.loads(body or '[]')
+        docs = docs if isinstance(docs, list) else [docs]
+        if any('id' not in i for i in docs):
+            raise ValueError('Document is missing mandatory uniqueKey field: id')
+        with self.lock:
+            self.pending[name].extend((api, i) for i in docs)
+            if params.get('commit') == 'true' or 'commitWithin' in params:
+                self.commit(name)
+        return {'responseHeader': {'status': 0, 'QTime': 0}}
+
+    def commit(self, name):
+        """commit: apply pending updates to core name"""
+        docs = {str(i['id']): i for i in self.cores[name]}
+        for (api, doc) in self.pending[name]:
+            this_id = str(doc['id'])
+            if api == 'update/json' and any(isinstance(v, dict) and 'set' in v for v in doc.values()):
+                doc = {**docs.get(this_id, {}), **{k: v['set'] if isinstance(v, dict) else v for k, v in doc.items()}}
+            docs[this_id] = doc
+        self.pending[name] = []
+        self.cores[name] = sorted(docs.values(), key=lambda v: str(v.get('id', '')))
+        self.versions[name] += 1
+        self.matches.clear()
+
+    def get_response(self, method, path, params, body=None):
+        """get_response: return (status, data) for a request path"""
+        self.requests[method] += 1
+        parts = [i for i in path.split('/') if i]
+        if len(parts) >= 3 and parts[0] == 'solr' and parts[1] in self.cores:
+            (name, api) = (parts[1], '/'.join(parts[2:]))
+            if api == 'admin/ping':
+                return (200, {'responseHeader': {'status': 0}, 'status': 'OK'})
+            if api == 'admin/luke':
+                return (200, {'responseHeader': {'status': 0},
+                              'index': {'numDocs': len(self.cores[name]), 'version': self.versions[name]}})
+            try:
+                if api == 'select':
+                    return (200, self.select(name, params))
+                if api in ('update/json/docs', 'update/json') and method == 'POST':
+                    return (200, self.update(name, api, params, body))
+            except (KeyError, ValueError) as error:
+                return (400, {'responseHeader': {'status': 400}, 'error': {'msg': str(error), 'code': 400}})
+        if len(parts) >= 2 and parts[0] == 'solr':
+            return (404, {'error': {'msg': 'no such core: {}'.format(parts[1]), 'code': 404}})
+        return (404, {'error': {'msg': 'not found: {}'.format(path), 'code': 404}})
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """StandinHandler: HTTP/1.1 keep-alive handler for a SolrStandin"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    standin = None
+
+    def send_data(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_params(self, query, body=''):
+        params = parse_qs(query, keep_blank_values=True)
+        params.update(parse_qs(body, keep_blank_values=True))
+        return {k: v[-1] for k, v in params.items()}
+
+    def do_GET(self):
+        this_url = urlsplit(self.path)
+        self.send_data(*self.standin.get_response('GET', this_url.path, self.get_params(this_url.query)))
+
+    def do_POST(self):
+        this_url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        if '/update' in this_url.path:
+            self.send_data(*self.standin.get_response('POST', this_url.path, self.get_params(this_url.query), body))
+            return
+        self.send_data(*self.standin.get_response('POST', this_url.path, self.get_params(this_url.query, body)))
+
+    def log_message(self, *args):
+        return None
+
+def get_server(standin, host='127.0.0.1', port=8983):
+    """get_server: return a threaded HTTP server for a SolrStandin"""
+    handler = type('Handler', (StandinHandler,), {'standin': standin})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,180 @@
+"""store: read and write pipeline intermediate files as columnar Parquet or JSONL"""
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FLOAT_COLUMNS = {'latitude', 'longitude'}
+BATCHSIZE = 65536
+EXTENSIONS = {'parquet': '.parquet', 'jsonl': '.jsonl'}
+
+def get_format(filename):
+    """get_format: return `parquet` or `jsonl` from a filename extension"""
+    if filename.endswith('.parquet'):
+        return 'parquet'
+    return 'jsonl'
+
+def get_filename(filestub, this_format='parquet'):
+    """get_filename: return filename for a file stub and output format"""
+    return filestub + EXTENSIONS[this_format]
+
+def find_file(filestub):
+    """find_file: return the Parquet file for filestub if present otherwise JSONL"""
+    for this_format in ['parquet', 'jsonl']:
+        filename = get_filename(filestub, this_format)
+        if os.path.exists(filename):
+            return filename
+    raise OSError(2, 'No such file or directory: \'{}\''.format(get_filename(filestub)))
+
+def get_schema(columns):
+    """get_schema: return arrow schema with float coordinate and string columns"""
+    return pa.schema([(i, pa.float64() if i in FLOAT_COLUMNS else pa.string()) for i in columns])
+
+def clean_json(this_record):
+    """clean_json: remove empty values from a record"""
+    return {k: v for k, v in this_record.items() if isinstance(v, list) or (v is not None and v != '')}
+
+def write_jsonl(records, filename):
+    """write_jsonl: write an iterable of dict records as newline separated JSON
+    lines with no newline after the last record"""
+    with open(filename, 'w') as fout:
+        separator = ''
+        for record in records:
+            fout.write(separator + json.dumps(clean_json(record)))
+            separator = '\n'
+
+def write_parquet(records, filename, columns, batchsize=BATCHSIZE):
+    """write_parquet: write an iterable of dict records as Parquet in batches of
+    `batchsize` rows with dictionary encoded string columns"""
+    schema = get_schema(columns)
+    with pq.ParquetWriter(filename, schema, use_dictionary=True) as writer:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batchsize:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+def merge_files(partfiles, filename):
+    """merge_files: join part files written in the format of filename in order
+    without parsing the records, returning the number of rows"""
+    nrows = 0
+    if get_format(filename) == 'parquet':
+        schema = pq.read_schema(partfiles[0])
+        with pq.ParquetWriter(filename, schema, use_dictionary=True) as writer:
+            for partfile in partfiles:
+                this_file = pq.ParquetFile(partfile)
+                for n in range(this_file.num_row_groups):
+                    writer.write_table(this_file.read_row_group(n))
+                nrows += this_file.metadata.num_rows
+        return nrows
+    with open(filename, 'wb') as fout:
+        for partfile in partfiles:
+            if not os.path.getsize(partfile):
+                continue
+            if nrows:
+                fout.write(b'\n')
+            nrows += 1
+            with open(partfile, 'rb') as fin:
+                for block in iter(lambda: fin.read(1 << 20), b''):
+                    nrows += block.count(b'\n')
+                    fout.write(block)
+    return nrows
+
+def iter_tables(parquetfile, size):
+    """iter_tables: yield tables of exactly `size` rows from a Parquet file,
+    except the last which holds the remaining rows"""
+    (tables, nrows) = ([], 0)
+    for batch in parquetfile.iter_batches(batch_size=size):
+        tables.append(pa.Table.from_batches([batch]))
+        nrows += batch.num_rows
+        while nrows >= size:
+            this_table = pa.concat_tables(tables)
+            yield this_table.slice(0, size)
+            (tables, nrows) = ([this_table.slice(size)], nrows - size)
+    if nrows:
+        yield pa.concat_tables(tables)
+
+def interleave_files(partfiles, filename, batchsize=BATCHSIZE):
+    """interleave_files: join part files where part k holds records k, k + n,
+    k + 2n and so on of a sequence split n ways back into sequence order,
+    returning the number of rows"""
+    nrows = 0
+    if get_format(filename) == 'parquet':
+        these_files = [pq.ParquetFile(i) for i in partfiles]
+        these_tables = [iter_tables(i, batchsize) for i in these_files]
+        with pq.ParquetWriter(filename, these_files[0].schema_arrow, use_dictionary=True) as writer:
+            while True:
+                tables = [i for i in (next(j, None) for j in these_tables) if i is not None]
+                if not tables:
+                    break
+                # Part sizes differ by at most one row so the shorter parts
+                # are always the last ones
+                lengths = np.asarray([i.num_rows for i in tables])
+                offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+                (row, part) = np.meshgrid(np.arange(lengths.max()), np.arange(len(tables)), indexing='ij')
+                mask = row < lengths[part]
+                writer.write_table(pa.concat_tables(tables).take(pa.array((offsets[part] + row)[mask])))
+                nrows += int(lengths.sum())
+        return nrows
+    these_files = [open(i) for i in partfiles]
+    try:
+        with open(filename, 'w') as fout:
+            while True:
+                lines = [i for i in (j.readline() for j in these_files) if i]
+                if not lines:
+                    break
+                for line in lines:
+                    fout.write(('\n' if nrows else '') + line.rstrip('\n'))
+                    nrows += 1
+    finally:
+        for fin in these_files:
+            fin.close()
+    return nrows
+
+def write_records(records, filename, columns=None):
+    """write_records: stream dict records to filename in the format given by
+    its extension, the Parquet format requires a list of `columns`"""
+    if get_format(filename) == 'parquet':
+        return write_parquet(records, filename, columns)
+    return write_jsonl(records, filename)
+
+def normalise_frame(this_df):
+    """normalise_frame: make object columns arrow friendly with null for empty
+    values and lists wrapped consistently for multi-valued columns"""
+    this_df = this_df.copy()
+    for column in this_df.columns:
+        if column in FLOAT_COLUMNS:
+            this_df[column] = pd.to_numeric(this_df[column], errors='coerce')
+            continue
+        if this_df[column].dtype != 'object':
+            continue
+        this_series = this_df[column].where(this_df[column].apply(lambda v: isinstance(v, list) or v != ''))
+        if this_series.apply(lambda v: isinstance(v, list)).any():
+            this_df[column] = this_series.apply(lambda v: v if isinstance(v, list) or v is None or v != v else [v])
+            continue
+        this_df[column] = this_series.where(this_series.isna(), this_series.astype(str))
+    return this_df
+
+def write_frame(this_df, filename):
+    """write_frame: write a DataFrame in the format given by the filename extension"""
+    if get_format(filename) == 'parquet':
+        normalise_frame(this_df).to_parquet(filename, index=False)
+        return
+    write_jsonl(this_df.fillna('').to_dict(orient='records'), filename)
+
+def read_frame(filename, columns=None):
+    """read_frame: read a Parquet or JSONL file optionally limited to `columns`"""
+    if get_format(filename) == 'parquet':
+        if columns:
+            these_columns = set(pq.read_schema(filename).names)
+            return pd.read_parquet(filename, columns=[i for i in columns if i in these_columns]).reindex(columns=columns)
+        return pd.read_parquet(filename)
+    this_df = pd.read_json(filename, dtype='object', lines=True)
+    if columns:
+        return this_df.reindex(columns=columns)
+    return this_df
@@ -0,0 +1,233 @@
+"""synthetic: reproducible synthetic GB rail location inputs at configurable
+scale for OSM, NaPTAN, BPLAN, FOI and the timetable Solr cores"""
+import os
+import gzip
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from app.boundary import POLYFILE, in_boundary
+from app.coords import trim
+
+BOUNDS = (49.9, -6.4, 58.7, 1.8)
+LETTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+WORDS = ['ABER', 'ASH', 'BAR', 'BEECH', 'BRAD', 'BROOK', 'BURN', 'CASTLE', 'CHAPEL', 'CLIFF', 'COLD', 'CROSS',
+         'DALE', 'DEAN', 'EAST', 'ELM', 'FAIR', 'FIELD', 'FORD', 'GLEN', 'GREEN', 'HAM', 'HAMP', 'HEATH',
+         'HILL', 'HOLM', 'KING', 'KIRK', 'LAKE', 'LEA', 'LONG', 'MARSH', 'MILL', 'MOOR', 'NEW', 'NORTH',
+         'OAK', 'PORT', 'RED', 'RIVER', 'ROCK', 'SAND', 'SHAW', 'SOUTH', 'STAN', 'STOKE', 'STON', 'THORN',
+         'TON', 'WATER', 'WELL', 'WEST', 'WICK', 'WOOD', 'WORTH']
+SUFFIXES = ['', '', '', '', ' JN', ' JUNCTION', ' SIDINGS', ' SDG', ' YARD', ' GF', ' SIG 12', ' DEPOT',
+            ' NORTH', ' SOUTH', ' EAST', ' WEST', ' C.E. SIDINGS', ' GOODS LOOP', ' LC']
+RAILWAY = ['station', 'halt', 'signal', 'junction', 'switch', 'level_crossing', 'buffer_stop']
+STOPTYPES = ['RLY', 'RSE', 'RPL']
+DATE = '01-01-1995 00:00:00'
+
+def get_rng(seed=0):
+    return np.random.default_rng(seed)
+
+def get_points(n, rng, filename=POLYFILE):
+    """get_points: return n random (latitude, longitude) arrays inside the GB
+    boundary, or its bounding box where there is no boundary file"""
+    (south, west, north, east) = BOUNDS
+    (latitude, longitude) = (np.empty(0), np.empty(0))
+    while latitude.shape[0] < n:
+        m = max(2 * (n - latitude.shape[0]), 1024)
+        this_latitude = rng.uniform(south, north, m)
+        this_longitude = rng.uniform(west, east, m)
+        if os.path.exists(filename):
+            mask = in_boundary(this_latitude, this_longitude, filename)
+            (this_latitude, this_longitude) = (this_latitude[mask], this_longitude[mask])
+        latitude = np.concatenate([latitude, this_latitude])
+        longitude = np.concatenate([longitude, this_longitude])
+    return (trim(latitude[:n]), trim(longitude[:n]))
+
+def get_tiplocs(n, rng):
+    """get_tiplocs: return n unique random 4 to 7 letter TIPLOC codes"""
+    tiplocs = pd.Index([])
+    while tiplocs.shape[0] < n:
+        m = 2 * (n - tiplocs.shape[0]) + 64
+        lengths = rng.integers(4, 8, m)
+        letters = LETTERS[rng.integers(0, 26, (m, 7))]
+        codes = [''.join(i[:j]) for i, j in zip(letters, lengths)]
+        tiplocs = tiplocs.append(pd.Index(codes)).unique()
+    return tiplocs[:n].to_numpy(dtype='object')
+
+def get_names(n, rng):
+    """get_names: return n random upper case location descriptions"""
+    first = np.asarray(WORDS, dtype='object')[rng.integers(0, len(WORDS), n)]
+    second = np.asarray(WORDS, dtype='object')[rng.integers(0, len(WORDS), n)]
+    suffix = np.asarray(SUFFIXES, dtype='object')[rng.integers(0, len(SUFFIXES), n)]
+    return first + second.astype(str) + suffix.astype(str)
+
+def get_locations(n, seed=0):
+    """get_locations: return the synthetic reference TIPLOC locations"""
+    rng = get_rng(seed)
+    (latitude, longitude) = get_points(n, rng)
+    return pd.DataFrame({'TIPLOC': get_tiplocs(n, rng), 'Description': get_names(n, rng),
+                         'latitude': latitude, 'longitude': longitude})
+
+def jitter(locations, rng, metres=50.0, outliers=0.002, outlier_metres=20000.0):
+    """jitter: return latitude and longitude arrays moved by about `metres`
+    with a fraction of `outliers` moved by about `outlier_metres`"""
+    n = locations.shape[0]
+    scale = np.where(rng.random(n) < outliers, outlier_metres, metres) / 111320.0
+    latitude = locations['latitude'].to_numpy() + rng.normal(0.0, scale)
+    longitude = locations['longitude'].to_numpy() + rng.normal(0.0, scale) / np.cos(np.radians(latitude))
+    return (trim(latitude), trim(longitude))
+
+def get_sample(locations, share, rng):
+    """get_sample: return a random `share` of the reference locations"""
+    return locations[rng.random(locations.shape[0]) < share].reset_index(drop=True)
+
+def write_osm(locations, filename, seed=0, share=0.6, nfeature=None):
+    """write_osm: write an OSM XML rail extract with `nfeature` tagged nodes,
+    tagged with `ref:tiploc` for a share of the locations, and a closed
+    platform way for one in ten nodes, returning the number of features"""
+    rng = get_rng(seed + 1)
+    nfeature = nfeature or locations.shape[0]
+    this_df = locations.iloc[rng.integers(0, locations.shape[0], nfeature)].reset_index(drop=True)
+    (latitude, longitude) = jitter(this_df, rng)
+    tagged = rng.random(nfeature) < share
+    railway = np.asarray(RAILWAY, dtype='object')[rng.integers(0, len(RAILWAY), nfeature)]
+    (node_id, way_id, nway) = (1, 1, 0)
+    with open(filename, 'w') as fout:
+        fout.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="synthetic">\n')
+        fout.write(' <bounds minlat="{}" minlon="{}" maxlat="{}" maxlon="{}"/>\n'.format(*BOUNDS))
+        ways = []
+        for n in range(nfeature):
+            fout.write(' <node id="{}" version="1" lat="{}" lon="{}">\n'.format(node_id, latitude[n], longitude[n]))
+            fout.write('  <tag k="railway" v="{}"/>\n'.format(railway[n]))
+            fout.write('  <tag k="name" v="{}"/>\n'.format(this_df.at[n, 'Description'].title()))
+            if tagged[n]:
+                fout.write('  <tag k="ref:tiploc" v="{}"/>\n'.format(this_df.at[n, 'TIPLOC']))
+            fout.write(' </node>\n')
+            node_id += 1
+            if n % 10 == 0:
+                corners = [(latitude[n] + i, longitude[n] + j) for i, j in
+                           [(0.0, 0.0), (0.0002, 0.0), (0.0002, 0.0008), (0.0, 0.0008)]]
+                for this_latitude, this_longitude in corners:
+                    fout.write(' <node id="{}" version="1" lat="{:.7f}" lon="{:.7f}"/>\n'.format(node_id, this_latitude, this_longitude))
+                    node_id += 1
+                ways.append((list(range(node_id - 4, node_id)), n))
+        for these_nodes, n in ways:
+            fout.write(' <way id="{}" version="1">\n'.format(way_id))
+            for i in these_nodes + these_nodes[:1]:
+                fout.write('  <nd ref="{}"/>\n'.format(i))
+            fout.write('  <tag k="railway" v="platform"/>\n  <tag k="area" v="yes"/>\n')
+            fout.write('  <tag k="name" v="{}"/>\n'.format(this_df.at[n, 'Description'].title()))
+            if tagged[n]:
+                fout.write('  <tag k="ref:tiploc" v="{}"/>\n'.format(this_df.at[n, 'TIPLOC']))
+            fout.write(' </way>\n')
+            (way_id, nway) = (way_id + 1, nway + 1)
+        fout.write('</osm>\n')
+    return nfeature + nway
+
+def get_naptan(locations, seed=0, share=0.5):
+    """get_naptan: return NaPTAN StopPoint and StopArea Solr docs with the
+    flattened field names of the NaPTAN cores"""
+    rng = get_rng(seed + 2)
+    this_df = get_sample(locations, share, rng)
+    (latitude, longitude) = jitter(this_df, rng, metres=30.0)
+    location = ['{},{}'.format(i, j) for i, j in zip(latitude, longitude)]
+    stoptype = np.asarray(STOPTYPES, dtype='object')[rng.integers(0, len(STOPTYPES), this_df.shape[0])]
+    points = pd.DataFrame({'id': ['9100' + i for i in this_df['TIPLOC']],
+                           '_location_': location,
+                           'Status': 'active',
+                           'AtcoCode': ['9100' + i for i in this_df['TIPLOC']],
+                           'AdministrativeAreaRef': '110',
+                           'StopAreas.StopAreaRef.value': ['910G' + i for i in this_df['TIPLOC']],
+                           'Descriptor.CommonName': this_df['Description'].str.title() + ' Rail Station',
+                           'StopClassification.StopType': stoptype,
+                           'StopClassification.OffStreet.Rail.AnnotatedRailRef.TiplocRef': this_df['TIPLOC'],
+                           'StopClassification.OffStreet.Rail.AnnotatedRailRef.StationName': this_df['Description'].str.title(),
+                           'Place.Town': this_df['Description'].str.title()})
+    areas = pd.DataFrame({'id': ['910G' + i for i in this_df['TIPLOC']],
+                          '_location_': location,
+                          'AdministrativeAreaRef': '110',
+                          'Name': this_df['Description'].str.title() + ' Rail Station',
+                          'Status': 'active',
+                          'StopAreaCode': ['910G' + i for i in this_df['TIPLOC']],
+                          'StopAreaType': 'GRLS'})
+    return (points.to_dict(orient='records'), areas.to_dict(orient='records'))
+
+def to_osgb(latitude, longitude):
+    """to_osgb: return rounded (easting, northing) arrays for WGS84 points"""
+    this_transformer = Transformer.from_crs('EPSG:4326', 'EPSG:27700', always_xy=True)
+    (easting, northing) = this_transformer.transform(np.asarray(longitude), np.asarray(latitude))
+    return (np.round(easting).astype('int64'), np.round(northing).astype('int64'))
+
+def write_bplan(locations, filename, seed=0, share=0.8):
+    """write_bplan: write a gzip BPLAN Geography archive with LOC records for a
+    share of the locations, an NWK link between neighbouring locations and
+    the PIF header and PIT trailer, returning the number of records"""
+    rng = get_rng(seed + 3)
+    this_df = get_sample(locations, share, rng)
+    (latitude, longitude) = jitter(this_df, rng, metres=20.0)
+    (easting, northing) = to_osgb(latitude, longitude)
+    order = np.lexsort((this_df['longitude'].to_numpy(), np.round(this_df['latitude'].to_numpy(), 1)))
+    tiplocs = this_df['TIPLOC'].to_numpy()[order]
+    with gzip.open(filename, 'wt', newline='') as fout:
+        fout.write('PIF\t1.0\tNR\t\t{}\t{}\tF\t1\t{}\t1\r\n'.format(DATE, DATE, DATE))
+        for i, j, k, l, m in zip(this_df['TIPLOC'], this_df['Description'], easting, northing,
+                                 rng.integers(10000, 90000, this_df.shape[0])):
+            fout.write('LOC\tA\t{}\t{}\t{}\t\t{}\t{}\tT\t1\t{}\t \t\r\n'.format(i, j, DATE, k, l, m))
+        for i, j, k in zip(tiplocs[:-1], tiplocs[1:], rng.integers(100, 5000, max(len(tiplocs) - 1, 0))):
+            fout.write('NWK\tA\t{}\t{}\tML\tMain Line\t{}\t\tU\tU\t{}\tN\tN\tN\t1\tN\tD\t8\t\r\n'.format(i, j, DATE, k))
+        fout.write('PIT\t0\t0\t{}\t0\t{}\t0\r\n'.format(this_df.shape[0], max(len(tiplocs) - 1, 0)))
+    return 2 * this_df.shape[0] + 1
+
+def write_foi(locations, filename, seed=0, share=0.7):
+    """write_foi: write the FOI TIPLOC easting and northing spreadsheet for a
+    share of the locations, returning the number of rows"""
+    rng = get_rng(seed + 4)
+    this_df = get_sample(locations, share, rng)
+    (latitude, longitude) = jitter(this_df, rng, metres=20.0)
+    (easting, northing) = to_osgb(latitude, longitude)
+    pd.DataFrame({'TIPLOC': this_df['TIPLOC'], 'NAME': this_df['Description'],
+                  'EASTING': easting, 'NORTHING': northing}).to_excel(filename, sheet_name='TIPLOC', index=False)
+    return this_df.shape[0]
+
+def get_timetable(locations, seed=0, npath=None, length=12):
+    """get_timetable: return PATH, TR and BS Solr docs for `npath` schedules
+    of `length` stops over the locations and one TR record per TIPLOC"""
+    rng = get_rng(seed + 5)
+    npath = npath or max(locations.shape[0] // 4, 1)
+    tiplocs = locations['TIPLOC'].to_numpy()
+    start = rng.integers(0, len(tiplocs), npath)
+    paths = [{'id': '{}:{}'.format(n, m), 'UUID': 'U{:08d}'.format(n), 'TIPLOC': tiplocs[(i + m) % len(tiplocs)]}
+             for n, i in enumerate(start) for m in range(length)]
+    schedules = [{'id': 'U{:08d}'.format(n), 'UUID': 'U{:08d}'.format(n),
+                  'Headcode': '{}{}{:02d}'.format(rng.integers(0, 10), LETTERS[rng.integers(0, 26)], n % 100)}
+                 for n in range(npath)]
+    names = [{'id': i, 'TIPLOC': i, 'TPS_Description': j, 'Stanox': '{:05d}'.format(n)}
+             for n, (i, j) in enumerate(zip(tiplocs, locations['Description']))]
+    return {'PATH': paths, 'BS': schedules, 'TR': names}
+
+def write_docs(docs, filename):
+    """write_docs: write Solr docs as JSON lines"""
+    with open(filename, 'w') as fout:
+        for i in docs:
+            fout.write(json.dumps({k: v for k, v in i.items() if v is not None}) + '\n')
+    return len(docs)
+
+def write_inputs(workdir, n, seed=0, features=1.0, datapath='data'):
+    """write_inputs: write every synthetic input for n locations into workdir
+    laid out as the pipeline expects, returning the rows for each stage"""
+    for i in ['data', 'output', 'solr']:
+        os.makedirs(os.path.join(workdir, i), exist_ok=True)
+    for i in ['TIPLOC-map.tsv', 'wikipedia-map.tsv', 'overlap-map.tsv', 'great-britain.poly', 'osmconfig.ini']:
+        shutil.copy(os.path.join(datapath, i), os.path.join(workdir, 'data', i))
+    locations = get_locations(n, seed)
+    nfeature = write_osm(locations, os.path.join(workdir, 'great-britain-rail-all.osm'), seed,
+                         nfeature=int(n * features))
+    (points, areas) = get_naptan(locations, seed)
+    write_docs(points, os.path.join(workdir, 'solr', 'StopPoint.jsonl'))
+    write_docs(areas, os.path.join(workdir, 'solr', 'StopArea.jsonl'))
+    timetable = get_timetable(locations, seed)
+    for k, v in timetable.items():
+        write_docs(v, os.path.join(workdir, 'solr', '{}.jsonl'.format(k)))
+    nbplan = write_bplan(locations, os.path.join(workdir, 'output', 'Geography-full.gz'), seed)
+    write_foi(locations, os.path.join(workdir, 'output', 'TIPLOC_Eastings_and_Northings.xlsx'), seed)
+    return {'OSM': nfeature, 'NaPTAN': len(points) + len(areas), 'BPLAN': nbplan,
+            'solr': len(timetable['TR']) + len(timetable['PATH']), 'locations': n}
@@ -0,0 +1,153 @@
+"""tiplocdb: compiled, sorted, fixed-width TIPLOC location index read through
+mmap with binary search lookups and no parsing on open"""
+import os
+import mmap
+import struct
+from collections import namedtuple
+import numpy as np
+
+REPORT = 'locations-report.tsv'
+EXTENSION = '.idx'
+MAGIC = b'TIPLOCDB'
+VERSION = 1
+
+# magic, version, number of types, number of records, type table offset and
+# length, string table offset
+HEADER = struct.Struct('<8sHHIQIQ')
+RECORD = np.dtype([('key', 'S7'), ('type', 'u1'), ('latitude', '<f8'), ('longitude', '<f8'),
+                   ('offset', '<u4'), ('length', '<u4')])
+
+Location = namedtuple('Location', ['TIPLOC', 'type', 'Description', 'latitude', 'longitude'])
+
+def get_dbfile(filename=REPORT):
+    return os.path.splitext(filename)[0] + EXTENSION
+
+def encode(values):
+    return [('' if i is None or i != i else str(i)).encode('utf-8') for i in values]
+
+def compile_index(locations, filename):
+    """compile_index: write a locations frame indexed by TIPLOC to a sorted
+    fixed-width index file, replacing any existing file atomically"""
+    keys = encode(locations.index)
+    if any(len(i) > RECORD['key'].itemsize for i in keys):
+        raise ValueError('TIPLOC longer than {} bytes'.format(RECORD['key'].itemsize))
+    order = np.argsort(np.asarray(keys, dtype=RECORD['key']), kind='stable')
+    types = [''] + sorted(set(locations['type'].dropna().astype(str)) - {''})
+    type_codes = {k: n for n, k in enumerate(types)}
+    if len(types) > 256:
+        raise ValueError('more than 255 location types')
+    descriptions = encode(locations['Description'])
+    records = np.zeros(len(keys), dtype=RECORD)
+    records['key'] = np.asarray(keys, dtype=RECORD['key'])[order]
+    this_types = locations['type'].where(locations['type'].notna(), '').astype(str)
+    records['type'] = np.asarray([type_codes[i] for i in this_types], dtype='u1')[order]
+    records['latitude'] = locations['latitude'].to_numpy(dtype='float64')[order]
+    records['longitude'] = locations['longitude'].to_numpy(dtype='float64')[order]
+    lengths = np.asarray([len(descriptions[i]) for i in order], dtype='int64')
+    records['length'] = lengths
+    records['offset'] = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if len(lengths) else lengths
+    type_table = '\n'.join(types).encode('utf-8')
+    types_offset = HEADER.size + records.nbytes
+    strings_offset = types_offset + len(type_table)
+    tmpfile = '{}.{}'.format(filename, os.getpid())
+    with open(tmpfile, 'wb') as fout:
+        fout.write(HEADER.pack(MAGIC, VERSION, len(types), len(keys), types_offset, len(type_table), strings_offset))
+        fout.write(records.tobytes())
+        fout.write(type_table)
+        for i in order:
+            fout.write(descriptions[i])
+    os.replace(tmpfile, filename)
+
+def write_db(filename=REPORT):
+    """write_db: compile the index for a locations report next to the report"""
+    from app.nearest import read_locations
+    compile_index(read_locations(filename), get_dbfile(filename))
+    return get_dbfile(filename)
+
+class TiplocDB:
+    """TiplocDB: read only view of a compiled index file
+
+    The arrays over the mmap are kept private and `keys` and `records` return
+    copies so that no view of the mmap outlives `close`"""
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fin:
+            self.mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, count, types_offset, types_length, strings_offset) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError('{}: not a version {} TIPLOC index'.format(filename, VERSION))
+        self._records = np.frombuffer(self.mm, dtype=RECORD, count=count, offset=HEADER.size)
+        self._keys = self._records['key']
+        self.types = self.mm[types_offset:types_offset + types_length].decode('utf-8').split('\n')
+        self.strings_offset = strings_offset
+
+    @property
+    def records(self):
+        """records: return a copy of the index records"""
+        return self._records.copy()
+
+    @property
+    def keys(self):
+        """keys: return a copy of the sorted TIPLOC keys"""
+        return self._keys.copy()
+
+    def __len__(self):
+        return self._records.shape[0]
+
+    def __contains__(self, tiploc):
+        return self.find([tiploc])[0] >= 0
+
+    def close(self):
+        # The mmap cannot be closed while an array still exports its buffer
+        (self._records, self._keys) = (None, None)
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def find(self, tiplocs):
+        """find: return record positions for tiplocs by binary search, -1 where
+        a TIPLOC is not in the index"""
+        these_tiplocs = encode(tiplocs)
+        # Keys are truncated to the key width so a longer TIPLOC is never found
+        valid = np.asarray([len(i) <= RECORD['key'].itemsize for i in these_tiplocs], dtype=bool)
+        these_keys = np.asarray(these_tiplocs, dtype=RECORD['key'])
+        if not len(self):
+            return np.full(these_keys.shape[0], -1)
+        position = np.minimum(np.searchsorted(self._keys, these_keys), len(self) - 1)
+        return np.where(valid & (self._keys[position] == these_keys), position, -1)
+
+    def get_records(self, positions):
+        """get_records: return Locations for an array of record positions"""
+        these_records = self._records[positions]
+        start = these_records['offset'].astype('int64') + self.strings_offset
+        end = start + these_records['length']
+        return [Location(key.decode('utf-8'), self.types[code] or None,
+                         self.mm[i:j].decode('utf-8') or None, latitude, longitude)
+                for key, code, i, j, latitude, longitude in zip(these_records['key'].tolist(), these_records['type'].tolist(),
+                                                                start.tolist(), end.tolist(),
+                                                                these_records['latitude'].tolist(),
+                                                                these_records['longitude'].tolist())]
+
+    def get(self, tiploc):
+        """get: return the Location for a TIPLOC or None"""
+        return self.lookup([tiploc])[0]
+
+    def lookup(self, tiplocs):
+        """lookup: return a list of Location or None for each of tiplocs"""
+        positions = self.find(tiplocs)
+        found = positions >= 0
+        these_locations = iter(self.get_records(positions[found]))
+        return [next(these_locations) if i else None for i in found.tolist()]
+
+def open_db(filename=REPORT):
+    """open_db: open the compiled index for a report, compiling it when missing
+    or older than the report"""
+    dbfile = get_dbfile(filename)
+    if not os.path.exists(dbfile) or (os.path.exists(filename) and os.path.getmtime(dbfile) < os.path.getmtime(filename)):
+        write_db(filename)
+    return TiplocDB(dbfile)
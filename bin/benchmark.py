@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+import urllib.request
+
+ARGPARSER = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic inputs served by a local Solr stand-in')
+
+ARGPARSER.add_argument('--scale', dest='scales', type=int, nargs='+', default=[10000], help='number of synthetic TIPLOC locations, repeatable')
+ARGPARSER.add_argument('--features', dest='features', type=float, default=1.0, help='OSM features per location')
+ARGPARSER.add_argument('--seed', dest='seed', type=int, default=0, help='random seed')
+ARGPARSER.add_argument('--stages', dest='stages', type=str, nargs='+', default=None, help='stages to run, default all')
+ARGPARSER.add_argument('--workers', dest='workers', type=int, default=1, help='process-osm.py worker processes')
+ARGPARSER.add_argument('--port', dest='port', type=int, default=8993, help='Solr stand-in port')
+ARGPARSER.add_argument('--workdir', dest='workdir', type=str, default=None, help='directory for generated inputs, default temporary')
+ARGPARSER.add_argument('--output', dest='outputfile', type=str, default='output/benchmark.jsonl', help='JSON lines results file, appended')
+
+ARGS = ARGPARSER.parse_args()
+
+BINPATH = os.path.dirname(os.path.abspath(__file__))
+DATAPATH = os.path.join(os.path.dirname(BINPATH), 'data')
+
+# Every stage runs in its own process so this process stays small and the
+# peak RSS reported by `wait4` is the stage's own
+GENERATE_SCRIPT = '''
+import sys, json
+from app.synthetic import write_inputs
+ROWS = write_inputs('.', int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3]), sys.argv[4])
+with open('rows.json', 'w') as fout:
+    json.dump(ROWS, fout)
+'''
+
+# The app.solr helpers on their own, as used by wtt-map2.py
+SOLR_SCRIPT = '''
+from app import solr
+TR = solr.get_frame('TR', fl='TIPLOC,TPS_Description')
+FACET = solr.get_facet('PATH', 'TIPLOC')
+SAMPLE = TR['TIPLOC'].iloc[::50].tolist()
+DOCS = solr.get_query_in('TR', 'TIPLOC', SAMPLE)
+for search_str in solr.chunk_query('TIPLOC', SAMPLE[:2048]):
+    solr.get_group('PATH', 'TIPLOC', search_str=search_str, fl='UUID,TIPLOC', ngroup=4)
+print(TR.shape[0], len(FACET) // 2, len(DOCS))
+'''
+
+STAGES = {'OSM': ['process-osm.py', 'great-britain-rail-all.osm', '--workers', str(ARGS.workers)],
+          'NaPTAN': ['process-naptan.py'],
+          'BPLAN': ['process-bplan.py', 'output/Geography-full.gz', '--force'],
+          'solr': ['-c', SOLR_SCRIPT],
+          'locations': ['wtt-map2.py']}
+
+def get_result(seconds, cpu, rss, rows, returncode=0):
+    """get_result: return a stage result with throughput in rows per second"""
+    return {'seconds': round(seconds, 3), 'cpu': round(cpu, 3), 'peak_rss_mb': round(rss, 1),
+            'rows': rows, 'rows/s': round(rows / seconds, 1) if seconds > 0 else None,
+            'returncode': returncode}
+
+def start_standin(workdir, port, timeout=600.0):
+    """start_standin: start the Solr stand-in on the generated docs and wait
+    until it answers a ping"""
+    with open(os.path.join(workdir, 'logs', 'standin.log'), 'w') as fout:
+        process = subprocess.Popen([sys.executable, os.path.join(BINPATH, 'solr-standin.py'), 'solr', '--port', str(port)],
+                                   cwd=workdir, stdout=fout, stderr=subprocess.STDOUT)
+    url = 'http://127.0.0.1:{}/solr/TR/admin/ping'.format(port)
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError('Solr stand-in exited, see {}'.format(os.path.join(workdir, 'logs', 'standin.log')))
+        try:
+            urllib.request.urlopen(url, timeout=1.0).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Solr stand-in did not start')
+
+def run_stage(workdir, name, command, port, rows):
+    """run_stage: run a stage command in workdir against the stand-in and
+    return its wall time, CPU time and peak RSS from `wait4`"""
+    env = dict(os.environ, SOLRHOST='127.0.0.1', SOLRPORT=str(port), SOLRCACHE='off', PYTHONPATH=BINPATH,
+               PATH=BINPATH + os.pathsep + os.environ.get('PATH', ''))
+    if command[0] != '-c':
+        command = [os.path.join(BINPATH, command[0])] + command[1:]
+    with open(os.path.join(workdir, 'logs', '{}.log'.format(name)), 'w') as fout:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable] + command, cwd=workdir, env=env, stdout=fout, stderr=subprocess.STDOUT)
+        (_, status, usage) = os.wait4(process.pid, 0)
+        seconds = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return get_result(seconds, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024.0, rows, process.returncode)
+
+def run_benchmark(workdir, n, seed):
+    """run_benchmark: generate inputs for n locations and time each stage"""
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    command = ['-c', GENERATE_SCRIPT, str(n), str(seed), str(ARGS.features), DATAPATH]
+    results = {'generate': run_stage(workdir, 'generate', command, ARGS.port, 0)}
+    if results['generate']['returncode']:
+        raise RuntimeError('input generation failed, see {}'.format(os.path.join(workdir, 'logs', 'generate.log')))
+    with open(os.path.join(workdir, 'rows.json')) as fin:
+        rows = json.load(fin)
+    results['generate'] = get_result(results['generate']['seconds'], results['generate']['cpu'],
+                                     results['generate']['peak_rss_mb'], sum(rows.values()))
+    start = time.monotonic()
+    standin = start_standin(workdir, ARGS.port)
+    results['standin'] = get_result(time.monotonic() - start, 0.0, 0.0, rows['solr'] + rows['NaPTAN'])
+    try:
+        for name, command in STAGES.items():
+            if ARGS.stages and name not in ARGS.stages:
+                continue
+            results[name] = run_stage(workdir, name, command, ARGS.port, rows[name])
+            print('{}: {}'.format(name, json.dumps(results[name])), file=sys.stderr, flush=True)
+    finally:
+        standin.terminate()
+        standin.wait()
+    return results
+
+for SCALE in ARGS.scales:
+    WORKDIR = ARGS.workdir or tempfile.mkdtemp(prefix='benchmark-{}-'.format(SCALE))
+    RESULT = {'scale': SCALE, 'features': int(SCALE * ARGS.features), 'seed': ARGS.seed,
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(),
+              'python': platform.python_version(), 'cpus': os.cpu_count(), 'workdir': WORKDIR,
+              'stages': run_benchmark(WORKDIR, SCALE, ARGS.seed)}
+    if not ARGS.workdir:
+        shutil.rmtree(WORKDIR)
+    print(json.dumps(RESULT))
+    os.makedirs(os.path.dirname(ARGS.outputfile) or '.', exist_ok=True)
+    with open(ARGS.outputfile, 'a') as fout:
+        fout.write(json.dumps(RESULT) + '\n')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import time
+import json
+import random
+import argparse
+import http.client
+import threading
+import numpy as np
+from app.tiplocdb import REPORT, open_db
+
+ARGPARSER = argparse.ArgumentParser(description='Measure tiploc-server.py throughput and latency percentiles')
+
+ARGPARSER.add_argument('--host', dest='host', type=str, default='127.0.0.1', help='server address')
+ARGPARSER.add_argument('--port', dest='port', type=int, default=8080, help='server port')
+ARGPARSER.add_argument('--report', dest='report', type=str, default=REPORT, help='locations report to draw TIPLOCs from')
+ARGPARSER.add_argument('--requests', dest='nrequest', type=int, default=20000, help='total requests')
+ARGPARSER.add_argument('--concurrency', dest='concurrency', type=int, default=4, help='client connections')
+ARGPARSER.add_argument('--batch', dest='batch', type=int, default=1, help='TIPLOCs per request')
+ARGPARSER.add_argument('--query', dest='query', type=str, choices=['tiploc', 'radius', 'bbox'], default='tiploc', help='request type')
+ARGPARSER.add_argument('--seed', dest='seed', type=int, default=0, help='random seed')
+
+ARGS = ARGPARSER.parse_args()
+
+with open_db(ARGS.report) as DB:
+    TIPLOCS = DB.keys.astype(str).tolist()
+    LOCATED = DB.records[~np.isnan(DB.records['latitude'])][['latitude', 'longitude']].tolist()
+
+def get_paths(n, rng):
+    """get_paths: return n request paths for the query type"""
+    if ARGS.query == 'radius':
+        return ['/radius?lat={}&lon={}&radius=1000'.format(*rng.choice(LOCATED)) for _ in range(n)]
+    if ARGS.query == 'bbox':
+        return ['/bbox?south={}&west={}&north={}&east={}'.format(i[0] - 0.01, i[1] - 0.01, i[0] + 0.01, i[1] + 0.01)
+                for i in (rng.choice(LOCATED) for _ in range(n))]
+    if ARGS.batch == 1:
+        return ['/tiploc/{}'.format(rng.choice(TIPLOCS)) for _ in range(n)]
+    return ['/tiplocs?tiploc={}'.format(','.join(rng.choices(TIPLOCS, k=ARGS.batch))) for _ in range(n)]
+
+def run_client(paths, latencies, errors):
+    connection = http.client.HTTPConnection(ARGS.host, ARGS.port)
+    for path in paths:
+        start = time.perf_counter()
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(path)
+    connection.close()
+
+RNG = random.Random(ARGS.seed)
+PATHS = get_paths(ARGS.nrequest, RNG)
+(LATENCIES, ERRORS) = ([], [])
+THREADS = [threading.Thread(target=run_client, args=(PATHS[n::ARGS.concurrency], LATENCIES, ERRORS))
+           for n in range(ARGS.concurrency)]
+START = time.perf_counter()
+for THREAD in THREADS:
+    THREAD.start()
+for THREAD in THREADS:
+    THREAD.join()
+ELAPSED = time.perf_counter() - START
+
+LATENCY = np.asarray(LATENCIES) * 1000.0
+print(json.dumps({'requests': len(LATENCIES), 'errors': len(ERRORS), 'seconds': round(ELAPSED, 3),
+                  'requests/s': round(len(LATENCIES) / ELAPSED, 1),
+                  'lookups/s': round(len(LATENCIES) * (ARGS.batch if ARGS.query == 'tiploc' else 1) / ELAPSED, 1),
+                  'p50 ms': round(float(np.percentile(LATENCY, 50)), 3),
+                  'p95 ms': round(float(np.percentile(LATENCY, 95)), 3),
+                  'p99 ms': round(float(np.percentile(LATENCY, 99)), 3)}, indent=1))
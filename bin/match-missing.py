@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import argparse
+import pandas as pd
+from app.ingest import read_bplan
+from app.matcher import TOPN, rank_suggestions
+from app.nearest import read_locations
+from app.store import find_file, read_frame
+
+ARGPARSER = argparse.ArgumentParser(description='Propose locations for missing TIPLOCs by matching descriptions to OSM, NaPTAN and BPLAN names')
+
+ARGPARSER.add_argument('--missing', dest='missing', type=str, default='missing-report.tsv', help='missing TIPLOC report')
+ARGPARSER.add_argument('--report', dest='report', type=str, default='locations-report.tsv', help='locations report')
+ARGPARSER.add_argument('--output', dest='outputfile', type=str, default='output/suggestions-report.tsv', help='suggestions report')
+ARGPARSER.add_argument('--top', dest='topn', type=int, default=TOPN, help='suggestions per TIPLOC')
+
+ARGS = ARGPARSER.parse_args()
+
+CANDIDATE_COLUMNS = ['source', 'name', 'TIPLOC', 'latitude', 'longitude']
+
+MISSING = pd.read_csv(ARGS.missing, sep='\t', dtype='object', index_col='TIPLOC')
+MISSING = MISSING.rename(columns={'TPS_Description': 'Description'})[['Description', 'count']]
+MISSING = MISSING.dropna(subset=['Description'])
+
+OSM = read_frame(find_file('OSM-All'), columns=['name', 'TIPLOC', 'latitude', 'longitude'])
+OSM = OSM.dropna(subset=['name']).assign(source='OSM')
+
+NAPTAN = read_frame(find_file('NaPTAN-All'), columns=['Name', 'TIPLOC', 'latitude', 'longitude'])
+NAPTAN = NAPTAN.rename(columns={'Name': 'name'}).dropna(subset=['name']).assign(source='NaPTAN')
+
+BPLAN = read_bplan()
+BPLAN = BPLAN.rename(columns={'Location Code': 'TIPLOC', 'Location name': 'name'}).assign(source='BPLAN')
+
+CANDIDATES = pd.concat([i.reindex(columns=CANDIDATE_COLUMNS) for i in [OSM, NAPTAN, BPLAN]], ignore_index=True)
+CANDIDATES = CANDIDATES.dropna(subset=['latitude', 'longitude']).drop_duplicates().reset_index(drop=True)
+
+SUGGESTIONS = rank_suggestions(MISSING, CANDIDATES, read_locations(ARGS.report), topn=ARGS.topn)
+SUGGESTIONS = SUGGESTIONS[['TIPLOC', 'rank', 'Description', 'count', 'candidate_source', 'candidate_name',
+                           'candidate_TIPLOC', 'candidate_latitude', 'candidate_longitude',
+                           'similarity', 'prefix', 'neighbour_distance', 'score']]
+SUGGESTIONS.to_csv(ARGS.outputfile, sep='\t', index=False, float_format='%.6f')
+
+print('TIPLOCs: {} of {} with suggestions'.format(SUGGESTIONS['TIPLOC'].nunique(), MISSING.shape[0]))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from app.solr import read_version
+
+ARGPARSER = argparse.ArgumentParser(description='Run the TIPLOC location pipeline stages, rebuilding only stages whose inputs changed')
+
+ARGPARSER.add_argument('stages', type=str, nargs='*', help='stages to bring up to date, default all')
+ARGPARSER.add_argument('--force', dest='force', type=str, action='append', default=[], help='rebuild named stage, repeatable')
+ARGPARSER.add_argument('--all', dest='rebuild_all', action='store_true', help='rebuild every stage')
+ARGPARSER.add_argument('--max-age', dest='max_age', type=float, default=None, help='rebuild download stages last built more than hours ago')
+ARGPARSER.add_argument('--jobs', dest='jobs', type=int, default=4, help='number of stages to run in parallel')
+ARGPARSER.add_argument('--workers', dest='workers', type=int, default=1, help='process-osm.py worker processes')
+ARGPARSER.add_argument('--dry-run', dest='dry_run', action='store_true', help='report stages to rebuild without running them')
+ARGPARSER.add_argument('--instrument', dest='instrument', type=str, default=None, help='append stage timing JSON lines to file')
+ARGPARSER.add_argument('--profile', dest='profile', type=str, choices=['cprofile', 'pyinstrument'], default=None, help='profile each stage into output/profile')
+ARGPARSER.add_argument('--state', dest='statefile', type=str, default='output/pipeline-state.json', help='pipeline state file')
+
+ARGS = ARGPARSER.parse_args()
+
+BINPATH = os.path.dirname(os.path.abspath(__file__))
+BLOCKSIZE = 1 << 20
+
+# Each stage declares its command, the scripts and data files it reads and the
+# files it writes. Stages that read the output of another stage run after it.
+# Stages that download or query external data are marked `download` and are
+# rebuilt by `--max-age` as their inputs do not record when the data changes.
+# Stages that read Solr cores list them as `solr` and are rebuilt when a core's
+# index version changes, such as after the weekly timetable refresh.
+STAGES = {
+    'FOI': {'command': ['process-FOI.sh', '--force'],
+            'download': True,
+            'scripts': ['bin/process-FOI.sh'],
+            'inputs': [],
+            'outputs': ['output/TIPLOC_Eastings_and_Northings.xlsx']},
+    'NaPTAN': {'command': ['process-naptan.py'],
+               'download': True,
+               'scripts': ['bin/process-naptan.py', 'bin/app/solr.py', 'bin/app/asolr.py', 'bin/app/store.py',
+                           'bin/app/instrument.py'],
+               'inputs': [],
+               'outputs': ['NaPTAN-All.parquet']},
+    'OSM-update': {'command': ['update-OSM.sh'],
+                   'download': True,
+                   'scripts': ['bin/update-OSM.sh'],
+                   'inputs': ['data/great-britain.poly'],
+                   'outputs': ['great-britain-rail-all.osm']},
+    'OSM': {'command': ['process-osm.py', '--workers', str(ARGS.workers)],
+            'scripts': ['bin/process-osm.py', 'bin/app/coords.py', 'bin/app/store.py', 'bin/app/instrument.py'],
+            'inputs': ['great-britain-rail-all.osm', 'data/osmconfig.ini'],
+            'outputs': ['OSM-All.parquet']},
+    'BPLAN': {'command': ['process-BPLAN.sh'],
+              'download': True,
+              'scripts': ['bin/process-BPLAN.sh', 'bin/process-bplan.py', 'bin/app/bplan.py',
+                          'bin/app/instrument.py'],
+              'inputs': [],
+              'outputs': ['output/BPLAN-LOC.parquet', 'output/BPLAN-NWK.parquet',
+                          'output/BPLAN-PLT.parquet', 'output/BPLAN-TLK.parquet']},
+    'locations': {'command': ['wtt-map2.py'],
+                  'solr': ['PATH', 'TR', 'BS'],
+                  'scripts': ['bin/wtt-map2.py', 'bin/app/solr.py', 'bin/app/asolr.py',
+                              'bin/app/coords.py', 'bin/app/store.py', 'bin/app/ingest.py',
+                              'bin/app/incremental.py', 'bin/app/resolver.py', 'bin/app/boundary.py',
+                              'bin/app/nearest.py', 'bin/app/consistency.py', 'bin/app/tiplocdb.py',
+                              'bin/app/instrument.py'],
+                  'inputs': ['output/TIPLOC_Eastings_and_Northings.xlsx', 'output/BPLAN-LOC.parquet',
+                             'NaPTAN-All.parquet', 'OSM-All.parquet',
+                             'data/TIPLOC-map.tsv', 'data/wikipedia-map.tsv', 'data/overlap-map.tsv',
+                             'data/great-britain.poly'],
+                  'outputs': ['locations-report.tsv', 'missing-report.tsv',
+                              'output/locations-fingerprint.tsv', 'output/locations-fingerprint.json',
+                              'output/locations-changes.tsv',
+                              'output/locations-discrepancies.tsv']},
+}
+
+def get_dependencies(stages):
+    """get_dependencies: return the stages producing each stage's inputs"""
+    producers = {j: k for k, v in stages.items() for j in v['outputs']}
+    return {k: {producers[i] for i in v['inputs'] if i in producers} for k, v in stages.items()}
+
+def get_required(targets, dependencies):
+    """get_required: return the target stages and all their upstream stages"""
+    required = set()
+    pending = list(targets)
+    while pending:
+        this_stage = pending.pop()
+        if this_stage in required:
+            continue
+        required.add(this_stage)
+        pending.extend(dependencies[this_stage])
+    return required
+
+def read_state(filename):
+    try:
+        with open(filename) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {'files': {}, 'stages': {}}
+
+def write_state(state, filename):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename + '.tmp', 'w') as fout:
+        json.dump(state, fout, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+def get_hash(filename):
+    this_hash = hashlib.sha256()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(BLOCKSIZE), b''):
+            this_hash.update(block)
+    return this_hash.hexdigest()
+
+class Fingerprints:
+    """Fingerprints: content hashes of pipeline files, only rehashing a file
+    when its size or mtime differ from the recorded state"""
+    def __init__(self, files):
+        self.files = files
+        self.lock = Lock()
+
+    def get(self, filename):
+        try:
+            this_stat = os.stat(filename)
+        except OSError:
+            return None
+        this_key = [this_stat.st_size, this_stat.st_mtime_ns]
+        with self.lock:
+            this_record = self.files.get(filename)
+        if this_record and this_record['stat'] == this_key:
+            return this_record['sha256']
+        this_hash = get_hash(filename)
+        with self.lock:
+            self.files[filename] = {'stat': this_key, 'sha256': this_hash}
+        return this_hash
+
+    def get_all(self, filenames):
+        return {i: self.get(i) for i in filenames}
+
+def get_solr_versions(names):
+    """get_solr_versions: return the index version of each Solr core or None
+    where it cannot be read"""
+    versions = {}
+    for name in names:
+        try:
+            versions[name] = read_version(name)
+        except (OSError, ValueError):
+            versions[name] = None
+    return versions
+
+def get_reason(name, stage, record, fingerprints, force, max_age):
+    """get_reason: return why a stage needs rebuilding or None if up to date"""
+    if name in force:
+        return 'forced'
+    outputs = fingerprints.get_all(stage['outputs'])
+    missing = [k for k, v in outputs.items() if v is None]
+    if missing:
+        return 'missing {}'.format(', '.join(missing))
+    if not record:
+        return 'no recorded build'
+    if record.get('outputs') != outputs:
+        return 'outputs changed since last build'
+    inputs = fingerprints.get_all(stage['scripts'] + stage['inputs'])
+    changed = [k for k, v in inputs.items() if record.get('inputs', {}).get(k) != v]
+    if changed:
+        return 'changed {}'.format(', '.join(changed))
+    if stage.get('solr'):
+        versions = get_solr_versions(stage['solr'])
+        unknown = [k for k, v in versions.items() if v is None]
+        if unknown:
+            return 'unknown Solr index version {}'.format(', '.join(unknown))
+        changed = [k for k, v in versions.items() if record.get('solr', {}).get(k) != v]
+        if changed:
+            return 'Solr index changed {}'.format(', '.join(changed))
+    if max_age is not None and stage.get('download'):
+        this_age = (time.time() - record.get('time', 0)) / 3600.0
+        if this_age > max_age:
+            return 'older than {} hours'.format(max_age)
+    return None
+
+def run_stage(name, stage):
+    this_env = {**os.environ, 'PATH': os.pathsep.join([BINPATH, os.environ.get('PATH', '')])}
+    if ARGS.instrument:
+        this_env['INSTRUMENT'] = os.path.abspath(ARGS.instrument)
+    if ARGS.profile:
+        this_env['INSTRUMENT_PROFILE'] = ARGS.profile
+    this_start = time.time()
+    this_result = subprocess.run(stage['command'], env=this_env)
+    return (this_result.returncode, time.time() - this_start)
+
+def run_pipeline(stages, targets, state, force, max_age, jobs, dry_run):
+    """run_pipeline: run required stages in dependency order, running stages
+    whose dependencies are complete in parallel"""
+    dependencies = get_dependencies(stages)
+    required = get_required(targets, dependencies)
+    fingerprints = Fingerprints(state['files'])
+    done, failed, running = set(), set(), {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(done) + len(failed) < len(required):
+            for name in sorted(required - done - failed - set(running)):
+                if dependencies[name] & failed:
+                    print('skip {}: upstream failed'.format(name))
+                    failed.add(name)
+                    continue
+                if not dependencies[name] <= done:
+                    continue
+                reason = get_reason(name, stages[name], state['stages'].get(name), fingerprints, force, max_age)
+                if reason is None:
+                    print('up to date {}'.format(name))
+                    done.add(name)
+                    continue
+                print('process {}: {}'.format(name, reason))
+                if dry_run:
+                    done.add(name)
+                    continue
+                running[name] = executor.submit(run_stage, name, stages[name])
+            if not running:
+                continue
+            finished, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name in [k for k, v in running.items() if v in finished]:
+                (returncode, duration) = running.pop(name).result()
+                if returncode != 0:
+                    print('failed {}: exit {} after {:.1f}s'.format(name, returncode, duration))
+                    failed.add(name)
+                    continue
+                print('finished {} in {:.1f}s'.format(name, duration))
+                stage = stages[name]
+                state['stages'][name] = {'time': time.time(),
+                                         'inputs': fingerprints.get_all(stage['scripts'] + stage['inputs']),
+                                         'outputs': fingerprints.get_all(stage['outputs']),
+                                         'solr': get_solr_versions(stage.get('solr', []))}
+                done.add(name)
+    return failed
+
+if __name__ == '__main__':
+    unknown = set(ARGS.stages + ARGS.force) - set(STAGES)
+    if unknown:
+        ARGPARSER.error('unknown stages: {}'.format(', '.join(sorted(unknown))))
+    STATE = read_state(ARGS.statefile)
+    FORCE = set(STAGES) if ARGS.rebuild_all else set(ARGS.force)
+    try:
+        FAILED = run_pipeline(STAGES, ARGS.stages or list(STAGES), STATE, FORCE, ARGS.max_age, ARGS.jobs, ARGS.dry_run)
+    finally:
+        if not ARGS.dry_run:
+            write_state(STATE, ARGS.statefile)
+    sys.exit(1 if FAILED else 0)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import argparse
+import pandas as pd
+from app.coords import to_locationstr
+from app.instrument import stage
+from app.solr import INDEXBATCH, INDEXWORKERS, post_data
+
+ARGPARSER = argparse.ArgumentParser(description='Index the locations report and the location candidates into Solr')
+
+ARGPARSER.add_argument('--report', dest='report', type=str, default='locations-report.tsv', help='locations report file')
+ARGPARSER.add_argument('--name', dest='name', type=str, default='locations', help='Solr collection for the locations report')
+ARGPARSER.add_argument('--candidates', dest='candidates', type=str, default=None, help='also index a candidates file such as output/locations-candidates.tsv')
+ARGPARSER.add_argument('--candidates-name', dest='candidates_name', type=str, default='candidates', help='Solr collection for the candidates')
+ARGPARSER.add_argument('--batch', dest='batchsize', type=int, default=INDEXBATCH, help='docs per update request')
+ARGPARSER.add_argument('--workers', dest='workers', type=int, default=INDEXWORKERS, help='parallel update requests')
+ARGPARSER.add_argument('--commit-within', dest='commit_within', type=int, default=None, help='commitWithin in milliseconds instead of one final commit')
+
+ARGS = ARGPARSER.parse_args()
+
+def get_docs(filename, get_id, chunksize=ARGS.batchsize):
+    """get_docs: yield Solr docs from a TSV file a chunk at a time without
+    empty fields and with a `_location_` where the location is known"""
+    for this_df in pd.read_csv(filename, sep='\t', dtype={'TIPLOC': 'object'}, keep_default_na=False,
+                               na_values={'latitude': [''], 'longitude': [''], 'spread': ['']}, chunksize=chunksize):
+        this_df['id'] = get_id(this_df)
+        this_df['_location_'] = to_locationstr(this_df['latitude'], this_df['longitude'])
+        for record in this_df.to_dict(orient='records'):
+            yield {k: v for k, v in record.items() if v == v and v is not None and v != ''}
+
+def get_candidate_id(this_df):
+    # A source can have several candidates for a TIPLOC so use the file row
+    return this_df['TIPLOC'] + '-' + this_df.index.astype(str)
+
+def post_file(filename, name, get_id):
+    """post_file: index a TSV file into collection name and report failed batches"""
+    with stage(name) as this_stage:
+        this_result = post_data(get_docs(filename, get_id), name, ARGS.batchsize, ARGS.workers, ARGS.commit_within)
+        this_stage.rows_out = this_result['docs']
+        this_stage.count('batches', this_result['batches'])
+        this_stage.count('failed', len(this_result['failed']))
+    print('{}: {} docs in {} batches, {} failed'.format(name, this_result['docs'], this_result['batches'], len(this_result['failed'])))
+    for failure in this_result['failed']:
+        print(json.dumps(failure), file=sys.stderr)
+    return not this_result['failed']
+
+SUCCESS = post_file(ARGS.report, ARGS.name, lambda v: v['TIPLOC'])
+if ARGS.candidates:
+    SUCCESS = post_file(ARGS.candidates, ARGS.candidates_name, get_candidate_id) and SUCCESS
+sys.exit(0 if SUCCESS else 1)
@@ -1,9 +1,9 @@
 #!/bin/sh
 
-if [ ! -s TIPLOC_Eastings_and_Northings.json ]; then
+# The pipeline runs this stage with --force to download the file again
+if [ x"$1" = x--force ] || [ ! -s output/TIPLOC_Eastings_and_Northings.xlsx ]; then
     URL=https://wiki.openraildata.com/images/8/89
     FILE=TIPLOC_Eastings_and_Northings.xlsx
     curl -L "${URL}/${FILE}.gz" -o output/${FILE}.gz
     gzip -df output/${FILE}.gz
-    easting2GeoJSON.sh output/${FILE}
 fi
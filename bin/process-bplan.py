@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import argparse
+from app.bplan import BATCHSIZE, process_archive
+from app.instrument import stage
+
+ARGPARSER = argparse.ArgumentParser(description='Split a BPLAN Geography gzip archive into a Parquet table for each record type')
+
+ARGPARSER.add_argument('inputfile', type=str, nargs='?', default='output/Geography-full.gz', help='BPLAN Geography gzip archive')
+ARGPARSER.add_argument('--output', dest='outputpath', type=str, default='output', help='output directory')
+ARGPARSER.add_argument('--batch', dest='batchsize', type=int, default=BATCHSIZE, help='rows per Parquet row group')
+ARGPARSER.add_argument('--force', dest='force', action='store_true', help='rebuild even if the archive is unchanged')
+
+ARGS = ARGPARSER.parse_args()
+
+with stage('split') as this_stage:
+    COUNTS = process_archive(ARGS.inputfile, ARGS.outputpath, force=ARGS.force, batchsize=ARGS.batchsize)
+    if COUNTS is not None:
+        this_stage.rows_out = sum(COUNTS.values())
+        this_stage.update(COUNTS)
+if COUNTS is None:
+    print('{}: unchanged'.format(ARGS.inputfile))
+else:
+    print(', '.join('{} {}'.format(k, v) for k, v in COUNTS.items()))
@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
-import json
+import argparse
 import numpy as np
 import pandas as pd
-import sys
-from app.solr import get_facet,  get_query
+from app import asolr
+from app.solr import get_facet
+from app.coords import from_locationstr
+from app.store import get_filename, write_frame
+from app.instrument import stage
+
+ARGPARSER = argparse.ArgumentParser(description='Extract NaPTAN rail StopPoint and StopArea data to a summary Parquet or jsonl format')
+
+ARGPARSER.add_argument('--format', dest='format', type=str, choices=['parquet', 'jsonl'], help='output file format', default='parquet')
+
+ARGS = ARGPARSER.parse_args()
 
 def get_counts(name, field):
     r = get_facet(name, facet_fl=field)
@@ -17,73 +26,75 @@ def get_counts(name, field):
     r = get_facet(name, facet_fl=field)
     return dict(zip(r[::2], r[1::2]))
 
-STOPTYPES = get_counts('StopPoint', 'StopClassification.StopType')
-with open('output/StopTypes.tsv', 'w') as fout:
-    fout.write('StopType\t#\n')
-    fout.write('\n'.join(['{}\t{}'.format(k,v) for k, v in STOPTYPES.items()]))
+POINT_FIELDS = {'id': 'id',
+                '_location_': '_location_',
+                'Status': 'Status',
+                'AtcoCode': 'AtcoCode',
+                'AdministrativeAreaRef': 'AdministrativeAreaRef',
+                'Place.NptgLocalityRef': 'node',
+                'StopAreas.StopAreaRef.Status': 'StopAreaStatus',
+                'StopAreas.StopAreaRef.value': 'StopAreaRef',
+                'Descriptor.CommonName': 'Name',
+                'Descriptor.Street': 'Street',
+                'StopClassification.StopType': 'StopType',
+                'StopClassification.OffStreet.Rail.AnnotatedRailRef.TiplocRef': 'TIPLOC',
+                'StopClassification.OffStreet.Rail.AnnotatedRailRef.CrsRef': 'CRS',
+                'StopClassification.OffStreet.Rail.AnnotatedRailRef.StationName': 'StationName',
+                'PlusbusZones.PlusbusZoneRef.Status': 'PlusBusZoneStatus',
+                'PlusbusZones.PlusbusZoneRef.value': 'PlusBusZoneName',
+                'Place.MainNptgLocalities.NptgLocalityRef.value': 'PlaceLocatityRefs',
+                'Place.Suburb': 'Suburb',
+                'Place.Town': 'Town',
+                'AlternativeDescriptors.Descriptor.Status': 'AlternativeStatus',
+                'AlternativeDescriptors.Descriptor.CommonName': 'AlternativeName',
+                'AlternativeDescriptors.Descriptor.Street': 'AlternativeStreet',
+                'StopClassification.OffStreet.Rail.AnnotatedRailRef.StationName.value': 'StationStopName',
+                'Descriptor.Indicator': 'Platform',
+                'StopClassification.OffStreet.Air.AnnotatedAirRef.IataRef': 'IataRef',
+                'StopClassification.OffStreet.Air.AnnotatedAirRef.Name': 'AirportName',
+                'StopClassification.OffStreet.Ferry.AnnotatedFerryRef.FerryRef': 'FerryRef',
+                'StopClassification.OffStreet.Ferry.AnnotatedFerryRef.Name': 'FerryName',
+                'NaptanCode': 'NaptanCode',
+                'Descriptor.Landmark': 'Landmark',
+                'Descriptor.ShortCommonName': 'CommonName'}
 
-FIELDS = {'id': 'id',
-          '_location_': '_location_',
-          'Status': 'Status',
-          'AtcoCode': 'AtcoCode',
-          'AdministrativeAreaRef': 'AdministrativeAreaRef',
-          'Place.NptgLocalityRef': 'node',
-          'StopAreas.StopAreaRef.Status': 'StopAreaStatus',
-          'StopAreas.StopAreaRef.value': 'StopAreaRef',
-          'Descriptor.CommonName': 'Name',
-          'Descriptor.Street': 'Street',
-          'StopClassification.StopType': 'StopType',
-          'StopClassification.OffStreet.Rail.AnnotatedRailRef.TiplocRef': 'TIPLOC',
-          'StopClassification.OffStreet.Rail.AnnotatedRailRef.CrsRef': 'CRS',
-          'StopClassification.OffStreet.Rail.AnnotatedRailRef.StationName': 'StationName',
-          'PlusbusZones.PlusbusZoneRef.Status': 'PlusBusZoneStatus',
-          'PlusbusZones.PlusbusZoneRef.value': 'PlusBusZoneName',
-          'Place.MainNptgLocalities.NptgLocalityRef.value': 'PlaceLocatityRefs',
-          'Place.Suburb': 'Suburb',
-          'Place.Town': 'Town',
-          'AlternativeDescriptors.Descriptor.Status': 'AlternativeStatus',
-          'AlternativeDescriptors.Descriptor.CommonName': 'AlternativeName',
-          'AlternativeDescriptors.Descriptor.Street': 'AlternativeStreet',
-          'StopClassification.OffStreet.Rail.AnnotatedRailRef.StationName.value': 'StationStopName',
-          'Descriptor.Indicator': 'Platform',
-          'StopClassification.OffStreet.Air.AnnotatedAirRef.IataRef': 'IataRef',
-          'StopClassification.OffStreet.Air.AnnotatedAirRef.Name': 'AirportName',
-          'StopClassification.OffStreet.Ferry.AnnotatedFerryRef.FerryRef': 'FerryRef',
-          'StopClassification.OffStreet.Ferry.AnnotatedFerryRef.Name': 'FerryName',
-          'NaptanCode': 'NaptanCode',
-          'Descriptor.Landmark': 'Landmark',
-          'Descriptor.ShortCommonName': 'CommonName'}
+AREA_FIELDS = {'id': 'id',
+               '_location_': '_location_',
+               'AdministrativeAreaRef': 'AdministrativeAreaRef',
+               'Name': 'Name',
+               'ParentStopAreaRef.Status': 'StopAreaStatus',
+               'ParentStopAreaRef.value': 'ParentAtcoCode',
+               'Status': 'Status',
+               'StopAreaCode': 'AtcoCode',
+               'StopAreaType': 'StopAreaType'}
 
+with stage('solr') as this_stage:
+    SOLRDATA = asolr.run_queries(stoptypes=asolr.get_facet('StopPoint', 'StopClassification.StopType'),
+                                 points=asolr.get_frame('StopPoint', 'AtcoCode:9*',
+                                                        fl=','.join(POINT_FIELDS.keys()), columns=POINT_FIELDS),
+                                 areas=asolr.get_frame('StopArea', 'ParentStopAreaRef.value:9* OR StopAreaCode:9*',
+                                                       fl=','.join(AREA_FIELDS.keys()), columns=AREA_FIELDS))
+    this_stage.rows_out = SOLRDATA['points'].shape[0] + SOLRDATA['areas'].shape[0]
+    this_stage.update({'StopPoint': SOLRDATA['points'].shape[0], 'StopArea': SOLRDATA['areas'].shape[0]})
 
-POINTS = get_query('StopPoint', 'AtcoCode:9*', fl=','.join(FIELDS.keys()))
-#DATA = get_query('StopPoint', 'AtcoCode:9*') #, fl=','.join(FIELDS.keys()))
-
-df1 = pd.DataFrame(POINTS)
-df1 = df1.rename(columns=FIELDS).fillna('')
-df1['TIPLOC'] = df1['AtcoCode'].str[4:]
-df1['type'] = 'Point'
-
-FIELDS = {'id': 'id',
-          '_location_': '_location_',
-          'AdministrativeAreaRef': 'AdministrativeAreaRef',
-          'Name': 'Name',
-          'ParentStopAreaRef.Status': 'StopAreaStatus',
-          'ParentStopAreaRef.value': 'ParentAtcoCode',
-          'Status': 'Status',
-          'StopAreaCode': 'AtcoCode',
-          'StopAreaType': 'StopAreaType'}
+STOPTYPES = dict(zip(SOLRDATA['stoptypes'][::2], SOLRDATA['stoptypes'][1::2]))
+with open('output/StopTypes.tsv', 'w') as fout:
+    fout.write('StopType\t#\n')
+    fout.write('\n'.join(['{}\t{}'.format(k,v) for k, v in STOPTYPES.items()]))
 
-AREAS = get_query('StopArea', 'ParentStopAreaRef.value:9* OR StopAreaCode:9*', fl=','.join(FIELDS.keys()))
-df2 = pd.DataFrame(AREAS)
-df2 = df2.rename(columns=FIELDS).fillna('')
-df2['TIPLOC'] = df2['ParentAtcoCode'].str[4:]
-idx1 = df2['TIPLOC'] == ''
-df2.loc[idx1, 'TIPLOC'] = df2.loc[idx1, 'AtcoCode'].str[4:]
-df2['type'] = 'Area'
+with stage('write') as this_stage:
+    df1 = SOLRDATA['points'].fillna('')
+    df1['TIPLOC'] = df1['AtcoCode'].str[4:]
+    df1['type'] = 'Point'
 
-def clean_json(this_df):
-    return [{k: v for k, v in m.items() if isinstance(v, list) or v != ''} for m in this_df]
+    df2 = SOLRDATA['areas'].fillna('')
+    df2['TIPLOC'] = df2['ParentAtcoCode'].str[4:]
+    idx1 = df2['TIPLOC'] == ''
+    df2.loc[idx1, 'TIPLOC'] = df2.loc[idx1, 'AtcoCode'].str[4:]
+    df2['type'] = 'Area'
 
-DATA = clean_json(df1.append(df2).fillna('').to_dict(orient='records'))
-with open('NaPTAN-All.jsonl', 'w') as fout:
-    fout.write('\n'.join([json.dumps(i) for i in DATA]))
+    DATA = pd.concat([df1, df2], ignore_index=True).fillna('')
+    DATA[['latitude', 'longitude']] = from_locationstr(DATA['_location_'])
+    write_frame(DATA, get_filename('NaPTAN-All', ARGS.format))
+    this_stage.rows_in = this_stage.rows_out = DATA.shape[0]
+    this_stage.count('TIPLOC', DATA.loc[DATA['TIPLOC'] != '', 'TIPLOC'].nunique())
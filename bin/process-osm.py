@@ -1,74 +1,158 @@
 #!/usr/bin/env python3
 
-import sys
-import json
+import os
 import argparse
-from geojson import FeatureCollection
-import pandas as pd
-import geopandas as gp
+import tempfile
+import numpy as np
+from multiprocessing import Pool
 from osgeo import gdal, ogr
+from app.coords import trim
+from app.instrument import stage
+from app.store import BATCHSIZE, get_filename, get_format, interleave_files, merge_files, write_records
 
-pd.set_option('display.max_columns', None)
-
-ARGPARSER = argparse.ArgumentParser(description='Reformats an OSM format file to a summary jsonl format')
+ARGPARSER = argparse.ArgumentParser(description='Reformats an OSM format file to a summary Parquet or jsonl format')
 
 ARGPARSER.add_argument('inputfile', type=str, nargs='?', help='name of file to convert', default='great-britain-rail-all.osm')
+ARGPARSER.add_argument('--output', dest='outputfile', type=str, help='name of output file', default=None)
+ARGPARSER.add_argument('--format', dest='format', type=str, choices=['parquet', 'jsonl'], help='output file format', default='parquet')
+ARGPARSER.add_argument('--workers', dest='workers', type=int, help='number of worker processes, each parses the whole extract', default=1)
 
 ARGS = ARGPARSER.parse_args()
 FILENAME = ARGS.inputfile
+OUTPUTFILE = ARGS.outputfile or get_filename('OSM-All', ARGS.format)
+
+def get_centroid(this_geometry):
+    if this_geometry is None or this_geometry.IsEmpty():
+        return (None, None)
+    v = this_geometry.Centroid()
+    return (v.GetY(), v.GetX())
 
-def trim_f(this_float):
-    return round(float(this_float), 6)
-
-def get_locationstr(p):
-    if p.type == 'Point':
-        v = p.coords[0]
-        return '{},{}'.format(str(trim_f(v[1])), str(trim_f(v[0])))
-    return ['{},{}'.format(str(trim_f(v[1])), str(trim_f(v[0])))
-            for v in p.coords]
-
-def get_pairs(this_list):
-    r = [trim_f(i) for i in this_list]
-    return list(zip(r[1::2], r[::2]))
-
-def get_tiploc(this_df):
-    this_series = pd.Series(index=this_df.index, dtype='object', name='TIPLOC')
-    idx1 = this_series.notna()
-    if 'ref:tiploc' in this_df.columns:
-        idx1 = this_df['ref:tiploc'].apply(lambda v: v is not None)
-        this_series[idx1] = this_df.loc[idx1, 'ref:tiploc']
-    if 'naptan:AtcoCode' in this_df.columns:
-        idx2 = this_df['naptan:AtcoCode'].apply(lambda v: v is not None)
-        this_series[idx2 & ~idx1] = this_df.loc[idx2 & ~idx1, 'naptan:AtcoCode'].str[4:]
-    this_series[this_series.isna()] = None
-    return this_series
-
-def clean_json(this_df):
-    return [{k: v for k, v in m.items() if v != ''} for m in this_df]
-
-def get_geoframe(osm_ds):
-    data = []
+def has_tiploc(osm_ds):
+    """has_tiploc: return whether any feature in the extract has a `ref:tiploc` tag"""
     for n in range(osm_ds.GetLayerCount()):
         layer = osm_ds.GetLayer(n)
-        layer_name = layer.GetName()
-        for feature in layer:
-            json_data = json.loads(feature.ExportToJson())
-            json_data['properties'].update({'layer': layer_name})
-            for i in [k for k, v in json_data['properties'].items() if v is None]:
-                json_data['properties'].pop(i)
-            data.append(json_data)
-    collection = FeatureCollection(data)
-    return gp.GeoDataFrame.from_features(collection['features'])
-
-gdal.SetConfigOption('OSM_CONFIG_FILE', 'data/osmconfig.ini')
-OSM_DS = ogr.Open(FILENAME, 0)
-if OSM_DS is None:
-    raise OSError(2, 'No such file or directory: \'{}\''.format(FILENAME))
-
-GDF = get_geoframe(OSM_DS).fillna('')
-GDF['_location_'] = GDF['geometry'].centroid.apply(get_locationstr)
-GDF['TIPLOC'] = get_tiploc(GDF)
-
-DATA = clean_json(GDF.drop(columns='geometry').fillna('').to_dict(orient='records'))
-with open('OSM-All.jsonl', 'w') as fout:
-    fout.write('\n'.join([json.dumps(i) for i in DATA]))
+        layer.SetAttributeFilter('"ref:tiploc" IS NOT NULL')
+        feature = layer.GetNextFeature()
+        layer.SetAttributeFilter(None)
+        layer.ResetReading()
+        if feature is not None:
+            return True
+    return False
+
+def get_tiploc(this_properties, fallback=False):
+    # The NaPTAN AtcoCode is only used when no feature in the extract has a TIPLOC
+    if 'ref:tiploc' in this_properties:
+        return this_properties['ref:tiploc']
+    if fallback and 'naptan:AtcoCode' in this_properties:
+        return this_properties['naptan:AtcoCode'][4:]
+    return None
+
+def get_record(feature, layer_name, fallback=False):
+    this_record = {k: v for k, v in feature.items().items() if v is not None and v != ''}
+    this_record['layer'] = layer_name
+    (this_record['latitude'], this_record['longitude']) = get_centroid(feature.GetGeometryRef())
+    this_record['TIPLOC'] = get_tiploc(this_record, fallback)
+    return {k: v for k, v in this_record.items() if v is not None and v != ''}
+
+def open_osm(filename):
+    gdal.SetConfigOption('OSM_CONFIG_FILE', 'data/osmconfig.ini')
+    osm_ds = ogr.Open(filename, 0)
+    if osm_ds is None:
+        raise OSError(2, 'No such file or directory: \'{}\''.format(filename))
+    return osm_ds
+
+def get_layer_records(layer, fallback=False, chunk=0, nchunk=1):
+    """get_layer_records: yield the records of every `nchunk`-th feature of a
+    layer starting from feature `chunk`"""
+    layer_name = layer.GetName()
+    layer.ResetReading()
+    for n, feature in enumerate(layer):
+        if n % nchunk == chunk:
+            yield get_record(feature, layer_name, fallback)
+
+def get_records(osm_ds):
+    fallback = not has_tiploc(osm_ds)
+    for n in range(osm_ds.GetLayerCount()):
+        yield from get_layer_records(osm_ds.GetLayer(n), fallback)
+
+def trim_batch(batch, locationstr=False):
+    """trim_batch: round the centroids of a batch of records in one call and
+    optionally add the `_location_` string used by the jsonl export"""
+    latitude = trim([i.get('latitude', np.nan) for i in batch])
+    longitude = trim([i.get('longitude', np.nan) for i in batch])
+    for record, this_latitude, this_longitude in zip(batch, latitude.tolist(), longitude.tolist()):
+        if this_latitude != this_latitude:
+            continue
+        record['latitude'] = this_latitude
+        record['longitude'] = this_longitude
+        if locationstr:
+            record['_location_'] = '{},{}'.format(this_latitude, this_longitude)
+    return batch
+
+def trim_records(records, locationstr=False, batchsize=BATCHSIZE):
+    """trim_records: round record centroids in batches of `batchsize`"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batchsize:
+            yield from trim_batch(batch, locationstr)
+            batch = []
+    if batch:
+        yield from trim_batch(batch, locationstr)
+
+def get_columns(osm_ds):
+    """get_columns: return the union of the OSM layer field names and derived columns"""
+    columns = {}
+    for n in range(osm_ds.GetLayerCount()):
+        layer_defn = osm_ds.GetLayer(n).GetLayerDefn()
+        for i in range(layer_defn.GetFieldCount()):
+            columns[layer_defn.GetFieldDefn(i).GetName()] = None
+    for i in ['layer', 'TIPLOC', 'latitude', 'longitude']:
+        columns[i] = None
+    return list(columns)
+
+def process_chunk(this_job):
+    """process_chunk: write the records of one chunk of an OSM layer to a
+    part file in the output format"""
+    (filename, n, chunk, nchunk, partfile, columns, fallback) = this_job
+    osm_ds = open_osm(filename)
+    records = get_layer_records(osm_ds.GetLayer(n), fallback, chunk, nchunk)
+    write_records(trim_records(records, get_format(partfile) == 'jsonl'), partfile, columns)
+    return partfile
+
+def write_parallel(filename, outputfile, workers, this_stage=None):
+    """write_parallel: split each OSM layer into `workers` chunks of every
+    `workers`-th feature, write each chunk in its own worker process, then
+    interleave the chunks and join the layers back into the serial order,
+    counting rows out on the optional instrument stage
+
+    Each worker still parses the whole extract with OGR and only builds and
+    writes the records of its chunk, so the speedup is bounded by the share
+    of the run spent parsing"""
+    osm_ds = open_osm(filename)
+    (nlayer, columns) = (osm_ds.GetLayerCount(), get_columns(osm_ds))
+    fallback = not has_tiploc(osm_ds)
+    outputpath = os.path.dirname(os.path.abspath(outputfile))
+    extension = os.path.splitext(outputfile)[1]
+    with tempfile.TemporaryDirectory(dir=outputpath) as tmpdir:
+        jobs = [(filename, n, k, workers, os.path.join(tmpdir, 'part-{}-{}{}'.format(n, k, extension)), columns, fallback)
+                for n in range(nlayer) for k in range(workers)]
+        with Pool(workers) as pool:
+            partfiles = pool.map(process_chunk, jobs, chunksize=1)
+        layerfiles = []
+        for n in range(nlayer):
+            layerfile = os.path.join(tmpdir, 'layer-{}{}'.format(n, extension))
+            interleave_files(partfiles[n * workers:(n + 1) * workers], layerfile)
+            layerfiles.append(layerfile)
+        nrows = merge_files(layerfiles, outputfile)
+    if this_stage is not None:
+        this_stage.rows_out = nrows
+
+if __name__ == '__main__':
+    with stage('convert') as this_stage:
+        if ARGS.workers > 1:
+            write_parallel(FILENAME, OUTPUTFILE, ARGS.workers, this_stage)
+        else:
+            OSM_DS = open_osm(FILENAME)
+            write_records(this_stage.iter_rows(trim_records(get_records(OSM_DS), get_format(OUTPUTFILE) == 'jsonl')),
+                          OUTPUTFILE, get_columns(OSM_DS))
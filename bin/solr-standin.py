@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+import argparse
+from app.standin import SolrStandin, get_server, read_cores
+
+ARGPARSER = argparse.ArgumentParser(description='Serve `<core>.jsonl` files as a local stand-in for the Solr requests made by app.solr')
+
+ARGPARSER.add_argument('dirname', type=str, help='directory of `<core>.jsonl` doc files')
+ARGPARSER.add_argument('--host', dest='host', type=str, default='127.0.0.1', help='listen address')
+ARGPARSER.add_argument('--port', dest='port', type=int, default=8983, help='listen port')
+
+ARGS = ARGPARSER.parse_args()
+
+CORES = read_cores(ARGS.dirname)
+SERVER = get_server(SolrStandin(CORES), ARGS.host, ARGS.port)
+print('serving {} on http://{}:{}/solr/'.format(', '.join('{} {}'.format(k, len(v)) for k, v in CORES.items()),
+                                                ARGS.host, ARGS.port), flush=True)
+try:
+    SERVER.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    SERVER.server_close()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+from app.tiplocdb import REPORT, open_db, write_db
+
+ARGPARSER = argparse.ArgumentParser(description='Look up TIPLOC locations in the compiled locations report index')
+
+ARGPARSER.add_argument('tiplocs', type=str, nargs='*', help='TIPLOCs to look up, - to read one per line from stdin')
+ARGPARSER.add_argument('--report', dest='report', type=str, default=REPORT, help='locations report file')
+ARGPARSER.add_argument('--url', dest='url', action='store_true', help='print an OpenStreetMap link for each location')
+ARGPARSER.add_argument('--compile', dest='compile', action='store_true', help='compile the report index and exit')
+
+ARGS = ARGPARSER.parse_args()
+
+URL = 'https://www.openstreetmap.org/#map=19/{}/{}'
+
+def get_url(location):
+    if location is None or location.latitude != location.latitude or location.longitude != location.longitude:
+        return ''
+    return URL.format(location.latitude, location.longitude)
+
+def get_line(tiploc, location):
+    if ARGS.url:
+        return '{}\t{}'.format(tiploc, get_url(location))
+    if location is None:
+        return '{}\t\t\t\t'.format(tiploc)
+    return '\t'.join('' if i is None or i != i else str(i) for i in location)
+
+if ARGS.compile:
+    print(write_db(ARGS.report))
+    sys.exit(0)
+
+TIPLOCS = ARGS.tiplocs
+if TIPLOCS == ['-']:
+    TIPLOCS = [i.strip() for i in sys.stdin if i.strip()]
+
+with open_db(ARGS.report) as DB:
+    if not ARGS.url:
+        print('TIPLOC\ttype\tDescription\tlatitude\tlongitude')
+    for TIPLOC, LOCATION in zip(TIPLOCS, DB.lookup(TIPLOCS)):
+        print(get_line(TIPLOC, LOCATION))
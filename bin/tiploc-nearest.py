@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import pandas as pd
+from app.nearest import REPORT, get_index
+
+ARGPARSER = argparse.ArgumentParser(description='Find TIPLOCs near GPS points in the locations report')
+
+ARGPARSER.add_argument('--report', dest='report', type=str, default=REPORT, help='locations report file')
+ARGPARSER.add_argument('--input', dest='inputfile', type=str, default=None,
+                       help='TSV file of query points with latitude and longitude columns, - for stdin')
+SUBPARSERS = ARGPARSER.add_subparsers(dest='query', required=True)
+
+NEAREST = SUBPARSERS.add_parser('nearest', help='k nearest TIPLOCs to each point')
+NEAREST.add_argument('point', type=float, nargs='*', help='latitude longitude')
+NEAREST.add_argument('-k', dest='k', type=int, default=1, help='number of TIPLOCs per point')
+NEAREST.add_argument('--max-distance', dest='max_distance', type=float, default=float('inf'), help='metres')
+
+RADIUS = SUBPARSERS.add_parser('radius', help='TIPLOCs within a radius of each point')
+RADIUS.add_argument('radius', type=float, help='metres')
+RADIUS.add_argument('point', type=float, nargs='*', help='latitude longitude')
+
+BBOX = SUBPARSERS.add_parser('bbox', help='TIPLOCs in a bounding box')
+BBOX.add_argument('bounds', type=float, nargs=4, help='south west north east')
+
+ARGS = ARGPARSER.parse_args()
+
+def get_points(args):
+    if args.inputfile:
+        this_df = pd.read_csv(sys.stdin if args.inputfile == '-' else args.inputfile, sep='\t')
+        return (this_df['latitude'].to_numpy(), this_df['longitude'].to_numpy())
+    if len(args.point) != 2:
+        ARGPARSER.error('expected a latitude and longitude or --input file')
+    return ([args.point[0]], [args.point[1]])
+
+INDEX = get_index(ARGS.report)
+if ARGS.query == 'nearest':
+    RESULT = INDEX.nearest(*get_points(ARGS), k=ARGS.k, max_distance=ARGS.max_distance)
+elif ARGS.query == 'radius':
+    RESULT = INDEX.within(*get_points(ARGS), radius=ARGS.radius)
+else:
+    RESULT = INDEX.bbox(*ARGS.bounds).drop(columns=['query', 'distance'])
+RESULT.to_csv(sys.stdout, sep='\t', index=False, float_format='%.6f')
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+import argparse
+from app.service import CACHESIZE, INTERVAL, LocationService, get_server
+from app.tiplocdb import REPORT
+
+ARGPARSER = argparse.ArgumentParser(description='Serve TIPLOC location lookups as GeoJSON over HTTP')
+
+ARGPARSER.add_argument('--report', dest='report', type=str, default=REPORT, help='locations report file')
+ARGPARSER.add_argument('--host', dest='host', type=str, default='127.0.0.1', help='listen address')
+ARGPARSER.add_argument('--port', dest='port', type=int, default=8080, help='listen port')
+ARGPARSER.add_argument('--cache', dest='cachesize', type=int, default=CACHESIZE, help='LRU response cache entries')
+ARGPARSER.add_argument('--interval', dest='interval', type=float, default=INTERVAL, help='seconds between report change checks')
+
+ARGS = ARGPARSER.parse_args()
+
+SERVICE = LocationService(ARGS.report, cachesize=ARGS.cachesize)
+SERVICE.watch(ARGS.interval)
+SERVER = get_server(SERVICE, ARGS.host, ARGS.port)
+print('serving {} TIPLOCs from {} on http://{}:{}/'.format(len(SERVICE.snapshot.db), ARGS.report, ARGS.host, ARGS.port), flush=True)
+try:
+    SERVER.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    SERVER.server_close()
+    SERVICE.close()
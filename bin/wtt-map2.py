@@ -3,176 +3,197 @@
 import json
 import numpy as np
 import pandas as pd
-import geopandas as gp
 import sys
 import os
-os.environ['SOLRHOST'] = 'joseph'
-
-from app.solr import get_group, get_query, get_facet
+import argparse
+
+from app import asolr
+from app.solr import chunk_query, get_group, get_query_in, set_cache
+from app.solrcache import MODES
+from app.boundary import in_boundary
+from app.coords import from_locationstr, to_locationstr
+from app.ingest import read_bplan, read_foi
+from app.store import find_file, read_frame
+from app.nearest import write_index
+from app.tiplocdb import write_db
+from app.resolver import get_candidates, resolve, resolve_aliases
+from app.consistency import ERROR, WARNING, check_sources
+from app.instrument import stage
+from app.incremental import get_changes, get_source_fingerprints, merge_candidates, read_candidates, read_fingerprints, read_report, write_fingerprints
 pd.set_option('display.max_columns', None)
 
-def get_url(tiploc):
-    if LOCATIONS.loc[tiploc].any():
-        (latitude, longitude) = LOCATIONS.loc[tiploc]['_location_'].split(',')
-        print('https://www.openstreetmap.org/#map=19/{}/{}'.format(latitude, longitude))
-    return None
-
-def print_url(tiploc):
-    print(get_url(tiploc))
+ARGPARSER = argparse.ArgumentParser(description='Resolve the locations of the timetable TIPLOCs')
 
-def get_counts(name, field):
-    r = get_facet(name, facet_fl=field)
-    return dict(zip(r[::2], r[1::2]))
+ARGPARSER.add_argument('--incremental', dest='incremental', action='store_true', help='only re-resolve TIPLOCs whose source records changed')
+ARGPARSER.add_argument('--report', dest='report', type=str, default='locations-report.tsv', help='locations report file')
+ARGPARSER.add_argument('--fingerprints', dest='fingerprints', type=str, default='output/locations-fingerprint.tsv', help='per TIPLOC source fingerprint file')
+ARGPARSER.add_argument('--candidates', dest='candidates', type=str, default='output/locations-candidates.tsv', help='every candidate location with the winning candidate flagged')
+ARGPARSER.add_argument('--changes', dest='changes', type=str, default='output/locations-changes.tsv', help='new, moved and lost locations change log')
+ARGPARSER.add_argument('--discrepancies', dest='discrepancies', type=str, default='output/locations-discrepancies.tsv', help='TIPLOCs where the source locations disagree')
+ARGPARSER.add_argument('--warning', dest='warning', type=float, default=WARNING, help='source spread in metres to report a discrepancy')
+ARGPARSER.add_argument('--error', dest='error', type=float, default=ERROR, help='source spread in metres to report a discrepancy as an error')
+ARGPARSER.add_argument('--cache', dest='cache', type=str, choices=MODES, default=os.environ.get('SOLRCACHE', 'on'), help='Solr response cache mode, replay needs no Solr server')
 
-def get_facetkeys(name, field):
-    r = get_facet(name, facet_fl=field)
-    return r[::2]
+ARGS = ARGPARSER.parse_args()
+set_cache(ARGS.cache)
 
 def get_found():
     try:
-        return LOCATIONS['_location_'].notna().sum()
+        return LOCATIONS['latitude'].notna().sum()
     except KeyError:
         pass
     return 0
 
-def get_missing():
-    return {k: COUNTS[k] for k, v in LOCATIONS.items() if not v}
-
-COUNTS = get_counts('PATH', 'TIPLOC')
-LOCATIONS = pd.DataFrame(index=get_facetkeys('PATH', 'TIPLOC'), dtype='object', columns=['type', '_location_'])
-
-LOCATIONS.index.name='TIPLOC'
-NAMES = pd.DataFrame(get_query('TR', fl='TIPLOC,TPS_Description')).rename(columns={'TPS_Description': 'Description'}).set_index('TIPLOC')
-LOCATIONS = LOCATIONS.join(NAMES)
-
-N, _ = LOCATIONS.shape
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-## Decode GeoJson object:
-# {"type": "FeatureCollection",
-#  "name": "TIPLOC",
-#  "crs": {
-#    "type": "name",
-#    "properties": {
-#      "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
-#    }
-#  },
-#  "features": [...]}
-
-def get_locationstr(p):
-    if p.type == 'Point':
-        v = p.coords[0]
-        return '{},{}'.format(str(trim_f(v[1])), str(trim_f(v[0])))
-    return ['{},{}'.format(str(trim_f(v[1])), str(trim_f(v[0])))
-            for v in p.coords]
-
-def trim_f(this_float):
-    return round(float(this_float), 6)
-
-def match_TIPLOC(idk, this_df):
-    this_df = this_df.set_index('TIPLOC')
-    this_idk = this_df[this_df.index.isin(idk)].index
-    return this_df.loc[this_idk, ['type', 'Description', '_location_']]
-
-COLUMNS = ['type', 'Description', '_location_']
-
-FOI = gp.read_file('TIPLOC_Eastings_and_Northings.json')
-FOI['_location_'] = FOI['geometry'].centroid.apply(get_locationstr)
-FOI['type'] = 'FOI'
-
-IDX1 = LOCATIONS[LOCATIONS['_location_'].isna()].index
-DF1 = match_TIPLOC(IDX1, FOI.rename(columns={'NAME': 'Description'}))
-LOCATIONS.loc[DF1.index, COLUMNS] = DF1
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-BPLAN = gp.read_file('Geography-LOC.json')
-BPLAN['_location_'] = BPLAN['geometry'].centroid.apply(get_locationstr)
-BPLAN = BPLAN.rename(columns={'Location Code': 'TIPLOC', 'Location name': 'Description'})
-BPLAN['type'] = 'BPLAN'
-COUNTRIES = gp.GeoDataFrame.from_file('shape-file/ne_110m_admin_0_countries_lakes.shp')
-GBPOLYGON = COUNTRIES.loc[COUNTRIES['ISO_A2'] == 'GB', 'geometry']
-IDX2 = LOCATIONS[LOCATIONS['_location_'].isna()].index
-DF2 = match_TIPLOC(IDX2, gp.clip(BPLAN, GBPOLYGON))
-LOCATIONS.loc[DF2.index, COLUMNS] = DF2
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-NAPTAN = pd.read_json('NaPTAN-All.jsonl', dtype='object', lines=True)
-NAPTAN['type'] = 'NaPTAN'
-IDX3 = LOCATIONS[LOCATIONS['_location_'].isna()].index
-DF3 = match_TIPLOC(IDX3, NAPTAN.rename(columns={'Name': 'Description'}))
-LOCATIONS.loc[DF3.index, COLUMNS] = DF3
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-OSM = pd.read_json('OSM-All.jsonl', dtype='object', lines=True)
-OSM = OSM.dropna(subset=['TIPLOC'])
-OSM = OSM.drop_duplicates(subset='TIPLOC')
-OSM['type'] = 'OSM'
-
-IDX4 = LOCATIONS[LOCATIONS['_location_'].isna()].index
-DF4 = match_TIPLOC(IDX4, OSM.rename(columns={'name': 'Description'}))
-LOCATIONS.loc[DF4.index, COLUMNS] = DF4
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-MAP = pd.read_csv('data/TIPLOC-map.tsv', dtype='object', sep='\t')
-MAP = MAP.dropna(subset=['TIPLOC'])
-MAP['type'] = 'NaPTAN_MAP'
-MAP = MAP.join(NAPTAN[['AtcoCode', '_location_']].set_index('AtcoCode'), on='StopAreaCode')
-
-IDX5 = LOCATIONS[LOCATIONS['_location_'].isna()].index
-DF5 = match_TIPLOC(IDX5, MAP.rename(columns={'Name': 'Description'}))
-LOCATIONS.loc[DF5.index, COLUMNS] = DF5
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-WIKIPEDIA = pd.read_csv('data/wikipedia-map.tsv', dtype='object', sep='\t')
-WIKIPEDIA = WIKIPEDIA.set_index('TIPLOC')
-LOCATIONS.loc[WIKIPEDIA.index, ['type', 'Description', '_location_']] = WIKIPEDIA[['type', 'Description', '_location_']]
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-OVERLAP = pd.read_csv('data/overlap-map.tsv', dtype='object', sep='\t')
-OVERLAP = OVERLAP.dropna(subset=['mapped TIPLOC'])
-for _, location in OVERLAP.iterrows():
-    LOCATIONS.loc[location['TIPLOC'], 'Description'] = location['Description']
-    LOCATIONS.loc[location['TIPLOC'], 'type'] = 'overlapA'
+with stage('solr') as this_stage:
+    SOLRDATA = asolr.run_queries(facet=asolr.get_facet('PATH', 'TIPLOC'),
+                                 names=asolr.get_frame('TR', fl='TIPLOC,TPS_Description',
+                                                       columns={'TIPLOC': 'TIPLOC', 'TPS_Description': 'Description'}))
+    FACET = SOLRDATA['facet']
+    COUNTS = dict(zip(FACET[::2], FACET[1::2]))
+    LOCATIONS = pd.DataFrame(index=FACET[::2], columns=['type', 'latitude', 'longitude'])
+    LOCATIONS = LOCATIONS.astype({'type': 'object', 'latitude': 'float64', 'longitude': 'float64'})
+
+    LOCATIONS.index.name='TIPLOC'
+    NAMES = SOLRDATA['names'].set_index('TIPLOC')
+    LOCATIONS = LOCATIONS.join(NAMES)
+
+    N, _ = LOCATIONS.shape
+    this_stage.rows_out = N
+    this_stage.count('TR', NAMES.shape[0])
+
+COLUMNS = ['type', 'Description', 'latitude', 'longitude']
+
+with stage('sources') as this_stage:
+    FOI = read_foi()
+    FOI = FOI.rename(columns={'NAME': 'Description'})
+    FOI['type'] = 'FOI'
+
+    BPLAN = read_bplan()
+    BPLAN = BPLAN.rename(columns={'Location Code': 'TIPLOC', 'Location name': 'Description'})
+    BPLAN['type'] = 'BPLAN'
+    BPLAN_GB = BPLAN[in_boundary(BPLAN['latitude'], BPLAN['longitude'])]
+
+    NAPTAN = read_frame(find_file('NaPTAN-All'), columns=['TIPLOC', 'AtcoCode', 'Name', 'latitude', 'longitude'])
+    NAPTAN = NAPTAN.rename(columns={'Name': 'Description'})
+    NAPTAN['type'] = 'NaPTAN'
+
+    OSM = read_frame(find_file('OSM-All'), columns=['TIPLOC', 'name', 'latitude', 'longitude'])
+    OSM = OSM.dropna(subset=['TIPLOC'])
+    OSM = OSM.drop_duplicates(subset='TIPLOC')
+    OSM = OSM.rename(columns={'name': 'Description'})
+    OSM['type'] = 'OSM'
+
+    MAP = pd.read_csv('data/TIPLOC-map.tsv', dtype='object', sep='\t')
+    MAP = MAP.dropna(subset=['TIPLOC'])
+    MAP['type'] = 'NaPTAN_MAP'
+    MAP = MAP.join(NAPTAN[['AtcoCode', 'latitude', 'longitude']].set_index('AtcoCode'), on='StopAreaCode')
+    MAP = MAP.rename(columns={'Name': 'Description'})
+
+    WIKIPEDIA = pd.read_csv('data/wikipedia-map.tsv', dtype='object', sep='\t')
+    WIKIPEDIA = WIKIPEDIA.join(from_locationstr(WIKIPEDIA['_location_'])).set_index('TIPLOC')
+
+    OVERLAP = pd.read_csv('data/overlap-map.tsv', dtype='object', sep='\t')
+    OVERLAP = OVERLAP.dropna(subset=['mapped TIPLOC'])
+
+    # Candidate sources in priority order, highest first
+    SOURCES = [WIKIPEDIA.reset_index(), FOI, BPLAN_GB, NAPTAN, OSM, MAP]
+    CANDIDATES = get_candidates(SOURCES)
+    this_stage.rows_in = sum(i.shape[0] for i in SOURCES)
+    this_stage.rows_out = CANDIDATES.shape[0]
+    this_stage.update(CANDIDATES['type'].value_counts())
+
+with stage('resolve') as this_stage:
+    # Each source is fingerprinted on its own so only the TIPLOCs of sources
+    # that changed since the last run are hashed again. BPLAN is fingerprinted
+    # as resolved, the full BPLAN used by the aliases is read every run
+    (FINGERPRINTS, CHANGED) = get_source_fingerprints({'WIKIPEDIA': WIKIPEDIA.reset_index(), 'FOI': FOI, 'BPLAN': BPLAN_GB,
+                                                       'NaPTAN': NAPTAN, 'OSM': OSM, 'NaPTAN_MAP': MAP,
+                                                       'TR': NAMES.reset_index().assign(type='TR'),
+                                                       'overlap': OVERLAP.assign(type='overlap', Description=OVERLAP['mapped TIPLOC'] + '\t' + OVERLAP['Description'])},
+                                                      read_fingerprints(ARGS.fingerprints))
+    PREVIOUS = read_report(ARGS.report)
+
+    # Wikipedia TIPLOCs not in the timetable are kept in the report
+    LOCATIONS = LOCATIONS.reindex(LOCATIONS.index.append(WIKIPEDIA.index.unique().difference(LOCATIONS.index, sort=False)))
+    LOCATIONS.index.name = 'TIPLOC'
+    TIPLOCS = LOCATIONS.index
+    # Without previous fingerprints every TIPLOC is resolved again
+    if ARGS.incremental and CHANGED is not None:
+        UNCHANGED = LOCATIONS.index.intersection(PREVIOUS.index).difference(CHANGED)
+        LOCATIONS.loc[UNCHANGED, COLUMNS] = PREVIOUS.loc[UNCHANGED, COLUMNS]
+        TIPLOCS = TIPLOCS.difference(UNCHANGED)
+        this_stage.count('reused', len(UNCHANGED))
+
+    (RESOLVED, AUDIT) = resolve(TIPLOCS, CANDIDATES[CANDIDATES['TIPLOC'].isin(TIPLOCS)])
+    LOCATIONS.loc[RESOLVED.index, COLUMNS] = RESOLVED
+    this_stage.update(AUDIT.loc[AUDIT['winner'], 'type'].value_counts())
+    if ARGS.incremental:
+        AUDIT = merge_candidates(read_candidates(ARGS.candidates), AUDIT, LOCATIONS.index, TIPLOCS)
+    AUDIT.to_csv(ARGS.candidates, sep='\t', index=False)
+
+    this_stage.rows_in = len(TIPLOCS)
+    this_stage.rows_out = RESOLVED.shape[0]
+    this_stage.count('missing', N - get_found())
+
+with stage('aliases') as this_stage:
+    (LOCATIONS, CYCLES) = resolve_aliases(LOCATIONS, OVERLAP, [('overlapB', BPLAN)])
+    this_stage.rows_in = OVERLAP.shape[0]
+    this_stage.count('cycles', list(CYCLES))
+    this_stage.count('missing', N - get_found())
+
+with stage('consistency') as this_stage:
+    (SPREAD, DISCREPANCIES) = check_sources(CANDIDATES, warning=ARGS.warning, error=ARGS.error)
+    DISCREPANCIES.to_csv(ARGS.discrepancies, sep='\t')
+    this_stage.rows_in = CANDIDATES.shape[0]
+    this_stage.rows_out = DISCREPANCIES.shape[0]
+    this_stage.update(DISCREPANCIES['level'].value_counts())
+
+with stage('report') as this_stage:
+    IDX0 = LOCATIONS[LOCATIONS['Description'].isna()].index
+    LOCATIONS.loc[IDX0, 'Description'] = NAMES['Description'].reindex(IDX0)
+    LOCATIONS['_location_'] = to_locationstr(LOCATIONS['latitude'], LOCATIONS['longitude'])
+    LOCATIONS['spread'] = SPREAD.reindex(LOCATIONS.index).round(1)
+    LOCATIONS = LOCATIONS[['type', '_location_', 'Description', 'latitude', 'longitude', 'spread']]
+    LOCATIONS.fillna('').reset_index().to_csv(ARGS.report, sep='\t', index=False)
+    write_fingerprints(FINGERPRINTS, ARGS.fingerprints)
+    write_index(ARGS.report)
+    write_db(ARGS.report)
+
+    CHANGES = get_changes(PREVIOUS, LOCATIONS)
+    CHANGES.fillna('').to_csv(ARGS.changes, sep='\t')
+    this_stage.rows_out = LOCATIONS.shape[0]
+    this_stage.update(CHANGES['change'].value_counts())
+
+def get_transports(tiplocs, nuuid=4):
+    """get_transports: return a representative headcode for each TIPLOC using
+    one grouped `PATH` query and one `BS` lookup per chunk of TIPLOCs"""
+    UUIDS = {}
+    for search_str in chunk_query('TIPLOC', tiplocs):
+        UUIDS.update(get_group('PATH', 'TIPLOC', search_str=search_str, fl='UUID,TIPLOC', ngroup=nuuid))
+    UUIDS = {k: [i['UUID'] for i in v if 'UUID' in i] for k, v in UUIDS.items()}
+    HEADCODES = {}
+    for i in get_query_in('BS', 'UUID', [j for v in UUIDS.values() for j in v], fl='UUID,Headcode'):
+        if i.get('Headcode'):
+            HEADCODES.setdefault(i['UUID'], i['Headcode'])
+    this_data = {}
+    for tiploc in tiplocs:
+        this_headcode = [HEADCODES[i] for i in UUIDS.get(tiploc, []) if i in HEADCODES]
+        this_data[tiploc] = this_headcode[0] if this_headcode else '____'
+    return pd.Series(this_data, name='Transport', dtype='object')
+
+with stage('missing') as this_stage:
+    MISSING = pd.DataFrame(index=LOCATIONS[LOCATIONS['latitude'].isna()].index)
     try:
-        LOCATIONS.loc[location['TIPLOC'], '_location_'] = LOCATIONS.loc[location['mapped TIPLOC'], '_location_']
-    except KeyError:
-        LOCATIONS.loc[location['TIPLOC'], 'type'] = 'overlapB'
-        LOCATIONS.loc[location['TIPLOC'], '_location_'] = BPLAN.set_index('TIPLOC').loc[location['mapped TIPLOC'], '_location_']
-
-print('TIPLOCs: {} of {}'.format(N - get_found(), N))
-
-IDX0 = LOCATIONS[LOCATIONS['Description'].isna()].index
-LOCATIONS.loc[IDX0, 'Description'] = NAMES.loc[IDX0, 'Description']
-LOCATIONS[['latitude', 'longitude']] = LOCATIONS['_location_'].str.split(',', expand=True).fillna('')
-LOCATIONS.fillna('').reset_index().to_csv('locations-report.tsv', sep='\t', index=False)
-
-def get_transport(tiploc):
-    UUIDS = get_query('PATH', search_str='TIPLOC:{}'.format(tiploc), fl='UUID')
-    search_str = ' OR '.join(['UUID:{}'.format(i['UUID']) for i in UUIDS[:4]])
-    this_type = set([i['Headcode'] for i in get_query('BS', search_str, fl='Headcode', nrows=4) if i])
-    if this_type:
-        return this_type.pop()
-    return '____'
-
-MISSING = pd.DataFrame(index=LOCATIONS[LOCATIONS['_location_'].isna()].index)
-try:
-    TRANSPORT.empty
-except NameError:
-    TRANSPORT = pd.Series([get_transport(i) for i in MISSING.index], index=MISSING.index, name='Transport')
-
-q = ' OR '.join(['TIPLOC:{}'.format(i) for i in list(MISSING.index)])
-DF5 = pd.DataFrame(get_query('TR', q))
-DF5 = DF5.set_index('TIPLOC').drop(columns=['_version_'])
-MISSING = DF5.join(pd.Series(COUNTS, name='count')).fillna('')
-MISSING = MISSING.join(TRANSPORT).sort_values('count', ascending=False)
-MISSING['k'] = pd.Series(MISSING.index, index=MISSING.index).str[:4]
-MISSING.to_csv('missing-report.tsv', sep='\t')
-
-print(MISSING['count'].sum() / sum(COUNTS.values()))
+        TRANSPORT.empty
+    except NameError:
+        TRANSPORT = get_transports(list(MISSING.index)).reindex(MISSING.index)
+
+    DF5 = pd.DataFrame(get_query_in('TR', 'TIPLOC', list(MISSING.index)))
+    DF5 = DF5.set_index('TIPLOC').drop(columns=['_version_'], errors='ignore')
+    MISSING = DF5.join(pd.Series(COUNTS, name='count')).fillna('')
+    MISSING = MISSING.join(TRANSPORT).sort_values('count', ascending=False)
+    MISSING['k'] = pd.Series(MISSING.index, index=MISSING.index).str[:4]
+    MISSING.to_csv('missing-report.tsv', sep='\t')
+
+    this_stage.rows_out = MISSING.shape[0]
+    this_stage.count('missing_share', MISSING['count'].sum() / sum(COUNTS.values()))
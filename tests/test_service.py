@@ -0,0 +1,42 @@
+import json
+import pandas as pd
+from app.service import LocationService
+
+def write_report(filename, latitude):
+    this_df = pd.DataFrame({'TIPLOC': ['EUSTON', 'KNGX'], 'type': ['FOI', 'OSM'],
+                            'Description': ['Euston', 'Kings Cross'],
+                            'latitude': [latitude, 51.53], 'longitude': [-0.13, -0.12]})
+    this_df.to_csv(filename, sep='\t', index=False)
+
+def get_latitude(service):
+    (_, body) = service.get_response('/tiploc/EUSTON', '')
+    return json.loads(body)['geometry']['coordinates'][1]
+
+def test_reload_closes_snapshots(tmp_path):
+    report = str(tmp_path / 'locations-report.tsv')
+    write_report(report, 51.0)
+    service = LocationService(report)
+    snapshots = [service.snapshot]
+    for n in range(1, 6):
+        write_report(report, 51.0 + n)
+        assert service.reload(force=True)
+        snapshots.append(service.snapshot)
+        assert get_latitude(service) == 51.0 + n
+    assert all(i.db.mm.closed for i in snapshots[:-1])
+    assert not snapshots[-1].db.mm.closed
+    assert not service.readers
+    service.close()
+
+def test_reload_keeps_snapshot_in_use(tmp_path):
+    report = str(tmp_path / 'locations-report.tsv')
+    write_report(report, 51.0)
+    service = LocationService(report)
+    with service.reading() as snapshot:
+        for n in range(1, 4):
+            write_report(report, 51.0 + n)
+            service.reload(force=True)
+        assert not snapshot.db.mm.closed
+        assert snapshot.db.get('EUSTON').latitude == 51.0
+    assert snapshot.db.mm.closed
+    assert get_latitude(service) == 54.0
+    service.close()
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from app.tiplocdb import TiplocDB, compile_index
+
+def get_db(tmp_path):
+    locations = pd.DataFrame({'type': ['FOI', 'OSM'], 'Description': ['Seven', 'Kings Cross'],
+                              'latitude': [51.5, 51.53], 'longitude': [-0.1, -0.12]},
+                             index=pd.Index(['ABCDEFG', 'KNGX'], name='TIPLOC'))
+    filename = str(tmp_path / 'locations-report.idx')
+    compile_index(locations, filename)
+    return TiplocDB(filename)
+
+def test_lookup(tmp_path):
+    with get_db(tmp_path) as db:
+        assert db.get('ABCDEFG').Description == 'Seven'
+        assert db.get('KNGX').latitude == 51.53
+        assert db.get('EUSTON') is None
+
+def test_long_key(tmp_path):
+    with get_db(tmp_path) as db:
+        assert db.lookup(['ABCDEFGH', 'ABCDEFG']) == [None, db.get('ABCDEFG')]
+        assert 'ABCDEFGXYZ' not in db
+        assert db.find(['ABCDEFGH']).tolist() == [-1]
+
+def test_close_with_copies(tmp_path):
+    db = get_db(tmp_path)
+    (keys, records) = (db.keys, db.records)
+    db.close()
+    assert keys.astype(str).tolist() == ['ABCDEFG', 'KNGX']
+    assert not np.isnan(records['latitude']).any()